@@ -0,0 +1,387 @@
+"""قياس أداء نظام حضور الطلاب بدون واجهة على بيانات صناعية بأحجام مختلفة
+
+يولد ملف بيانات (مجموعات وطلاب وتاريخ حضور طويل) وصور كاميرا صناعية بها QR، ثم يقيس زمن
+وذاكرة تحميل البيانات وحفظها وتسجيل الحضور والبحث وقراءة QR بنفس دوال الواجهة، ويكتب النتائج
+في ملف JSON يمكن مقارنته بنتائج سابقة لاكتشاف أي تراجع في الأداء قبل النشر.
+
+أمثلة:
+    python benchmark.py
+    python benchmark.py --preset full --backend excel --backend sqlite --output results.json
+    python benchmark.py --scale 100x50000:60 --baseline results.json
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageFilter
+
+try:
+    import resource
+except ImportError:
+    # على ويندوز لا يتوفر resource، ويُكتفى بقياس tracemalloc
+    resource = None
+
+import streamlit.logger
+from streamlit import config as streamlit_config
+
+import main
+
+# رسائل Streamlit عن التشغيل بدون واجهة لا تهم هنا. قراءة الإعدادات أولاً لأنها تعيد ضبط مستوى الرسائل عند أول قراءة
+streamlit_config.get_option('logger.level')
+streamlit.logger.set_log_level('error')
+
+# أحجام البيانات (مجموعات x طلاب: حصص لكل مجموعة) في كل مجموعة قياسات جاهزة
+PRESETS = {
+    'quick': ['10x100:20', '10x1000:40'],
+    'full': ['10x100:20', '20x5000:40', '50x20000:60', '100x50000:80']
+}
+# نسبة الزيادة في الزمن (أو الذاكرة) عن النتائج السابقة التي تعتبر تراجعاً
+DEFAULT_TOLERANCE = 0.25
+# فرق الزمن الوسيط الذي يعتبر أقل منه ضوضاء قياس حتى لو تجاوزت النسبة الحد (للعمليات التي تأخذ أجزاء من الملي ثانية)
+MIN_REGRESSION_MS = 1.0
+# عدد المسحات في مجموعة واحدة قبل قياس الحفظ التدريجي
+SAVE_INCREMENTAL_SCANS = 20
+# مقاس إطار الكاميرا الصناعي الذي يوضع عليه QR
+QR_FRAME_SIZE = (1280, 720)
+
+
+def parse_scale(text):
+    """تحويل '20x5000:40' إلى (عدد المجموعات، عدد الطلاب، عدد الحصص لكل مجموعة)"""
+    size, _, history = text.partition(':')
+    groups, _, students = size.lower().partition('x')
+    return int(groups), int(students), int(history or 40)
+
+
+def peak_rss_mb():
+    """أعلى استهلاك لذاكرة العملية حتى الآن بالميجابايت، أو None إذا لم يكن متاحاً"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # لينكس يرجع الكيلوبايت وماك يرجع البايت
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Recorder:
+    """تسجيل زمن كل عملية وذاكرتها في قائمة نتائج بنفس الصيغة لكل الأحجام"""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.results = []
+
+    def measure(self, scenario, operation, function, repeat=1, **extra):
+        """تشغيل الدالة repeat مرة وتسجيل زمن كل مرة، وإرجاع نتيجة آخر تشغيل"""
+        if self.trace_memory:
+            tracemalloc.start()
+        durations = []
+        value = None
+        # رسائل النظام (مثل "تم حفظ البيانات") لا تطبع في نتائج القياس ولا تدخل في زمنه
+        with redirect_stdout(StringIO()):
+            for _ in range(repeat):
+                started = time.perf_counter()
+                value = function()
+                durations.append((time.perf_counter() - started) * 1000)
+        traced_peak = None
+        if self.trace_memory:
+            traced_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+            tracemalloc.stop()
+
+        durations = np.array(durations)
+        record = dict(
+            scenario,
+            operation=operation,
+            runs=repeat,
+            total_ms=round(float(durations.sum()), 3),
+            p50_ms=round(float(np.percentile(durations, 50)), 3),
+            p95_ms=round(float(np.percentile(durations, 95)), 3),
+            max_ms=round(float(durations.max()), 3),
+            peak_rss_mb=peak_rss_mb(),
+            traced_peak_mb=traced_peak,
+            **extra
+        )
+        self.results.append(record)
+        print(f"  {operation:<22} p50 {record['p50_ms']:>10.2f} ms   p95 {record['p95_ms']:>10.2f} ms   ({repeat} مرة)")
+        return value
+
+
+def synthetic_groups(months, group_count, student_count, sessions, rng):
+    """مجموعات صناعية بأعمدة الملف الكاملة، ولكل مجموعة حصص موزعة على السنة الدراسية"""
+    columns = main.build_required_columns(months)
+    first_month, first_year = main.parse_month_column(months[0])
+    year_start = date(first_year, first_month, 1)
+    groups = {}
+
+    for group_number, codes in enumerate(np.array_split(np.arange(student_count), group_count)):
+        size = len(codes)
+        # حصص المجموعة على مدار السنة، وكل طالب يحضر حوالي 80% منها بعد تسجيله
+        session_days = [year_start + timedelta(days=int(day)) for day in np.linspace(group_number % 7, 364, sessions)]
+        session_text = np.array([day.isoformat() for day in session_days], dtype=object)
+        registered = rng.integers(0, 60, size)
+        attended = (rng.random((size, sessions)) < 0.8) & (
+            np.array([(day - year_start).days for day in session_days])[None, :] >= registered[:, None]
+        )
+
+        frame = pd.DataFrame({
+            'الكود': [f"S{code:06d}" for code in codes],
+            'الاسم': [f"طالب {code} {main.ARABIC_MONTH_NAMES[code % 12]}" for code in codes],
+            'رقم_الهاتف': [f"010{code:08d}" for code in codes],
+            'ولي_الامر': [f"011{code:08d}" for code in codes],
+            'الحصص_الحاضرة': attended.sum(axis=1),
+            'تواريخ_الحضور': ['; '.join(session_text[row]) for row in attended],
+            'تاريخ_التسجيل': [year_start + timedelta(days=int(day)) for day in registered],
+            'ملاحظات': np.where(rng.random(size) < 0.1, 'ملاحظة للمتابعة', ''),
+            'الاختبارات': np.where(rng.random(size) < 0.3, f"شهر 1: 15/20 ({session_text[0]})", '')
+        })
+        for month, paid in zip(months, (rng.random((len(months), size)) < 0.6)):
+            frame[month] = paid
+        groups[f"مجموعة_{group_number + 1}"] = frame[columns]
+    return groups
+
+
+def synthetic_qr_frames(codes, count, rng):
+    """صور كاميرا صناعية: QR بحجم وموضع عشوائيين على خلفية بها تشويش مع تمويه خفيف"""
+    frames = []
+    width, height = QR_FRAME_SIZE
+    for code in rng.choice(codes, size=count):
+        qr = Image.open(BytesIO(main.render_qr_png(str(code)))).convert('L')
+        side = int(rng.integers(140, 360))
+        qr = qr.resize((side, side), Image.NEAREST)
+
+        background = rng.normal(170, 25, (height, width)).clip(0, 255).astype(np.uint8)
+        frame = Image.fromarray(background, 'L')
+        frame.paste(qr, (int(rng.integers(0, width - side)), int(rng.integers(0, height - side))))
+        frame = frame.filter(ImageFilter.GaussianBlur(radius=float(rng.uniform(0, 1.2)))).convert('RGB')
+        frames.append((str(code), frame))
+    return frames
+
+
+def make_system(backend, path, months):
+    """نسخة من النظام بدون واجهة تستخدم نفس دوال التحميل والحفظ والمسح والبحث، بدون أي بيانات محملة"""
+    main._shared_save_worker.clear()
+    main._shared_storage.clear()
+    system = main.StudentAttendanceSystem.__new__(main.StudentAttendanceSystem)
+    system.excel_path = path
+    system.current_group = None
+    system.months = list(months)
+    storage_key = (backend, path, tuple(months))
+    system.storage = main._shared_storage(*storage_key)
+    system.saver = main._shared_save_worker(*storage_key)
+    # الحفظ بالخلفية لا يعمل أثناء القياس حتى لا يختلط زمنه بزمن المسح، ويقاس وحده في save_incremental
+    system.saver.interval = 3600
+    system.sheets = None
+    # مقاييس منفصلة بدون تصدير حتى لا تكتب القياسات في ملفات البرنامج
+    system.metrics = main.HotPathMetrics(prometheus_path='', log_path='')
+    return system
+
+
+def close_system(system):
+    """إيقاف عامل الحفظ بالخلفية قبل حذف ملفات القياس حتى لا يحاول الحفظ عند الخروج"""
+    with redirect_stdout(StringIO()):
+        system.saver.shutdown()
+    atexit.unregister(system.saver.shutdown)
+
+
+def dirty_group_count(storage):
+    """عدد المجموعات التي سيكتبها الحفظ التدريجي، أو None للتخزين الذي يحفظ كل تعديل عند حدوثه"""
+    if not hasattr(storage, 'dirty_groups'):
+        return None
+    with storage.lock:
+        return len(storage.dirty_groups | storage.journal.pending_groups)
+
+
+def run_scale(recorder, backend, scale, args, work_dir):
+    group_count, student_count, sessions = scale
+    scenario = {'backend': backend, 'groups': group_count, 'students': student_count, 'sessions': sessions}
+    name = f"{backend} {group_count}x{student_count}:{sessions}"
+    print(f"== {name}")
+
+    rng = np.random.default_rng(args.seed)
+    months = main.academic_months()
+    path = os.path.join(work_dir, f"students_{backend}.{'db' if backend == 'sqlite' else 'xlsx'}")
+    groups = synthetic_groups(months, group_count, student_count, sessions, rng)
+
+    system = make_system(backend, path, months)
+    recorder.measure(scenario, 'write_initial', lambda: system.storage.initialize(groups))
+    close_system(system)
+    del groups
+    file_bytes = os.path.getsize(path)
+
+    # تحميل بارد من الملف في طريقة تخزين جديدة، ثم تحميل دافئ يلحق بالتعديلات فقط
+    system = make_system(backend, path, months)
+    recorder.measure(scenario, 'load_cold', system.load_data, file_bytes=file_bytes)
+    recorder.measure(scenario, 'load_warm', system.load_data, repeat=5)
+    memory = system.storage.memory_report()
+    recorder.results[-1]['data_bytes'] = int(memory['الإجمالي'].sum())
+
+    codes = np.concatenate([df['الكود'].astype(str).to_numpy(dtype=object) for df in system.groups_df.values()])
+    system.current_group = next(iter(system.groups_df))
+    group_codes = system.groups_df[system.current_group]['الكود'].astype(str).tolist()
+    group_names = system.groups_df[system.current_group]['الاسم'].astype(str).tolist()
+
+    # تسجيل الحضور بنفس مسار المسح في الواجهة، وكل مسح صورة جديدة حتى لا يعتبر تكراراً
+    placeholder = main.st.empty()
+    scan_codes = iter(rng.choice(codes, size=args.scans))
+    scan_number = iter(range(args.scans))
+
+    def scan():
+        main.st.session_state.last_processed_image = next(scan_number)
+        system.process_student_attendance(str(next(scan_codes)), placeholder)
+
+    recorder.measure(scenario, 'process_attendance', scan, repeat=args.scans)
+    # المسح السابق عدل كل المجموعات، لذلك الحفظ الكامل يكتبها كلها ثم تعدل مجموعة واحدة للحفظ التدريجي
+    recorder.measure(scenario, 'save_full', lambda: system.save_data(full=True, wait=True), file_bytes=os.path.getsize(path))
+    with redirect_stdout(StringIO()):
+        for number, code in enumerate(rng.choice(group_codes, size=SAVE_INCREMENTAL_SCANS)):
+            main.st.session_state.last_processed_image = args.scans + number
+            system.process_student_attendance(str(code), placeholder)
+    recorder.measure(scenario, 'save_incremental', lambda: system.save_data(wait=True), dirty_groups=dirty_group_count(system.storage))
+
+    # أول بحث يبني الفهرس، والبحث بعده على الفهرس المبني
+    recorder.measure(scenario, 'search_index_build', lambda: system.search_students(group_names[0][:4], 'name'))
+    name_queries = iter(rng.choice(group_names, size=args.searches))
+    code_queries = iter(rng.choice(group_codes, size=args.searches))
+    recorder.measure(scenario, 'search_name', lambda: system.search_students(next(name_queries)[:6], 'name'), repeat=args.searches)
+    recorder.measure(scenario, 'search_code', lambda: system.search_students(next(code_queries)[:5], 'code'), repeat=args.searches)
+
+    recorder.measure(scenario, 'report_query', lambda: system.storage.reports.query(absent_sessions=3))
+    close_system(system)
+
+
+def run_qr(recorder, args):
+    """قياس قراءة QR على صور كاميرا صناعية بنفس محرك المسح المستخدم في الواجهة"""
+    print(f"== QR ({args.qr_images} صورة)")
+    rng = np.random.default_rng(args.seed)
+    codes = [f"S{code:06d}" for code in range(1000)]
+    frames = iter(synthetic_qr_frames(codes, args.qr_images, rng))
+    scanner = main.QRScanner()
+    correct = []
+
+    def decode():
+        code, frame = next(frames)
+        result = scanner.decode(frame)
+        correct.append(code in result['codes'])
+
+    scenario = {'backend': None, 'groups': None, 'students': None, 'sessions': None}
+    recorder.measure(scenario, 'qr_decode', decode, repeat=args.qr_images, frame_size=list(QR_FRAME_SIZE))
+    recorder.results[-1]['accuracy'] = round(float(np.mean(correct)), 3)
+    stages = pd.Series([scan['stage'] for scan in scanner.recent_scans]).value_counts(dropna=False)
+    recorder.results[-1]['stages'] = {str(stage): int(count) for stage, count in stages.items()}
+
+
+def result_key(record):
+    return record['backend'], record['groups'], record['students'], record['sessions'], record['operation']
+
+
+def compare(results, baseline_path, tolerance):
+    """مقارنة الزمن الوسيط لكل عملية بالنتائج السابقة وإرجاع قائمة العمليات التي تراجعت"""
+    with open(baseline_path, encoding='utf-8') as baseline_file:
+        baseline = {result_key(record): record for record in json.load(baseline_file)['results']}
+
+    regressions = []
+    print(f"== مقارنة بـ {baseline_path}")
+    for record in results:
+        old = baseline.get(result_key(record))
+        if old is None or not old['p50_ms']:
+            continue
+        ratio = record['p50_ms'] / old['p50_ms']
+        flag = ''
+        if ratio > 1 + tolerance and record['p50_ms'] - old['p50_ms'] >= MIN_REGRESSION_MS:
+            flag = '  <-- تراجع'
+            regressions.append(dict(record, baseline_p50_ms=old['p50_ms'], ratio=round(ratio, 2)))
+        label = f"{record['backend']} {record['groups']}x{record['students']}" if record['backend'] else 'QR'
+        print(f"  {label:<20} {record['operation']:<22} {old['p50_ms']:>10.2f} -> {record['p50_ms']:>10.2f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="قياس أداء التحميل والحفظ والمسح والبحث وقراءة QR على بيانات صناعية")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick', help="مجموعة أحجام جاهزة (الافتراضي quick)")
+    parser.add_argument('--scale', action='append', help="حجم إضافي بصيغة مجموعاتxطلاب:حصص مثل 100x50000:80، ويلغي preset")
+    parser.add_argument('--backend', action='append', choices=['excel', 'sqlite'], help="طريقة التخزين (الافتراضي excel)")
+    parser.add_argument('--scans', type=int, default=200, help="عدد عمليات تسجيل الحضور لكل حجم")
+    parser.add_argument('--searches', type=int, default=200, help="عدد عمليات البحث لكل نوع")
+    parser.add_argument('--qr-images', type=int, default=30, help="عدد صور QR الصناعية (0 لتخطي قياس QR)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true', help="قياس أعلى ذاكرة Python لكل عملية (يبطئ القياس)")
+    parser.add_argument('--output', default='benchmark_results.json', help="ملف JSON للنتائج")
+    parser.add_argument('--baseline', help="ملف نتائج سابق للمقارنة، ويرجع البرنامج 1 عند وجود تراجع")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="نسبة الزيادة المسموحة في الزمن الوسيط")
+    parser.add_argument('--keep', action='store_true', help="الإبقاء على مجلد الملفات الصناعية بعد القياس")
+    args = parser.parse_args(argv)
+
+    scales = [parse_scale(text) for text in (args.scale or PRESETS[args.preset])]
+    backends = args.backend or ['excel']
+    recorder = Recorder(trace_memory=args.trace_memory)
+
+    work_dir = tempfile.mkdtemp(prefix='students_benchmark_')
+    previous_dir = os.getcwd()
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    started = time.perf_counter()
+    try:
+        os.chdir(work_dir)
+        for backend in backends:
+            for scale in scales:
+                scale_dir = os.path.join(work_dir, f"{backend}_{scale[0]}x{scale[1]}")
+                os.makedirs(scale_dir)
+                os.chdir(scale_dir)
+                run_scale(recorder, backend, scale, args, scale_dir)
+        if args.qr_images:
+            run_qr(recorder, args)
+    finally:
+        os.chdir(previous_dir)
+        if args.keep:
+            print(f"الملفات الصناعية في {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'pyarrow': main.pa.__version__ if main.pa is not None else None,
+            'arguments': vars(args),
+            'duration_s': round(time.perf_counter() - started, 1)
+        },
+        'results': recorder.results
+    }
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, ensure_ascii=False, indent=2)
+    print(f"تم حفظ النتائج في {output_path}")
+
+    if baseline_path:
+        regressions = compare(recorder.results, baseline_path, args.tolerance)
+        if regressions:
+            print(f"عدد العمليات التي تراجع أداؤها: {len(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
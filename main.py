@@ -1,105 +1,3990 @@
 import streamlit as st
 import pandas as pd
 import os
-from datetime import date
-from PIL import Image
+from datetime import date, timedelta
+from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 import cv2
 import qrcode
 from io import BytesIO
 import time
 import plotly.express as px
+import tempfile
+import json
+import threading
+import atexit
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime
+import sqlite3
+import re
+import heapq
+import hashlib
+import zipfile
+import shutil
+from collections import OrderedDict, defaultdict, deque
+from itertools import repeat
+from array import array
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils.dataframe import dataframe_to_rows
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # التصدير بصيغة Parquet اختياري ويحتاج مكتبة pyarrow
+    pa = pq = None
+
+try:
+    import gspread
+except ImportError:
+    # مزامنة Google Sheets اختيارية وتحتاج مكتبة gspread
+    gspread = None
+
+try:
+    import fcntl
+except ImportError:
+    # على ويندوز يستخدم قفل msvcrt بدلاً من fcntl
+    fcntl = None
+    import msvcrt
+
+
+def _file_signature(path):
+    """بصمة الملف (وقت التعديل والحجم ورقم الملف) لمعرفة هل تغير منذ آخر قراءة"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class InterProcessLock:
+    """قفل على ملف بجانب البيانات يمنع أكثر من عملية (وأكثر من خيط) من التعديل في نفس الوقت
+
+    يمكن أخذه أكثر من مرة داخل نفس الخيط، ويُقفل الملف على مستوى النظام عند أول أخذ فقط
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        # عدد مرات أخذ القفل داخل الخيط الحالي
+        self.depth = 0
+        self.lock_file = None
+    
+    def acquire(self):
+        self.thread_lock.acquire()
+        try:
+            if self.depth == 0:
+                lock_file = open(self.path, 'a+b')
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                    else:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                except BaseException:
+                    lock_file.close()
+                    raise
+                self.lock_file = lock_file
+            self.depth += 1
+        except BaseException:
+            self.thread_lock.release()
+            raise
+        return True
+    
+    def release(self):
+        self.depth -= 1
+        try:
+            if self.depth == 0:
+                lock_file, self.lock_file = self.lock_file, None
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                    else:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                finally:
+                    lock_file.close()
+        finally:
+            self.thread_lock.release()
+    
+    def __enter__(self):
+        return self.acquire()
+    
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+# اسم الورقة المخفية التي تحفظ آخر حدث تم دمجه في ملف الإكسل
+META_SHEET_NAME = "__meta__"
+# اسم الورقة المخفية التي تحفظ أيام حصص كل مجموعة في ملف الإكسل
+SESSIONS_SHEET_NAME = "__sessions__"
+# عدد أحداث الحضور غير المدمجة التي يتم بعدها دمج السجل تلقائياً في ملف الإكسل
+JOURNAL_COMPACT_EVERY = 50
+# عدد آخر التعديلات التي تبقى في السجل بعد الدمج حتى تلحق بها العمليات الأخرى بدون إعادة قراءة كل البيانات
+JOURNAL_RETAIN_EVENTS = 1000
+# طريقة تخزين البيانات: "excel" (الافتراضي) أو "sqlite"
+STORAGE_BACKEND = os.environ.get("STUDENTS_STORAGE_BACKEND", "excel")
+
+
+# أسماء الأشهر كما تظهر في أعمدة الدفع (يناير = 1)
+ARABIC_MONTH_NAMES = [
+    'يناير', 'فبراير', 'مارس', 'أبريل', 'مايو', 'يونيو',
+    'يوليو', 'أغسطس', 'سبتمبر', 'أكتوبر', 'نوفمبر', 'ديسمبر'
+]
+# الشهر الذي تبدأ به السنة الدراسية (الافتراضي يوليو)
+ACADEMIC_YEAR_START_MONTH = int(os.environ.get("STUDENTS_ACADEMIC_YEAR_START_MONTH", 7))
+# اسم مجلد أرشيف السنوات الدراسية السابقة بجانب ملف البيانات
+ARCHIVE_DIR_NAME = "archive"
+# سجل كل عمليات الأرشفة (سطر JSON لكل عملية) داخل مجلد الأرشيف
+ARCHIVE_LOG_NAME = "archive_log.jsonl"
+
+
+def academic_year_of(day, start_month=ACADEMIC_YEAR_START_MONTH):
+    """سنة بداية السنة الدراسية التي يقع فيها اليوم (سبتمبر 2025 و مارس 2026 كلاهما 2025)"""
+    return day.year if day.month >= start_month else day.year - 1
+
+
+# السنة الدراسية النشطة (سنة بدايتها)، وتغييرها لا ينقل شيئاً للأرشيف إلا بزر الأرشفة في تبويب الإحصائيات
+ACADEMIC_YEAR = int(os.environ.get("STUDENTS_ACADEMIC_YEAR", 2025))
+
+
+def academic_months(start_year=ACADEMIC_YEAR, start_month=ACADEMIC_YEAR_START_MONTH):
+    """أعمدة الدفع الاثني عشر لسنة دراسية، مثل ['يوليو_2025', ... 'يونيو_2026']"""
+    months = []
+    for offset in range(12):
+        month_index = start_month - 1 + offset
+        months.append(f"{ARABIC_MONTH_NAMES[month_index % 12]}_{start_year + month_index // 12}")
+    return months
+
+
+def parse_month_column(column):
+    """(رقم الشهر، السنة) لعمود دفع مثل 'يوليو_2025'، أو None إذا لم يكن عمود شهر"""
+    name, _, year = str(column).rpartition('_')
+    if name not in ARABIC_MONTH_NAMES or not year.isdigit():
+        return None
+    return ARABIC_MONTH_NAMES.index(name) + 1, int(year)
+
+
+def past_month_columns(columns, months):
+    """أعمدة الدفع الخاصة بسنوات دراسية أقدم من السنة التي تبدأ بأول عمود في months"""
+    first_month, first_year = parse_month_column(months[0])
+    past_columns = []
+    for column in columns:
+        parsed = parse_month_column(column)
+        if parsed and column not in months and (parsed[1], parsed[0]) < (first_year, first_month):
+            past_columns.append(column)
+    return past_columns
+
+
+def _json_default(value):
+    """تحويل قيم numpy والتواريخ داخل التعديلات لقيم يمكن كتابتها في JSON"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+class ChangeJournal:
+    """سجل إلحاقي (JSONL) لكل التعديلات (حضور، دفع، اختبارات، طلاب ومجموعات) يُكتب فيه كل تعديل بتكلفة ثابتة
+
+    كل حدث له رقم تسلسلي هو رقم إصدار البيانات، وملف الإكسل يحفظ رقم آخر حدث تم دمجه فيه،
+    لذلك يمكن إعادة تطبيق الأحداث الأحدث فقط عند بدء التشغيل بعد أي توقف مفاجئ،
+    وكل عملية أخرى تستخدم نفس الملف تلحق بالتعديلات الجديدة بقراءة السجل فقط
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        # موضع القراءة في الملف حتى آخر حدث تم تطبيقه على البيانات في الذاكرة
+        self.offset = 0
+        # رقم نسخة السجل من أول سطر فيه، ويتغير كلما أعادت عملية كتابته بعد الدمج
+        self.generation = None
+        # آخر رقم تسلسلي تم تطبيقه على البيانات في الذاكرة
+        self.applied_seq = 0
+        # آخر رقم تسلسلي تم دمجه في ملف الإكسل
+        self.compacted_seq = 0
+        # المجموعات التي بها أحداث مطبقة في الذاكرة ولم تدمج بعد
+        self.pending_groups = set()
+    
+    @property
+    def pending_count(self):
+        """عدد الأحداث التي لم تدمج بعد في ملف الإكسل"""
+        return max(0, self.applied_seq - self.compacted_seq)
+    
+    def reset(self, compacted_seq):
+        """البدء من جديد بعد قراءة ملف الإكسل من القرص"""
+        with self.lock:
+            self.offset = 0
+            self.applied_seq = compacted_seq
+            self.compacted_seq = compacted_seq
+            self.pending_groups = set()
+    
+    def read_new_events(self):
+        """قراءة الأحداث المكتوبة بعد آخر موضع قراءة وتجاهل السطر الأخير غير المكتمل"""
+        with self.lock:
+            if not os.path.exists(self.path):
+                self.offset = 0
+                return []
+            
+            with open(self.path, 'rb') as journal_file:
+                generation = self.read_generation(journal_file)
+                if generation != self.generation or os.fstat(journal_file.fileno()).st_size < self.offset:
+                    # عملية أخرى أعادت كتابة السجل بعد الدمج، والأرقام التسلسلية تمنع تكرار التطبيق
+                    self.offset = 0
+                    self.generation = generation
+                journal_file.seek(self.offset)
+                data = journal_file.read()
+            
+            events = []
+            consumed = 0
+            for line in data.splitlines(keepends=True):
+                if not line.endswith(b'\n'):
+                    break
+                consumed += len(line)
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('seq', 0) > self.applied_seq:
+                    events.append(event)
+            
+            self.offset += consumed
+            return events
+    
+    @staticmethod
+    def read_generation(journal_file):
+        """رقم نسخة السجل من سطره الأول، أو None لسجل لم يُعد كتابته بعد"""
+        try:
+            return json.loads(journal_file.readline()).get('generation')
+        except ValueError:
+            return None
+    
+    def extend(self, changes):
+        """إضافة عدة تعديلات (قواميس بها op و group) للسجل بكتابة واحدة على القرص
+
+        تستدعى والقفل بين العمليات مأخوذ وبعد قراءة كل الأحداث الجديدة، لذلك الرقم التالي لا يتكرر
+        """
+        with self.lock:
+            timestamp = datetime.now().isoformat(timespec='seconds')
+            events = [
+                dict(change, seq=self.applied_seq + position, ts=timestamp)
+                for position, change in enumerate(changes, 1)
+            ]
+            data = b''.join(
+                (json.dumps(event, ensure_ascii=False, default=_json_default) + '\n').encode('utf-8')
+                for event in events
+            )
+            
+            with open(self.path, 'ab') as journal_file:
+                if os.fstat(journal_file.fileno()).st_size > self.offset:
+                    # حذف سطر غير مكتمل تركته عملية توقفت أثناء الكتابة
+                    journal_file.truncate(self.offset)
+                journal_file.write(data)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            
+            self.offset += len(data)
+            return events
+    
+    def mark_applied(self, event):
+        """تسجيل أن الحدث تم تطبيقه على البيانات في الذاكرة"""
+        with self.lock:
+            self.applied_seq = max(self.applied_seq, event['seq'])
+            if 'group' in event:
+                self.pending_groups.add(event['group'])
+    
+    def mark_compacted(self, seq):
+        """تسجيل أن عملية أخرى دمجت الأحداث حتى seq في ملف الإكسل"""
+        with self.lock:
+            self.compacted_seq = max(self.compacted_seq, seq)
+    
+    def discard_through(self, seq):
+        """حذف الأحداث المدمجة في ملف الإكسل من السجل مع إبقاء آخرها لتلحق بها العمليات الأخرى"""
+        with self.lock:
+            self.compacted_seq = seq
+            self.pending_groups = set()
+            if not os.path.exists(self.path):
+                self.offset = 0
+                return
+            
+            with open(self.path, 'rb') as journal_file:
+                lines = journal_file.readlines()
+            
+            # أول سطر رقم نسخة جديد حتى تعرف العمليات الأخرى أن مواضع القراءة القديمة لم تعد صالحة
+            self.generation = os.urandom(8).hex()
+            remaining = [(json.dumps({'generation': self.generation}) + '\n').encode('utf-8')]
+            for line in lines:
+                if not line.endswith(b'\n'):
+                    continue
+                try:
+                    if json.loads(line).get('seq', 0) > seq - JOURNAL_RETAIN_EVENTS:
+                        remaining.append(line)
+                except ValueError:
+                    continue
+            
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'wb') as journal_file:
+                journal_file.writelines(remaining)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            os.replace(temp_path, self.path)
+            self.offset = sum(len(line) for line in remaining)
+
+
+def build_required_columns(months):
+    """ترتيب أعمدة جدول المجموعة المعتمد في النظام"""
+    return [
+        'الكود', 'الاسم', 'رقم_الهاتف', 'ولي_الامر', 'الحصص_الحاضرة'
+    ] + list(months) + [
+        'تواريخ_الحضور', 'تاريخ_التسجيل', 'ملاحظات', 'الاختبارات'
+    ]
+
+
+# عمود الدفع في الجدول المضغوط: البت رقم i يعني أن الشهر رقم i في السنة الدراسية مدفوع
+PAYMENTS_COLUMN = 'الدفع'
+# النصوص تحفظ بصيغة Arrow المضغوطة عند توفر pyarrow بدلاً من كائنات Python
+STRING_DTYPE = 'string[pyarrow]' if pa is not None else object
+# أعمدة وأنواع جدول المجموعة في الذاكرة، والملاحظات وتواريخ الحضور والاختبارات تحفظ خارجه
+FRAME_DTYPES = {
+    'الكود': STRING_DTYPE,
+    'الاسم': STRING_DTYPE,
+    'رقم_الهاتف': STRING_DTYPE,
+    'ولي_الامر': STRING_DTYPE,
+    'الحصص_الحاضرة': np.int32,
+    PAYMENTS_COLUMN: np.int16,
+    # تواريخ التسجيل تتكرر كثيراً لذلك تحفظ كفئات
+    'تاريخ_التسجيل': 'category'
+}
+FRAME_COLUMNS = list(FRAME_DTYPES)
+
+
+def payments_mask(paid_columns):
+    """رقم دفع واحد لكل طالب من أعمدة الأشهر المنطقية (بترتيب أشهر السنة)"""
+    mask = np.zeros(len(paid_columns), dtype=np.int16)
+    for bit, month in enumerate(paid_columns.columns):
+        mask |= paid_columns[month].to_numpy(dtype=bool).astype(np.int16) << bit
+    return mask
+
+
+def month_flags(masks, month_count):
+    """مصفوفة منطقية (طالب × شهر) من أرقام الدفع"""
+    masks = np.asarray(masks, dtype=np.int16).reshape(-1, 1)
+    return ((masks >> np.arange(month_count, dtype=np.int16)) & 1).astype(bool)
+
+
+def paid_months(mask, months):
+    """أسماء الأشهر المدفوعة في رقم دفع طالب واحد"""
+    return [month for bit, month in enumerate(months) if int(mask) >> bit & 1]
+
+
+def compact_group_frame(df, months):
+    """الجدول المضغوط الذي يبقى في الذاكرة من جدول مجموعة بأعمدة الملف الكاملة"""
+    frame = pd.DataFrame({column: df[column] for column in FRAME_COLUMNS if column != PAYMENTS_COLUMN}, index=df.index)
+    frame[PAYMENTS_COLUMN] = payments_mask(df[list(months)])
+    return frame[FRAME_COLUMNS].astype(FRAME_DTYPES)
+
+
+def empty_group_frame():
+    """جدول مجموعة جديدة فارغة بالأعمدة والأنواع المضغوطة"""
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in FRAME_DTYPES.items()})
+
+
+def normalize_group_frame(df, months):
+    """تصحيح أعمدة وأنواع بيانات جدول مجموعة واحدة بعد قراءته من أي مصدر"""
+    # تصحيح الأعمدة إذا كان هناك خطأ إملائي
+    if 'رقم_الهاتf' in df.columns and 'رقم_الهاتف' not in df.columns:
+        df.rename(columns={'رقم_الهاتf': 'رقم_الهاتف'}, inplace=True)
+    
+    # إنشاء الأعمدة الأساسية المطلوبة
+    required_columns = build_required_columns(months)
+    
+    # إضافة الأعمدة المفقودة
+    for col in required_columns:
+        if col not in df.columns:
+            if col in months:
+                df[col] = False
+            elif col == 'الحصص_الحاضرة':
+                df[col] = 0
+            else:
+                df[col] = ''
+    
+    # ترتيب الأعمدة بالترتيب الصحيح
+    df = df[required_columns]
+    
+    # تحويل أنواع البيانات
+    df['الكود'] = df['الكود'].astype(str)
+    df['الاسم'] = df['الاسم'].astype(str)
+    df['رقم_الهاتف'] = df['رقم_الهاتف'].astype(str)
+    df['ولي_الامر'] = df['ولي_الامر'].astype(str)
+    df['الحصص_الحاضرة'] = pd.to_numeric(df['الحصص_الحاضرة'], errors='coerce').fillna(0).astype(int)
+    df['تواريخ_الحضور'] = df['تواريخ_الحضور'].astype(str).fillna('')
+    df['ملاحظات'] = df['ملاحظات'].astype(str).fillna('')
+    df['الاختبارات'] = df['الاختبارات'].astype(str).fillna('')
+    
+    # معالجة تاريخ التسجيل
+    try:
+        df['تاريخ_التسجيل'] = pd.to_datetime(df['تاريخ_التسجيل'], errors='coerce').dt.date
+        df['تاريخ_التسجيل'] = df['تاريخ_التسجيل'].fillna(date.today())
+    except:
+        df['تاريخ_التسجيل'] = date.today()
+    
+    # التأكد من أن أعمدة الأشهر من النوع المنطقي
+    for month in months:
+        df[month] = df[month].astype(bool)
+    
+    return df
+
+
+def read_excel_groups(excel_path, months, past_payments=None, session_rows=None):
+    """قراءة كل أوراق ملف الإكسل وتصحيحها، مع إرجاع رقم آخر حدث حضور تم دمجه
+
+    إذا أعطي past_payments (قاموس) توضع فيه أعمدة دفع السنوات السابقة لكل مجموعة قبل حذفها،
+    وإذا أعطي session_rows (قائمة) يضاف لها (المجموعة، اليوم) لكل حصة في ورقة الحصص
+    """
+    groups_df = pd.read_excel(excel_path, sheet_name=None)
+    
+    # قراءة رقم آخر حدث حضور تم دمجه في الملف
+    compacted_seq = 0
+    meta_df = groups_df.pop(META_SHEET_NAME, None)
+    if meta_df is not None and not meta_df.empty:
+        meta = dict(zip(meta_df['key'].astype(str), meta_df['value']))
+        compacted_seq = int(meta.get('journal_seq', 0))
+    
+    sessions_df = groups_df.pop(SESSIONS_SHEET_NAME, None)
+    if session_rows is not None and sessions_df is not None and not sessions_df.empty:
+        session_rows.extend(zip(sessions_df['group'].astype(str), sessions_df['day'].astype(str)))
+    
+    # معالجة وتصحيح البيانات لكل مجموعة
+    for group_name in list(groups_df.keys()):
+        df = groups_df[group_name]
+        past_columns = past_month_columns(df.columns, months)
+        if past_payments is not None and past_columns:
+            past_payments[group_name] = df[['الكود'] + past_columns].astype({'الكود': str}).fillna(False)
+        groups_df[group_name] = normalize_group_frame(df, months)
+    
+    return groups_df, compacted_seq
+
+
+def write_group_sheet(workbook, group_name, df):
+    """إعادة كتابة ورقة مجموعة واحدة فقط داخل ملف الإكسل"""
+    # تحويل التواريخ لنص للحفظ واستبدال القيم الفارغة بنصوص فارغة بدون نسخ الجدول كاملاً
+    if 'تاريخ_التسجيل' in df.columns:
+        df = df.assign(**{'تاريخ_التسجيل': df['تاريخ_التسجيل'].astype(str)})
+    df = df.fillna('')
+    
+    # استبدال الورقة القديمة في نفس موضعها
+    position = None
+    if group_name in workbook.sheetnames:
+        position = workbook.sheetnames.index(group_name)
+        workbook.remove(workbook[group_name])
+    worksheet = workbook.create_sheet(group_name, position)
+    
+    for row in dataframe_to_rows(df, index=False, header=True):
+        worksheet.append(row)
+
+
+def write_meta_sheet(workbook, journal_seq):
+    """كتابة الورقة المخفية التي تحفظ رقم آخر حدث تم دمجه"""
+    if META_SHEET_NAME in workbook.sheetnames:
+        workbook.remove(workbook[META_SHEET_NAME])
+    worksheet = workbook.create_sheet(META_SHEET_NAME)
+    worksheet.sheet_state = 'hidden'
+    worksheet.append(['key', 'value'])
+    worksheet.append(['journal_seq', journal_seq])
+
+
+def write_sessions_sheet(workbook, session_rows):
+    """كتابة الورقة المخفية التي تحفظ أيام حصص كل مجموعة"""
+    if SESSIONS_SHEET_NAME in workbook.sheetnames:
+        workbook.remove(workbook[SESSIONS_SHEET_NAME])
+    worksheet = workbook.create_sheet(SESSIONS_SHEET_NAME)
+    worksheet.sheet_state = 'hidden'
+    worksheet.append(['group', 'day'])
+    for row in session_rows:
+        worksheet.append(list(row))
+
+
+def read_journal_seq(excel_path):
+    """رقم آخر حدث تم دمجه في ملف الإكسل من الورقة المخفية فقط بدون قراءة أوراق المجموعات"""
+    workbook = load_workbook(excel_path, read_only=True)
+    try:
+        if META_SHEET_NAME not in workbook.sheetnames:
+            return 0
+        for key, value in workbook[META_SHEET_NAME].iter_rows(min_row=2, values_only=True):
+            if str(key) == 'journal_seq':
+                return int(value or 0)
+        return 0
+    finally:
+        workbook.close()
+
+
+def export_groups_to_excel(groups_df):
+    """تصدير كل المجموعات إلى ملف إكسل في الذاكرة"""
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for group_name, df in groups_df.items():
+        write_group_sheet(workbook, group_name, df)
+    
+    output = BytesIO()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+# أقصى طول لاسم ورقة في ملف الإكسل
+SHEET_NAME_MAX_LENGTH = 31
+
+
+def unique_sheet_name(name, taken):
+    """اسم ورقة بالطول المسموح لا يطابق أي اسم في taken (الإكسل لا يفرق بين الحروف الكبيرة والصغيرة)
+
+    المجموعتان اللتان تبدآن بنفس 31 حرفاً كانت الثانية منهما ستكتب في ورقة الأولى، لذلك يضاف رقم للاسم المكرر
+    """
+    taken = {sheet_name.lower() for sheet_name in taken}
+    sheet_name = str(name)[:SHEET_NAME_MAX_LENGTH]
+    number = 1
+    while sheet_name.lower() in taken:
+        number += 1
+        suffix = f" ({number})"
+        sheet_name = str(name)[:SHEET_NAME_MAX_LENGTH - len(suffix)] + suffix
+    return sheet_name
+
+
+def write_export(chunks, path, file_format):
+    """كتابة دفعات (المجموعة، جدول) في ملف دفعة بدفعة حتى لا يحتاج التصدير لكل البيانات في الذاكرة
+
+    الصيغ: csv، وparquet (تحتاج pyarrow)، وxlsx بورقة لكل مجموعة. ترجع عدد الصفوف المكتوبة
+    """
+    rows = 0
+    if file_format == 'csv':
+        with open(path, 'w', encoding='utf-8-sig', newline='') as export_file:
+            for _, chunk in chunks:
+                chunk.to_csv(export_file, header=rows == 0, index=False)
+                rows += len(chunk)
+    
+    elif file_format == 'parquet':
+        if pq is None:
+            raise RuntimeError("التصدير بصيغة Parquet يحتاج تثبيت مكتبة pyarrow")
+        writer = None
+        try:
+            for _, chunk in chunks:
+                # كل الدفعات تكتب بنفس أنواع أعمدة الدفعة الأولى
+                table = pa.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    
+    else:
+        # وضع الكتابة فقط في openpyxl يكتب الصفوف على القرص بدلاً من الاحتفاظ بها في الذاكرة
+        workbook = Workbook(write_only=True)
+        worksheets = {}
+        for group_name, chunk in chunks:
+            worksheet = worksheets.get(group_name)
+            if worksheet is None:
+                worksheet = workbook.create_sheet(unique_sheet_name(group_name, workbook.sheetnames))
+                worksheet.append(list(chunk.columns))
+                worksheets[group_name] = worksheet
+            for row in chunk.astype(object).where(chunk.notna(), None).values.tolist():
+                worksheet.append(row)
+            rows += len(chunk)
+        if not worksheets:
+            workbook.create_sheet("Sheet1")
+        workbook.save(path)
+    
+    return rows
+
+
+# أسماء الأعمدة المقبولة في ملف الطلاب للاستيراد الجماعي -> أعمدة النظام
+ROSTER_COLUMN_ALIASES = {
+    'كود': 'الكود', 'كود الطالب': 'الكود', 'code': 'الكود', 'student_id': 'الكود',
+    'اسم': 'الاسم', 'اسم الطالب': 'الاسم', 'name': 'الاسم',
+    'رقم الهاتف': 'رقم_الهاتف', 'الهاتف': 'رقم_الهاتف', 'phone': 'رقم_الهاتف',
+    'ولي الامر': 'ولي_الامر', 'ولي الأمر': 'ولي_الامر', 'رقم ولي الامر': 'ولي_الامر', 'parent_phone': 'ولي_الامر',
+    'تاريخ التسجيل': 'تاريخ_التسجيل', 'registration_date': 'تاريخ_التسجيل',
+    'notes': 'ملاحظات'
+}
+
+# الكود يظهر في QR وفي النصوص المفصولة بـ ; لذلك لا يحتوي على مسافات أو ;
+STUDENT_CODE_PATTERN = r'[^\s;]+'
+# رقم موبايل مصري مع كود الدولة أو بدونه
+PHONE_PATTERN = r'(?:\+?20|0)?1[0125]\d{8}'
+
+
+def read_roster_file(roster_file, file_name=None):
+    """قراءة ملف طلاب CSV أو Excel مع إبقاء كل القيم نصوصاً حتى لا تضيع الأصفار في الأكواد والأرقام"""
+    file_name = (file_name or getattr(roster_file, 'name', None) or str(roster_file)).lower()
+    if file_name.endswith('.csv'):
+        return pd.read_csv(roster_file, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    return pd.read_excel(roster_file, dtype=str, keep_default_na=False)
+
+
+def _clean_roster_text(column, digits=False):
+    """تنظيف عمود نصي: إزالة المسافات وتحويل الأرقام العربية، وللأرقام حذف الفواصل والشرطات"""
+    column = column.fillna('').astype(str).str.strip().str.translate(ARABIC_DIGITS_MAP)
+    column = column.mask(column.str.lower().isin(['nan', 'none']), '')
+    if digits:
+        column = column.str.replace(r'[\s\-().]', '', regex=True)
+    return column
+
+
+def validate_roster(roster, months, existing_codes, registration_months):
+    """التحقق من ملف الطلاب كاملاً بعمليات على الأعمدة وإرجاع (الصفوف الصالحة، أخطاء الصفوف)
+
+    الصفوف الصالحة جاهزة بترتيب أعمدة المجموعة، والأخطاء بها رقم الصف في الملف وسبب رفضه
+    """
+    roster = roster.rename(columns=lambda name: ROSTER_COLUMN_ALIASES.get(str(name).strip(), str(name).strip()))
+    missing = [column for column in ('الكود', 'الاسم') if column not in roster.columns]
+    if missing:
+        raise ValueError(f"أعمدة مطلوبة غير موجودة في الملف: {', '.join(missing)}")
+    
+    empty = pd.Series('', index=roster.index)
+    codes = _clean_roster_text(roster['الكود'])
+    names = _clean_roster_text(roster['الاسم'])
+    phones = _clean_roster_text(roster.get('رقم_الهاتف', empty), digits=True)
+    parent_phones = _clean_roster_text(roster.get('ولي_الامر', empty), digits=True)
+    notes = _clean_roster_text(roster.get('ملاحظات', empty))
+    
+    raw_dates = _clean_roster_text(roster.get('تاريخ_التسجيل', empty))
+    registration_dates = pd.to_datetime(raw_dates.mask(raw_dates == ''), errors='coerce')
+    
+    checks = pd.DataFrame({
+        'الكود فارغ': codes == '',
+        'الكود يحتوي على مسافات أو ;': (codes != '') & ~codes.str.fullmatch(STUDENT_CODE_PATTERN),
+        'الاسم فارغ': names == '',
+        'رقم الهاتف غير صحيح': (phones != '') & ~phones.str.fullmatch(PHONE_PATTERN),
+        'رقم ولي الأمر غير صحيح': (parent_phones != '') & ~parent_phones.str.fullmatch(PHONE_PATTERN),
+        'تاريخ التسجيل غير صحيح': (raw_dates != '') & registration_dates.isna(),
+        'الكود مكرر في الملف': (codes != '') & codes.duplicated(keep='first'),
+        'الكود مسجل بالفعل': codes.isin(existing_codes)
+    })
+    invalid = checks.any(axis=1)
+    
+    errors = pd.DataFrame({
+        # رقم الصف كما يظهر في برنامج الجداول (الصف الأول للعناوين)
+        'الصف': roster.index[invalid] + 2,
+        'الكود': codes[invalid].values,
+        'الخطأ': ['، '.join(checks.columns[row]) for row in checks[invalid].values]
+    })
+    
+    valid = ~invalid
+    registration_dates = registration_dates[valid].dt.date.fillna(date.today())
+    paid_month = pd.Series([registration_months.get(day.month) for day in registration_dates], index=registration_dates.index)
+    
+    students = pd.DataFrame({
+        'الكود': codes[valid],
+        'الاسم': names[valid],
+        'رقم_الهاتف': phones[valid],
+        'ولي_الامر': parent_phones[valid],
+        'الحصص_الحاضرة': 0
+    })
+    # الشهر الموافق لتاريخ التسجيل يعتبر مدفوعاً كما في نموذج التسجيل
+    for month in months:
+        students[month] = paid_month == month
+    students['تواريخ_الحضور'] = ''
+    students['تاريخ_التسجيل'] = registration_dates
+    students['ملاحظات'] = notes[valid]
+    students['الاختبارات'] = ''
+    
+    return students[build_required_columns(months)].reset_index(drop=True), errors
+
+
+# التشكيل والتطويل يتم حذفهما قبل البحث
+ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+# توحيد أشكال الألف والياء والتاء المربوطة
+ARABIC_LETTER_MAP = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ة': 'ه'})
+
+
+def normalize_arabic(text):
+    """تحويل النص لصيغة موحدة للبحث (حروف صغيرة، بدون تشكيل، وحروف عربية موحدة)"""
+    text = ARABIC_DIACRITICS.sub('', str(text).lower())
+    return ' '.join(text.translate(ARABIC_LETTER_MAP).split())
+
+
+class StudentSearchIndex:
+    """فهرس بحث للأسماء أو الأكواد مبني على الأجزاء الثنائية (bigrams) للنص الموحد
+
+    البحث يقاطع قوائم الأجزاء بدلاً من المرور على كل القيم، ثم يرتب النتائج
+    بحيث تأتي القيم التي تبدأ بالنص المطلوب أولاً
+    """
+    
+    def __init__(self, values=()):
+        # القيمة الأصلية -> [النص الموحد، عدد الطلاب الذين لهم نفس القيمة]
+        self.values = {}
+        # الجزء -> القيم التي تحتويه
+        self.grams = defaultdict(set)
+        for value in values:
+            self.add(value)
+    
+    @staticmethod
+    def grams_of(text):
+        """الحروف المفردة والأجزاء الثنائية للنص"""
+        return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+    
+    def add(self, value):
+        value = str(value)
+        if value in self.values:
+            self.values[value][1] += 1
+            return
+        normalized = normalize_arabic(value)
+        self.values[value] = [normalized, 1]
+        for gram in self.grams_of(normalized):
+            self.grams[gram].add(value)
+    
+    def remove(self, value):
+        value = str(value)
+        entry = self.values.get(value)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del self.values[value]
+        for gram in self.grams_of(entry[0]):
+            self.grams[gram].discard(value)
+    
+    def search(self, query, limit=50):
+        """إرجاع أفضل النتائج التي تحتوي على النص المطلوب"""
+        query = normalize_arabic(query)
+        if not query:
+            return []
+        
+        keys = {query} if len(query) == 1 else {query[i:i + 2] for i in range(len(query) - 1)}
+        postings = sorted((self.grams.get(key, set()) for key in keys), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        
+        matches = [value for value in candidates if query in self.values[value][0]]
+        
+        def rank(value):
+            normalized = self.values[value][0]
+            return (
+                not normalized.startswith(query),
+                f" {query}" not in f" {normalized}",
+                normalized.find(query),
+                len(normalized),
+                value
+            )
+        
+        return heapq.nsmallest(limit, matches, key=rank)
+
+
+# عدد الصفوف في كل دفعة عند التصدير
+EXPORT_CHUNK_ROWS = 5000
+# صيغ التصدير المتاحة ونوع كل ملف
+EXPORT_FORMATS = ['csv', 'xlsx'] + (['parquet'] if pq is not None else [])
+EXPORT_MIME_TYPES = {
+    'csv': "text/csv",
+    'xlsx': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    'parquet': "application/octet-stream"
+}
+# مجلد ملفات التصدير بجوار ملف البيانات
+EXPORT_DIR_NAME = "exports"
+# أعمدة جدول الحضور المصدر (صف لكل يوم حضور)
+ATTENDANCE_EXPORT_COLUMNS = ['الكود', 'الاسم', 'المجموعة', 'التاريخ']
+
+
+class AttendanceHistory:
+    """تواريخ الحضور لكل طالب كمصفوفة مضغوطة من أرقام الأيام بدلاً من نص مفصول بـ ;
+
+    العمود النصي القديم (تواريخ_الحضور) لا يبقى في جداول المجموعات، ويُبنى من هذه المصفوفات
+    فقط للصفوف التي تكتب في الملف أو تصدر أو تعرض
+    """
+    
+    def __init__(self):
+        # كود الطالب -> array من أرقام الأيام (date.toordinal) بترتيب التسجيل
+        self.dates = {}
+        # كود الطالب -> المجموعة
+        self.groups = {}
+    
+    @classmethod
+    def from_groups(cls, groups_df):
+        """تحويل العمود النصي القديم لكل المجموعات مرة واحدة"""
+        history = cls()
+        for group_name, df in groups_df.items():
+            for student_id, text in zip(df['الكود'].values, df['تواريخ_الحضور'].values):
+                history.add_student(group_name, student_id, text)
+        return history
+    
+    @staticmethod
+    def parse_legacy(text):
+        """تحويل نص مثل '2025-09-01; 2025-09-08' إلى مصفوفة أرقام أيام"""
+        days = array('i')
+        if pd.isna(text):
+            return days
+        for part in str(text).split(';'):
+            part = part.strip()
+            if not part or part == 'nan':
+                continue
+            try:
+                days.append(date.fromisoformat(part[:10]).toordinal())
+            except ValueError:
+                continue
+        return days
+    
+    def legacy_string(self, student_id):
+        """النص القديم المفصول بـ ; لطالب واحد"""
+        return '; '.join(date.fromordinal(day).isoformat() for day in self.dates.get(student_id, ()))
+    
+    def add_student(self, group_name, student_id, text=''):
+        self.dates[student_id] = self.parse_legacy(text)
+        self.groups[student_id] = group_name
+    
+    def remove_student(self, student_id):
+        self.dates.pop(student_id, None)
+        self.groups.pop(student_id, None)
+    
+    def remove_group(self, group_name):
+        for student_id in [code for code, group in self.groups.items() if group == group_name]:
+            self.remove_student(student_id)
+    
+    def append(self, student_id, day):
+        """إضافة يوم حضور لطالب"""
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        self.dates.setdefault(student_id, array('i')).append(day.toordinal())
+    
+    def pop(self, student_id):
+        """التراجع عن آخر يوم حضور لطالب وإرجاعه"""
+        days = self.dates.get(student_id)
+        if not days:
+            return None
+        return date.fromordinal(days.pop())
+    
+    def split_before(self, student_id, day):
+        """حذف أيام حضور الطالب السابقة ليوم معين وإرجاعها (لنقلها للأرشيف)"""
+        days = self.dates.get(student_id)
+        cutoff = day.toordinal()
+        if not days or min(days) >= cutoff:
+            return []
+        self.dates[student_id] = array('i', (ordinal for ordinal in days if ordinal >= cutoff))
+        return [date.fromordinal(ordinal) for ordinal in days if ordinal < cutoff]
+
+    def attended_on(self, student_id, day):
+        """هل سجل الطالب حضوراً في هذا اليوم"""
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        return day.toordinal() in self.dates.get(student_id, ())
+    
+    def history(self, student_id):
+        """كل أيام حضور الطالب بترتيب التسجيل"""
+        return [date.fromordinal(day) for day in self.dates.get(student_id, ())]
+    
+    def codes_of(self, group_name=None):
+        return [code for code in self.dates if group_name is None or self.groups.get(code) == group_name]
+    
+    def to_frame(self, group_name=None):
+        """جدول طويل (student_id, date, group) لكل أيام الحضور"""
+        return self.frame_for(self.codes_of(group_name))
+    
+    def iter_frames(self, group_name=None, chunk_rows=EXPORT_CHUNK_ROWS):
+        """نفس جدول to_frame على دفعات من الطلاب، كل دفعة بها حوالي chunk_rows صف"""
+        batch = []
+        batch_rows = 0
+        for code in self.codes_of(group_name):
+            batch.append(code)
+            batch_rows += len(self.dates[code])
+            if batch_rows >= chunk_rows:
+                yield self.frame_for(batch)
+                batch = []
+                batch_rows = 0
+        if batch:
+            yield self.frame_for(batch)
+    
+    def frame_for(self, codes):
+        """جدول طويل (student_id, date, group) لأيام حضور الطلاب المعطاة أكوادهم"""
+        lengths = np.fromiter((len(self.dates[code]) for code in codes), dtype=np.int64, count=len(codes))
+        if lengths.sum() == 0:
+            return pd.DataFrame({
+                'student_id': pd.Series(dtype=str),
+                'date': pd.Series(dtype='datetime64[ns]'),
+                'group': pd.Series(dtype=str)
+            })
+        
+        ordinals = np.concatenate([np.frombuffer(self.dates[code], dtype=np.int32) for code in codes])
+        # رقم اليوم 719163 يساوي 1970-01-01
+        days = (ordinals.astype(np.int64) - 719163).astype('datetime64[D]')
+        return pd.DataFrame({
+            'student_id': np.repeat(np.array(codes, dtype=object), lengths),
+            'date': days.astype('datetime64[ns]'),
+            'group': np.repeat(np.array([self.groups.get(code) for code in codes], dtype=object), lengths)
+        })
+    
+    def between(self, start, end, group_name=None):
+        """أيام الحضور بين تاريخين (شاملين) كجدول طويل"""
+        frame = self.to_frame(group_name)
+        mask = (frame['date'] >= pd.Timestamp(start)) & (frame['date'] <= pd.Timestamp(end))
+        return frame[mask].reset_index(drop=True)
+
+
+# تحويل الأرقام العربية الهندية إلى أرقام لاتينية قبل قراءة الدرجات
+ARABIC_DIGITS_MAP = str.maketrans('٠١٢٣٤٥٦٧٨٩', '0123456789')
+# الدرجة مع درجة نهائية اختيارية مثل "15" أو "15/20" أو "15 من 20"
+TEST_SCORE_PATTERN = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*(?:(?:/|من)\s*(\d+(?:\.\d+)?))?')
+# تاريخ الاختبار بين قوسين في نهاية النص مثل "(2025-10-01)"
+TEST_DATE_PATTERN = re.compile(r'\((\d{4}-\d{2}-\d{2})\)')
+
+
+class TestResults:
+    """نتائج الاختبارات كجدول منظم (طالب، مجموعة، اختبار، تاريخ، درجة، درجة نهائية)
+
+    يُبنى من عمود الاختبارات النصي القديم، ويعاد بناء العمود النصي منه عند الحفظ
+    بصيغة يمكن قراءتها مرة أخرى: "اسم الاختبار: الدرجة/النهائية (التاريخ)"
+    """
+    
+    COLUMNS = ['student_id', 'group', 'test_name', 'test_date', 'score', 'max_score', 'entry']
+    # أنواع الأعمدة الرقمية حتى يعمل الجدول الفارغ مع الإحصائيات
+    DTYPES = {'test_date': 'datetime64[ns]', 'score': float, 'max_score': float}
+    
+    def __init__(self, rows=()):
+        self.frame = pd.DataFrame(list(rows), columns=self.COLUMNS).astype(self.DTYPES)
+        # صفوف جديدة تضاف للجدول عند أول قراءة بدلاً من نسخ الجدول مع كل إضافة
+        self.pending_rows = []
+    
+    @classmethod
+    def from_groups(cls, groups_df):
+        """تحويل عمود الاختبارات النصي لكل المجموعات"""
+        rows = []
+        for group_name, df in groups_df.items():
+            for student_id, text in zip(df['الكود'].values, df['الاختبارات'].values):
+                rows.extend(cls.entry_rows(group_name, student_id, text))
+        return cls(rows)
+    
+    @classmethod
+    def entry_rows(cls, group_name, student_id, text):
+        """صفوف الجدول المنظم من نص الاختبارات القديم لطالب واحد"""
+        rows = []
+        if pd.isna(text):
+            return rows
+        for entry in str(text).split(';'):
+            entry = entry.strip()
+            if entry and entry != 'nan':
+                rows.append([student_id, group_name] + cls.parse_entry(entry) + [entry])
+        return rows
+    
+    @staticmethod
+    def parse_entry(entry):
+        """قراءة [اسم الاختبار، التاريخ، الدرجة، الدرجة النهائية] من نص نتيجة واحدة"""
+        test_name, separator, result = entry.rpartition(':')
+        if not separator:
+            test_name, result = entry, ''
+        result = result.translate(ARABIC_DIGITS_MAP)
+        
+        test_date = pd.NaT
+        date_match = TEST_DATE_PATTERN.search(result)
+        if date_match:
+            test_date = pd.to_datetime(date_match.group(1), errors='coerce')
+        
+        score = max_score = np.nan
+        score_match = TEST_SCORE_PATTERN.match(result)
+        if score_match:
+            score = float(score_match.group(1))
+            if score_match.group(2):
+                max_score = float(score_match.group(2))
+        
+        return [test_name.strip(), test_date, score, max_score]
+    
+    @staticmethod
+    def format_entry(test_name, score, max_score=None, test_date=None):
+        """صيغة النص التي تحفظ بها نتيجة واحدة في عمود الاختبارات"""
+        entry = f"{test_name}: {score}"
+        if max_score:
+            entry += f"/{max_score:g}"
+        if test_date:
+            entry += f" ({test_date})"
+        return entry
+    
+    def get_frame(self):
+        if self.pending_rows:
+            new_rows = pd.DataFrame(self.pending_rows, columns=self.COLUMNS).astype(self.DTYPES)
+            self.frame = new_rows if self.frame.empty else pd.concat([self.frame, new_rows], ignore_index=True)
+            self.pending_rows = []
+        return self.frame
+    
+    def add(self, group_name, student_id, test_name, score, max_score=None, test_date=None):
+        """إضافة نتيجة وإرجاع نصها في عمود الاختبارات"""
+        entry = self.format_entry(test_name, score, max_score, test_date)
+        self.add_entry(group_name, student_id, entry)
+        return entry
+    
+    def add_entry(self, group_name, student_id, entry):
+        """إضافة نتيجة واحدة من نصها كما يحفظ في عمود الاختبارات"""
+        self.pending_rows.append([str(student_id), group_name] + self.parse_entry(entry) + [entry])
+    
+    def add_text(self, group_name, student_id, text):
+        """إضافة نتائج طالب جديد من نص الاختبارات القديم"""
+        self.pending_rows.extend(self.entry_rows(group_name, student_id, text))
+    
+    def text_by_student(self, group_name=None):
+        """نص الاختبارات المفصول بـ ; لكل طالب، لكتابة عمود الاختبارات في الملف"""
+        frame = self.get_frame()
+        if group_name is not None:
+            frame = frame[frame['group'] == group_name]
+        return frame.groupby('student_id', sort=False)['entry'].agg('; '.join).to_dict()
+    
+    def remove_student(self, student_id):
+        frame = self.get_frame()
+        self.frame = frame[frame['student_id'] != student_id].reset_index(drop=True)
+    
+    def remove_group(self, group_name):
+        frame = self.get_frame()
+        self.frame = frame[frame['group'] != group_name].reset_index(drop=True)
+    
+    def for_student(self, student_id):
+        """نتائج طالب واحد بترتيب إضافتها"""
+        frame = self.get_frame()
+        return frame[frame['student_id'] == student_id]
+    
+    def scored(self, group_name):
+        """نتائج المجموعة التي لها درجة رقمية مع نسبة مئوية عند وجود درجة نهائية"""
+        frame = self.get_frame()
+        frame = frame[(frame['group'] == group_name) & frame['score'].notna()]
+        return frame.assign(percent=frame['score'] / frame['max_score'] * 100)
+    
+    def group_stats(self, group_name):
+        """المتوسط والوسيط والمئينات لكل اختبار في المجموعة"""
+        grouped = self.scored(group_name).groupby('test_name', sort=False)['score']
+        stats = grouped.agg(['count', 'mean', 'median', 'min', 'max'])
+        stats['p25'] = grouped.quantile(0.25)
+        stats['p75'] = grouped.quantile(0.75)
+        stats['p90'] = grouped.quantile(0.9)
+        return stats
+    
+    def ranked(self, group_name):
+        """ترتيب كل طالب ومئينه داخل كل اختبار في المجموعة"""
+        frame = self.scored(group_name)
+        by_test = frame.groupby('test_name', sort=False)['score']
+        return frame.assign(
+            rank=by_test.rank(ascending=False, method='min').astype(int),
+            percentile=(by_test.rank(pct=True) * 100).round(1)
+        )
+
+
+class GroupAggregates:
+    """ملخص محسوب مسبقاً لكل مجموعة: عدد الطلاب، إجمالي الحضور، وعدد من دفع كل شهر
+
+    يُحدّث بالفرق مع كل حضور أو دفع أو إضافة أو حذف طالب بدلاً من إعادة الحساب عند كل عرض،
+    ولكل مجموعة رقم إصدار يزيد مع كل تعديل ويستخدم لحفظ الرسوم البيانية حتى تتغير المجموعة
+    """
+    
+    def __init__(self, months):
+        self.months = list(months)
+        self.month_positions = {month: position for position, month in enumerate(self.months)}
+        # المجموعة -> {'students', 'attendance', 'paid' (مصفوفة بعدد الأشهر)}
+        self.summaries = {}
+        # المجموعة -> رقم الإصدار، ولا يرجع للصفر حتى عند إعادة بناء الملخص
+        self.versions = defaultdict(int)
+        # (المجموعة، اسم الرسم) -> (رقم الإصدار، الرسم)
+        self.figures = {}
+    
+    def build(self, group_name, df):
+        """حساب ملخص مجموعة كاملة مرة واحدة"""
+        self.summaries[group_name] = {
+            'students': len(df),
+            'attendance': int(df['الحصص_الحاضرة'].sum()),
+            'paid': month_flags(df[PAYMENTS_COLUMN], len(self.months)).sum(axis=0, dtype=np.int64)
+        }
+        self.versions[group_name] += 1
+    
+    def summary(self, group_name, df):
+        """ملخص المجموعة، ويحسب من الجدول فقط إذا لم يكن محسوباً من قبل"""
+        if group_name not in self.summaries:
+            self.build(group_name, df)
+        summary = self.summaries[group_name]
+        return {
+            'students': summary['students'],
+            'attendance': summary['attendance'],
+            'average': summary['attendance'] / summary['students'] if summary['students'] else 0,
+            'paid': pd.Series(summary['paid'], index=self.months),
+            'paid_total': int(summary['paid'].sum()),
+            'version': self.versions[group_name]
+        }
+    
+    def touch(self, group_name):
+        """تسجيل تعديل لا يغير الملخص لكنه يغير رسوم المجموعة (مثل نتائج الاختبارات)"""
+        self.versions[group_name] += 1
+    
+    def invalidate(self, group_name):
+        """حذف ملخص المجموعة ليعاد حسابه عند العرض القادم"""
+        self.summaries.pop(group_name, None)
+        self.versions[group_name] += 1
+    
+    def add_attendance(self, group_name, delta):
+        summary = self.summaries.get(group_name)
+        if summary is not None:
+            summary['attendance'] += delta
+        self.versions[group_name] += 1
+    
+    def add_payment(self, group_name, month, delta):
+        summary = self.summaries.get(group_name)
+        if summary is not None:
+            summary['paid'][self.month_positions[month]] += delta
+        self.versions[group_name] += 1
+    
+    def add_students(self, group_name, rows):
+        """إضافة صفوف طلاب جدد (جدول مضغوط) لملخص مجموعتهم"""
+        summary = self.summaries.get(group_name)
+        if summary is not None:
+            summary['students'] += len(rows)
+            summary['attendance'] += int(rows['الحصص_الحاضرة'].sum())
+            summary['paid'] += month_flags(rows[PAYMENTS_COLUMN], len(self.months)).sum(axis=0, dtype=np.int64)
+        self.versions[group_name] += 1
+    
+    def remove_student(self, group_name, row):
+        """حذف صف طالب (Series) من ملخص مجموعته"""
+        summary = self.summaries.get(group_name)
+        if summary is not None:
+            summary['students'] -= 1
+            summary['attendance'] -= int(row['الحصص_الحاضرة'])
+            summary['paid'] -= month_flags(row[PAYMENTS_COLUMN], len(self.months))[0].astype(np.int64)
+        self.versions[group_name] += 1
+    
+    def remove_group(self, group_name):
+        self.invalidate(group_name)
+        for key in [key for key in self.figures if key[0] == group_name]:
+            del self.figures[key]
+    
+    def figure(self, group_name, name, build):
+        """رسم بياني محفوظ للمجموعة، ويعاد رسمه فقط إذا تغيرت المجموعة منذ آخر رسم"""
+        version = self.versions[group_name]
+        cached = self.figures.get((group_name, name))
+        if cached is None or cached[0] != version:
+            cached = (version, build())
+            self.figures[(group_name, name)] = cached
+        return cached[1]
+
+
+# عدد نتائج التقارير المحفوظة لإصدار البيانات الحالي
+REPORT_CACHE_SIZE = 32
+# أعمدة جدول تقارير المتابعة بالترتيب المعروض والمصدّر
+REPORT_COLUMNS = [
+    'المجموعة', 'الكود', 'الاسم', 'رقم_الهاتف', 'ولي_الامر', 'الحصص_الحاضرة',
+    'آخر_حضور', 'حصص_الغياب_المتتالية', 'نسبة_الحضور', 'أشهر_غير_مدفوعة'
+]
+
+
+def current_month_column(months, today=None):
+    """عمود دفع الشهر الحالي من أعمدة السنة الدراسية، أو None إذا كان اليوم خارجها"""
+    today = today or date.today()
+    for month in months:
+        if parse_month_column(month) == (today.month, today.year):
+            return month
+    return None
+
+
+def month_bounds(months):
+    """أول يوم في كل شهر من أعمدة الدفع وأول يوم في الشهر التالي له كمصفوفتي datetime64[D]"""
+    starts = []
+    for month in months:
+        month_number, year = parse_month_column(month)
+        starts.append(f"{year:04d}-{month_number:02d}")
+    starts = np.array(starts, dtype='datetime64[M]')
+    return starts.astype('datetime64[D]'), (starts + 1).astype('datetime64[D]')
+
+
+class SessionCalendar:
+    """حصص كل مجموعة ومصفوفة حضور منطقية (طالب × حصة) لكل مجموعة
+
+    أيام الحصص تخزن مع البيانات: حصص يضيفها المدرس (يوماً بيوم أو من جدول أسبوعي) وكل يوم سجل فيه
+    حضور لطالب من المجموعة. لذلك الحصة التي لم يحضرها أحد تحسب غياباً لكل المسجلين وقتها، وحصص
+    المجموعة لا تعتمد على حضور طلاب آخرين ولا تتغير بحذف طالب. المصفوفة تبنى مرة لكل إصدار من
+    المجموعة، ونسب الحضور والغياب المتتالي والخرائط تصبح عمليات على مصفوفات
+    """
+    
+    def __init__(self, storage):
+        self.storage = storage
+        # المجموعة -> أرقام أيام الحصص (date.toordinal)
+        self.days = {}
+        # المجموعة -> (الملخصات، رقم الإصدار واليوم، المصفوفة) التي بنيت منها
+        self.matrices = {}
+    
+    @staticmethod
+    def ordinals(days):
+        return {date.fromisoformat(day[:10]).toordinal() if isinstance(day, str) else day.toordinal() for day in days}
+    
+    def reset(self, session_rows=()):
+        """أيام الحصص بعد التحميل: الأيام المخزنة (المجموعة، اليوم) وأيام حضور طلاب كل مجموعة"""
+        self.days = {group_name: set() for group_name in self.storage.groups_df}
+        attendance = self.storage.attendance
+        for student_id, student_days in attendance.dates.items():
+            group_name = attendance.groups.get(student_id)
+            if group_name in self.days:
+                self.days[group_name].update(student_days)
+        for group_name, day in session_rows:
+            if group_name in self.days:
+                self.days[group_name].update(AttendanceHistory.parse_legacy(day))
+        self.matrices = {}
+    
+    def add(self, group_name, days):
+        self.days.setdefault(group_name, set()).update(self.ordinals(days))
+    
+    def remove(self, group_name, days):
+        self.days.get(group_name, set()).difference_update(self.ordinals(days))
+    
+    def drop_group(self, group_name):
+        self.days.pop(group_name, None)
+        self.matrices.pop(group_name, None)
+    
+    def split_before(self, day):
+        """حذف الحصص السابقة ليوم معين (لنقل حضورها للأرشيف) وإرجاع المجموعات التي تغيرت"""
+        cutoff = day.toordinal()
+        changed_groups = set()
+        for group_name, group_days in self.days.items():
+            past_days = {group_day for group_day in group_days if group_day < cutoff}
+            if past_days:
+                group_days -= past_days
+                changed_groups.add(group_name)
+        return changed_groups
+    
+    def rows(self):
+        """(المجموعة، اليوم) لكل حصة بالترتيب للحفظ"""
+        return [
+            (group_name, date.fromordinal(day).isoformat())
+            for group_name in self.storage.groups_df for day in sorted(self.days.get(group_name, ()))
+        ]
+    
+    def unattended(self, group_name):
+        """أيام حصص المجموعة (ومنها المجدولة بعد اليوم) التي لم يحضرها أي طالب"""
+        attendance = self.storage.attendance
+        attended_days = set()
+        for student_id in self.storage.groups_df[group_name]['الكود'].values:
+            attended_days.update(attendance.dates.get(student_id, ()))
+        return [date.fromordinal(day) for day in sorted(self.days.get(group_name, set()) - attended_days)]
+    
+    def matrix(self, group_name):
+        """مصفوفة حضور المجموعة حتى اليوم كقاموس، وتبنى من جديد فقط إذا تغيرت المجموعة أو اليوم
+
+        codes: أكواد الصفوف بترتيب الجدول، sessions: أيام الحصص (datetime64[D])،
+        attended: حضر الطالب الحصة، enrolled: الحصة في تاريخ تسجيل الطالب أو بعده
+        """
+        aggregates = self.storage.aggregates
+        # الحصص المجدولة بعد اليوم لا تدخل المصفوفة حتى يأتي يومها
+        version = (aggregates.versions[group_name], date.today())
+        cached = self.matrices.get(group_name)
+        if cached is None or cached[0] is not aggregates or cached[1] != version:
+            cached = (aggregates, version, self.build(group_name, version[1]))
+            self.matrices[group_name] = cached
+        return cached[2]
+    
+    def build(self, group_name, today):
+        df = self.storage.groups_df[group_name]
+        codes = df['الكود'].astype(str).to_numpy(dtype=object)
+        dates = self.storage.attendance.dates
+        days = [np.frombuffer(dates.get(code, array('i')), dtype=np.int32) for code in codes]
+        lengths = np.fromiter((len(student_days) for student_days in days), dtype=np.int64, count=len(codes))
+        ordinals = np.concatenate(days) if lengths.sum() else np.zeros(0, dtype=np.int32)
+        
+        sessions = np.array(sorted(day for day in self.days.get(group_name, ()) if day <= today.toordinal()), dtype=np.int32)
+        attended = np.zeros((len(codes), len(sessions)), dtype=bool)
+        # أيام الحضور التي ليست في الحصص (مثل بعد اليوم) لا تدخل المصفوفة
+        columns = np.searchsorted(sessions, ordinals)
+        held = columns < len(sessions)
+        held[held] = sessions[columns[held]] == ordinals[held]
+        attended[np.repeat(np.arange(len(codes)), lengths)[held], columns[held]] = True
+        
+        # تاريخ التسجيل كرقم يوم، والطالب بدون تاريخ تسجيل يحسب من أول حصة
+        registered = pd.to_datetime(df['تاريخ_التسجيل'].astype(object), errors='coerce').to_numpy('datetime64[D]')
+        registered = np.where(np.isnat(registered), np.iinfo(np.int32).min, registered.astype(np.int64) + 719163)
+        enrolled = sessions[None, :] >= registered[:, None]
+        
+        return {
+            'codes': codes,
+            # رقم اليوم 719163 يساوي 1970-01-01
+            'sessions': (sessions.astype(np.int64) - 719163).astype('datetime64[D]'),
+            'attended': attended,
+            'enrolled': enrolled
+        }
+    
+    def sessions(self, group_name):
+        """أيام الحصص التي عقدتها المجموعة حتى اليوم بالترتيب"""
+        return self.matrix(group_name)['sessions']
+    
+    def student_stats(self, group_name):
+        """لكل طالب بترتيب جدول المجموعة: آخر حضور، عدد آخر الحصص المتتالية التي غابها، ونسبة حضوره منذ التسجيل"""
+        matrix = self.matrix(group_name)
+        attended = matrix['attended']
+        enrolled = matrix['enrolled']
+        sessions = matrix['sessions']
+        session_count = len(sessions)
+        
+        enrolled_count = enrolled.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(enrolled_count > 0, (attended & enrolled).sum(axis=1) * 100.0 / enrolled_count, np.nan)
+        
+        # آخر عمود حضره الطالب، و-1 إذا لم يحضر أي حصة
+        if session_count:
+            last_column = np.where(attended.any(axis=1), session_count - 1 - np.argmax(attended[:, ::-1], axis=1), -1)
+        else:
+            last_column = np.full(len(attended), -1)
+        missed = ((np.arange(session_count)[None, :] > last_column[:, None]) & enrolled).sum(axis=1)
+        last_seen = np.full(len(attended), np.datetime64('NaT'), dtype='datetime64[D]')
+        seen = last_column >= 0
+        last_seen[seen] = sessions[last_column[seen]]
+        
+        return pd.DataFrame({
+            'الكود': matrix['codes'],
+            'آخر_حضور': pd.Series(last_seen).dt.date,
+            'حصص_الغياب_المتتالية': missed,
+            'نسبة_الحضور': np.round(rate, 1)
+        })
+    
+    def session_rates(self, group_name):
+        """نسبة الحضور في كل حصة من الطلاب المسجلين وقتها"""
+        matrix = self.matrix(group_name)
+        enrolled_count = matrix['enrolled'].sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = np.where(enrolled_count > 0, (matrix['attended'] & matrix['enrolled']).sum(axis=0) * 100.0 / enrolled_count, np.nan)
+        return pd.Series(rates, index=pd.to_datetime(matrix['sessions']))
+
+
+class StudentReports:
+    """تقارير المتابعة (الغياب والدفع ونسبة الحضور) لكل المجموعات معاً بعمليات على مصفوفات
+
+    جدول واحد بصف لكل طالب يحسب مرة لكل إصدار من البيانات من مصفوفات الحصص في SessionCalendar
+    ومن أرقام الدفع، وكل تقرير بعد ذلك فلتر على هذا الجدول ونتيجته محفوظة حتى يتغير إصدار البيانات
+    """
+    
+    def __init__(self, storage, cache_size=REPORT_CACHE_SIZE):
+        self.storage = storage
+        self.cache_size = cache_size
+        # الملخصات وأرقام الإصدارات التي حسب منها جدول الطلاب الحالي
+        self.aggregates = None
+        self.version = None
+        self.table = None
+        # شروط التقرير -> النتيجة، للإصدار الحالي فقط
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def data_version(self):
+        """رقم إصدار كل المجموعات من الملخصات، مع اليوم لأن الأشهر المستحقة تتغير بمرور الوقت"""
+        versions = self.storage.aggregates.versions
+        return date.today(), tuple((group_name, versions[group_name]) for group_name in self.storage.groups_df)
+    
+    def student_table(self):
+        """جدول الطلاب بمؤشرات الحضور والدفع، ويعاد حسابه فقط إذا تغيرت البيانات"""
+        version = self.data_version()
+        if self.table is None or self.aggregates is not self.storage.aggregates or self.version != version:
+            self.table = self.build_table(version[0])
+            self.aggregates = self.storage.aggregates
+            self.version = version
+            self.results.clear()
+        return self.table
+    
+    def build_table(self, today):
+        storage = self.storage
+        # مؤشرات الحضور من مصفوفة حصص كل مجموعة، بنفس ترتيب صفوف جدولها
+        frames = [
+            df[['الكود', 'الاسم', 'رقم_الهاتف', 'ولي_الامر', 'الحصص_الحاضرة', PAYMENTS_COLUMN]].assign(
+                **{'المجموعة': group_name, 'تاريخ_التسجيل': df['تاريخ_التسجيل'].astype(object)}
+            ).join(storage.calendar.student_stats(group_name).drop(columns='الكود').set_index(df.index))
+            for group_name, df in storage.groups_df.items() if len(df)
+        ]
+        if not frames:
+            return pd.DataFrame(columns=REPORT_COLUMNS + [PAYMENTS_COLUMN, 'تاريخ_التسجيل'])
+        table = pd.concat(frames, ignore_index=True).drop_duplicates('الكود').reset_index(drop=True)
+        
+        registered = pd.to_datetime(table['تاريخ_التسجيل'], errors='coerce').to_numpy('datetime64[D]')
+        registered_days = np.where(np.isnat(registered), np.iinfo(np.int32).min, registered.astype(np.int64))
+        
+        # الأشهر المستحقة: بدأت قبل اليوم، والطالب كان مسجلاً قبل نهايتها
+        month_starts, month_ends = month_bounds(storage.months)
+        due = (month_starts.astype(np.int64)[None, :] <= np.datetime64(today, 'D').astype(np.int64)) & (
+            registered_days[:, None] < month_ends.astype(np.int64)[None, :]
+        )
+        paid = month_flags(table[PAYMENTS_COLUMN].to_numpy(), len(storage.months))
+        
+        table['تاريخ_التسجيل'] = registered
+        table['أشهر_غير_مدفوعة'] = (due & ~paid).sum(axis=1)
+        return table
+    
+    def query(self, absent_sessions=None, unpaid_month=None, max_rate=None, group_names=None):
+        """الطلاب الذين تنطبق عليهم كل الشروط المعطاة
+
+        absent_sessions: غابوا عن آخر N حصة لمجموعتهم على الأقل،
+        unpaid_month: لم يدفعوا هذا الشهر وكانوا مسجلين فيه،
+        max_rate: نسبة حضورهم منذ التسجيل أقل من هذه النسبة المئوية
+        """
+        table = self.student_table()
+        key = (absent_sessions, unpaid_month, max_rate, tuple(group_names) if group_names is not None else None)
+        cached = self.results.get(key)
+        if cached is not None:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        
+        mask = np.ones(len(table), dtype=bool)
+        if group_names is not None:
+            mask &= table['المجموعة'].isin(group_names).to_numpy()
+        if absent_sessions:
+            mask &= table['حصص_الغياب_المتتالية'].to_numpy() >= absent_sessions
+        if unpaid_month is not None:
+            position = self.storage.months.index(unpaid_month)
+            _, month_ends = month_bounds([unpaid_month])
+            mask &= ((table[PAYMENTS_COLUMN].to_numpy(dtype=np.int64) >> position) & 1) == 0
+            mask &= ~(table['تاريخ_التسجيل'].to_numpy('datetime64[D]') >= month_ends[0])
+        if max_rate is not None:
+            mask &= table['نسبة_الحضور'].to_numpy(dtype=float) < max_rate
+        
+        result = table.loc[mask, REPORT_COLUMNS].reset_index(drop=True)
+        self.results[key] = result
+        if len(self.results) > self.cache_size:
+            self.results.popitem(last=False)
+        return result
+
+
+class YearArchive:
+    """أرشيف السنوات الدراسية السابقة: ملف CSV مضغوط لكل سنة بجانب ملف البيانات
+
+    كل صف هو طالب في مجموعة خلال تلك السنة: عدد حصصه وتواريخ حضوره وأعمدة دفع السنة،
+    ولا يقرأ ملف أي سنة إلا عند طلب تقرير عنها
+    """
+    
+    COLUMNS = ['المجموعة', 'الكود', 'الاسم', 'الحصص_الحاضرة', 'تواريخ_الحضور']
+    
+    def __init__(self, directory, start_month=ACADEMIC_YEAR_START_MONTH):
+        self.directory = directory
+        self.start_month = start_month
+        # السنة -> جدول السنة بعد أول قراءة
+        self.loaded = {}
+    
+    def path_for(self, year):
+        return os.path.join(self.directory, f"students_{year}_{year + 1}.csv.gz")
+    
+    def backup_path_for(self, data_path):
+        """مسار نسخة ملف البيانات قبل أرشفة جديدة، باسم يحمل وقتها حتى لا تستبدل نسخة سابقة"""
+        return os.path.join(self.directory, f"{os.path.basename(data_path)}.before_archive_{datetime.now():%Y%m%d_%H%M%S}")
+    
+    def log(self, year_start, backup_path, moved):
+        """تسجيل ما نقل للأرشيف لكل سنة (عدد الطلاب وأيام الحضور وأعمدة الدفع) في سجل الأرشيف وفي سجل البرنامج"""
+        record = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'year_start': year_start.isoformat(),
+            'backup': backup_path,
+            'moved': {f"{year}/{year + 1}": details for year, details in moved.items()}
+        }
+        with open(os.path.join(self.directory, ARCHIVE_LOG_NAME), 'a', encoding='utf-8') as log_file:
+            log_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        for year, details in moved.items():
+            print(
+                f"أرشفة السنة الدراسية {year}/{year + 1} (بداية السنة النشطة {year_start}): "
+                f"{details['students']} طالب، {details['attendance_days']} يوم حضور، "
+                f"أعمدة الدفع: {', '.join(details['payment_columns']) or 'لا يوجد'}، نسخة قبل الأرشفة: {backup_path}"
+            )
+    
+    def years(self):
+        """السنوات المؤرشفة من الأحدث للأقدم (من أسماء الملفات فقط بدون قراءتها)"""
+        if not os.path.isdir(self.directory):
+            return []
+        years = []
+        for file_name in os.listdir(self.directory):
+            match = re.fullmatch(r'students_(\d{4})_\d{4}\.csv\.gz', file_name)
+            if match:
+                years.append(int(match.group(1)))
+        return sorted(years, reverse=True)
+    
+    def load(self, year):
+        """جدول سنة مؤرشفة، ويقرأ من القرص مرة واحدة عند أول طلب"""
+        if year not in self.loaded:
+            months = academic_months(year, self.start_month)
+            path = self.path_for(year)
+            if os.path.exists(path):
+                frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+            else:
+                frame = pd.DataFrame(columns=self.COLUMNS + months)
+            frame['الحصص_الحاضرة'] = pd.to_numeric(frame['الحصص_الحاضرة'], errors='coerce').fillna(0).astype(int)
+            for month in months:
+                frame[month] = frame[month].astype(str).str.lower().isin(['true', '1'])
+            self.loaded[year] = frame
+        return self.loaded[year]
+    
+    def write(self, records):
+        """دمج صفوف جديدة لكل سنة ({السنة: قائمة صفوف}) في ملفات الأرشيف
+
+        الصف الجديد يستبدل صف نفس الطالب في نفس المجموعة، لذلك تكرار الأرشفة بعد توقف مفاجئ آمن
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for year, rows in records.items():
+            months = academic_months(year, self.start_month)
+            new_rows = pd.DataFrame(rows).reindex(columns=self.COLUMNS + months)
+            new_rows[months] = new_rows[months].fillna(False).astype(bool)
+            new_rows['الحصص_الحاضرة'] = new_rows['الحصص_الحاضرة'].fillna(0).astype(int)
+            new_rows = new_rows.fillna('')
+            
+            self.loaded.pop(year, None)
+            frame = pd.concat([self.load(year), new_rows], ignore_index=True)
+            frame = frame.drop_duplicates(subset=['المجموعة', 'الكود'], keep='last')
+            
+            path = self.path_for(year)
+            temp_path = f"{path}.tmp"
+            frame.to_csv(temp_path, index=False, compression='gzip')
+            os.replace(temp_path, path)
+            # السنة المؤرشفة لا تبقى في الذاكرة حتى يطلبها تقرير
+            self.loaded.pop(year, None)
+            print(f"تم أرشفة {len(new_rows)} طالب في السنة الدراسية {year}/{year + 1}")
+
+
+def text_cell(value):
+    """قيمة خلية كنص، والقيمة المفقودة كنص فارغ"""
+    return '' if value is None or pd.isna(value) else str(value)
+
+
+class DuplicateStudentCodesError(ValueError):
+    """أكواد طلاب مكررة في البيانات أو في طلاب جدد، وتواريخ الحضور والملاحظات محفوظة بالكود فيكتب أحدهم فوق الآخر"""
+    
+    def __init__(self, duplicates):
+        # الكود -> المجموعات التي يظهر فيها
+        self.duplicates = duplicates
+        listed = '، '.join(f"{code} ({' / '.join(groups)})" for code, groups in list(duplicates.items())[:20])
+        super().__init__(f"أكواد طلاب مكررة: {listed}")
+
+
+def duplicate_codes(groups_df):
+    """الأكواد التي تظهر في أكثر من صف (في نفس المجموعة أو مجموعات مختلفة) -> المجموعات التي تظهر فيها"""
+    frames = [
+        pd.DataFrame({'code': df['الكود'].astype(str).to_numpy(dtype=object), 'group': group_name})
+        for group_name, df in groups_df.items() if len(df)
+    ]
+    if not frames:
+        return {}
+    codes = pd.concat(frames, ignore_index=True)
+    repeated = codes[codes['code'].duplicated(keep=False)]
+    return {code: list(dict.fromkeys(groups)) for code, groups in repeated.groupby('code', sort=False)['group']}
+
+
+class StudentStorage:
+    """الواجهة المشتركة لطرق تخزين بيانات الطلاب
+
+    الجداول في الذاكرة (groups_df) هي ما تعرضه الواجهة، وطريقة التخزين مسؤولة عن
+    تحميلها وحفظها وعن تسجيل كل تعديل نقطي (حضور، دفع، إضافة أو حذف طالب) عليها
+    """
+    
+    def __init__(self, path, months):
+        self.path = path
+        self.months = list(months)
+        self.lock = threading.RLock()
+        self.groups_df = None
+        # فهرس كود الطالب -> (المجموعة، رقم الصف) لكل المجموعات
+        self.code_index = {}
+        # فهارس البحث (المجموعة، العمود) -> StudentSearchIndex وتبنى عند أول بحث
+        self.search_indexes = {}
+        # تواريخ الحضور لكل طالب
+        self.attendance = AttendanceHistory()
+        # نتائج الاختبارات المنظمة
+        self.tests = TestResults()
+        # كود الطالب -> الملاحظات، للطلاب الذين لهم ملاحظات فقط (الكود فريد في كل المجموعات، راجع build_indexes)
+        self.notes = {}
+        # ملخص كل مجموعة للإحصائيات
+        self.aggregates = GroupAggregates(self.months)
+        # رسالة خطأ آخر حفظ فشل، أو None إذا نجح آخر حفظ
+        self.save_error = None
+        # حصص كل مجموعة ومصفوفة الحضور (طالب × حصة) المبنية منها
+        self.calendar = SessionCalendar(self)
+        # تقارير المتابعة لكل المجموعات ونتائجها المحفوظة لكل إصدار من البيانات
+        self.reports = StudentReports(self)
+        # أول يوم في السنة الدراسية النشطة، وما قبله من حضور ودفع ينقل للأرشيف
+        first_month, first_year = parse_month_column(self.months[0])
+        self.year_start = date(first_year, first_month, 1)
+        self.archive = YearArchive(os.path.join(os.path.dirname(os.path.abspath(path)), ARCHIVE_DIR_NAME), first_month)
+    
+    @property
+    def pending_count(self):
+        """عدد التعديلات التي لم تكتب بعد في المخزن الدائم"""
+        return 0
+    
+    def build_indexes(self, session_rows=()):
+        """بناء الجداول المضغوطة والفهارس لكل المجموعات مرة واحدة بعد التحميل
+
+        تواريخ الحضور والاختبارات والملاحظات تقرأ من جداول الملف الكاملة، ثم يستبدل كل جدول بنسخته المضغوطة،
+        وsession_rows هي أيام الحصص المخزنة (المجموعة، اليوم)
+        """
+        # تواريخ الحضور مخزنة بالكود، والكود المكرر يجعل أحد الطالبين يأخذ تاريخ الآخر عند الحفظ
+        duplicates = duplicate_codes(self.groups_df)
+        if duplicates:
+            self.groups_df = None
+            raise DuplicateStudentCodesError(duplicates)
+        self.attendance = AttendanceHistory.from_groups(self.groups_df)
+        self.tests = TestResults.from_groups(self.groups_df)
+        self.notes = {}
+        for group_name in list(self.groups_df):
+            df = self.groups_df[group_name]
+            for student_id, note in zip(df['الكود'].values, df['ملاحظات'].values):
+                self.set_note(student_id, note)
+            self.groups_df[group_name] = compact_group_frame(df, self.months)
+        
+        self.code_index = {}
+        self.search_indexes = {}
+        for group_name in self.groups_df:
+            self.index_group(group_name)
+        # الملخصات تحسب عند أول عرض لكل مجموعة
+        self.aggregates = GroupAggregates(self.months)
+        self.calendar.reset(session_rows)
+    
+    def index_group(self, group_name):
+        """إعادة فهرسة طلاب مجموعة واحدة بعد تغير أرقام صفوفها (الكود لا يتكرر في كل المجموعات)"""
+        df = self.groups_df[group_name]
+        self.code_index.update(zip(df['الكود'].values, zip([group_name] * len(df), df.index)))
+    
+    def append_students(self, group_name, rows):
+        """إضافة طلاب جدد (صفوف بأعمدة الملف الكاملة) في آخر جدول المجموعة المضغوط وإلى الفهارس
+
+        الصف بكود موجود بالفعل يتجاهل كما تفعل قاعدة البيانات، وهذا يحدث فقط لتعديلات قديمة في السجل
+        كتبت قبل فحص الأكواد عند التسجيل
+        """
+        added = set()
+        kept = []
+        for row in rows:
+            student_id = str(row.get('الكود', ''))
+            if student_id not in self.code_index and student_id not in added:
+                added.add(student_id)
+                kept.append(row)
+        rows = kept
+        if not rows:
+            return
+        full_rows = normalize_group_frame(pd.DataFrame(rows), self.months)
+        new_rows = compact_group_frame(full_rows, self.months)
+        df = self.groups_df[group_name]
+        new_rows.index = pd.RangeIndex(len(df), len(df) + len(new_rows))
+        self.groups_df[group_name] = new_rows if df.empty else pd.concat([df, new_rows]).astype(FRAME_DTYPES)
+        
+        for student_index, student_id, history, tests, note in zip(
+            new_rows.index, full_rows['الكود'].values, full_rows['تواريخ_الحضور'].values,
+            full_rows['الاختبارات'].values, full_rows['ملاحظات'].values
+        ):
+            self.code_index[student_id] = (group_name, student_index)
+            self.attendance.add_student(group_name, student_id, history)
+            self.tests.add_text(group_name, student_id, tests)
+            self.set_note(student_id, note)
+        
+        # إضافة أسماء وأكواد الطلاب لفهارس البحث المبنية لهذه المجموعة
+        for (indexed_group, column), search_index in self.search_indexes.items():
+            if indexed_group == group_name:
+                for value in new_rows[column].values:
+                    search_index.add(value)
+        
+        self.aggregates.add_students(group_name, new_rows)
+    
+    def set_note(self, student_id, note):
+        """حفظ ملاحظات طالب خارج الجدول، والطلاب بدون ملاحظات لا يأخذون مساحة"""
+        note = '' if pd.isna(note) else str(note)
+        if note.strip() and note != 'nan':
+            self.notes[student_id] = note
+        else:
+            self.notes.pop(student_id, None)
+
+    def unindex_student(self, group_name, student_id, row=None):
+        """حذف طالب من الفهرس وإعادة ترقيم صفوف مجموعته
+
+        row هو صف الطالب المحذوف لخصمه من ملخص المجموعة، وبدونه يعاد حساب الملخص
+        """
+        student_id = str(student_id)
+        self.code_index.pop(student_id, None)
+        if group_name in self.groups_df:
+            self.index_group(group_name)
+        self.drop_search_indexes(group_name)
+        self.attendance.remove_student(student_id)
+        self.notes.pop(student_id, None)
+        self.tests.remove_student(student_id)
+        if row is not None:
+            self.aggregates.remove_student(group_name, row)
+        else:
+            self.aggregates.invalidate(group_name)
+    
+    def unindex_group(self, group_name):
+        """حذف كل طلاب مجموعة محذوفة من الفهرس"""
+        removed = [student_id for student_id, location in self.code_index.items() if location[0] == group_name]
+        for student_id in removed:
+            del self.code_index[student_id]
+        self.drop_search_indexes(group_name)
+        for student_id in self.attendance.codes_of(group_name):
+            self.notes.pop(student_id, None)
+        self.attendance.remove_group(group_name)
+        self.tests.remove_group(group_name)
+        self.aggregates.remove_group(group_name)
+    
+    def search_index(self, group_name, column):
+        """فهرس البحث لعمود في مجموعة، ويبنى مرة واحدة عند أول استخدام"""
+        key = (group_name, column)
+        search_index = self.search_indexes.get(key)
+        if search_index is None:
+            search_index = StudentSearchIndex(self.groups_df[group_name][column].dropna().astype(str))
+            self.search_indexes[key] = search_index
+        return search_index
+    
+    def drop_search_indexes(self, group_name):
+        """حذف فهارس بحث المجموعة ليعاد بناؤها عند البحث القادم"""
+        for key in [key for key in self.search_indexes if key[0] == group_name]:
+            del self.search_indexes[key]
+    
+    def archive_past_years(self, past_payments=None):
+        """نقل تواريخ الحضور وأعمدة الدفع الخاصة بالسنوات الدراسية السابقة من الذاكرة للأرشيف
+
+        past_payments: المجموعة -> جدول بعمود الكود وأعمدة دفع السنوات السابقة كما قرئت من المخزن.
+        عدد الحصص الحاضرة عداد لكل السنوات ولا يتغير، ويرجع المجموعات التي تغيرت
+        """
+        past_payments = past_payments or {}
+        records = defaultdict(dict)
+        changed_groups = set()
+        
+        def record_of(year, group_name, student_id, name):
+            key = (group_name, student_id)
+            if key not in records[year]:
+                records[year][key] = {
+                    'المجموعة': group_name, 'الكود': student_id, 'الاسم': name,
+                    'الحصص_الحاضرة': 0, 'تواريخ_الحضور': []
+                }
+            return records[year][key]
+        
+        for group_name, df in self.groups_df.items():
+            names = dict(zip(df['الكود'].values, df['الاسم'].values))
+            
+            payments = past_payments.get(group_name)
+            if payments is not None and len(payments.columns) > 1:
+                changed_groups.add(group_name)
+                for column in payments.columns.drop('الكود'):
+                    month, year = parse_month_column(column)
+                    year = academic_year_of(date(year, month, 1), self.archive.start_month)
+                    for student_id in payments.loc[payments[column].astype(bool), 'الكود'].astype(str):
+                        record_of(year, group_name, student_id, names.get(student_id, ''))[column] = True
+            
+            for student_id in df['الكود'].values:
+                if self.attendance.groups.get(student_id) != group_name:
+                    continue
+                past_days = self.attendance.split_before(student_id, self.year_start)
+                if not past_days:
+                    continue
+                changed_groups.add(group_name)
+                for day in past_days:
+                    record = record_of(academic_year_of(day, self.archive.start_month), group_name, student_id, names[student_id])
+                    record['الحصص_الحاضرة'] += 1
+                    record['تواريخ_الحضور'].append(day.isoformat())
+        
+        # حصص السنوات السابقة تنقل مع حضورها، وإلا حسبت غياباً لكل الطلاب
+        changed_groups |= self.calendar.split_before(self.year_start)
+        
+        if records:
+            # نسخة من ملف البيانات كما هو قبل الأرشفة، لأن الأرشفة تعيد كتابة الملف بدون ما نقل منه
+            backup_path = self.archive.backup_path_for(self.path)
+            os.makedirs(self.archive.directory, exist_ok=True)
+            self.write_backup(backup_path)
+            
+            moved = {}
+            for year, year_records in records.items():
+                for record in year_records.values():
+                    record['تواريخ_الحضور'] = '; '.join(record['تواريخ_الحضور'])
+                moved[year] = {
+                    'students': len(year_records),
+                    'attendance_days': sum(record['الحصص_الحاضرة'] for record in year_records.values()),
+                    'payment_columns': sorted({
+                        column for record in year_records.values() for column in record if column not in YearArchive.COLUMNS
+                    }),
+                    'groups': sorted({record['المجموعة'] for record in year_records.values()})
+                }
+            self.archive.write({year: list(year_records.values()) for year, year_records in records.items()})
+            self.archive.log(self.year_start, backup_path, moved)
+        
+        for group_name in changed_groups:
+            self.aggregates.invalidate(group_name)
+        return changed_groups
+
+    def write_backup(self, backup_path):
+        """نسخة كاملة من المخزن الدائم كما هو الآن في backup_path"""
+        raise NotImplementedError
+    
+    def archive_years(self):
+        """نقل حضور ودفع ما قبل السنة الدراسية النشطة للأرشيف وحذفه من المخزن، بطلب من المدير فقط
+
+        تسجل تعديل 'reload' حتى تعيد العمليات الأخرى قراءة المخزن بدلاً من إبقاء البيانات المؤرشفة في
+        ذاكرتها وكتابتها مرة أخرى، وترجع المجموعات التي تغيرت
+        """
+        raise NotImplementedError
+    
+    def load(self):
+        """تحميل كل المجموعات، أو None إذا لم تكن هناك بيانات بعد"""
+        raise NotImplementedError
+    
+    def initialize(self, groups_df):
+        """بدء مخزن جديد بالمجموعات المعطاة وحفظها فوراً"""
+        raise NotImplementedError
+    
+    def save(self, full=False):
+        """حفظ التعديلات المعلقة، أو كل البيانات إذا كان full صحيحاً"""
+        raise NotImplementedError
+    
+    def find_student(self, student_id):
+        """البحث عن طالب بالكود وإرجاع (المجموعة، رقم الصف) أو (None, None)"""
+        return self.code_index.get(str(student_id), (None, None))
+    
+    def apply_attendance_event(self, event):
+        """تطبيق حدث حضور واحد (تسجيل أو خصم حصة) على العداد وتواريخ الحضور"""
+        df = self.groups_df.get(event['group'])
+        if df is None:
+            return False
+        
+        location = self.code_index.get(event['code'])
+        if location is None or location[0] != event['group']:
+            return False
+        student_index = location[1]
+        
+        if event['op'] == 'attend':
+            df.loc[student_index, 'الحصص_الحاضرة'] += 1
+            self.attendance.append(event['code'], event['date'])
+            # يوم الحضور حصة عقدتها المجموعة، وتبقى حتى لو ألغي الحضور
+            self.calendar.add(event['group'], [event['date']])
+            self.aggregates.add_attendance(event['group'], 1)
+        
+        elif event['op'] == 'unattend':
+            if df.loc[student_index, 'الحصص_الحاضرة'] <= 0:
+                return False
+            df.loc[student_index, 'الحصص_الحاضرة'] -= 1
+            # إزالة آخر تاريخ حضور
+            self.attendance.pop(event['code'])
+            self.aggregates.add_attendance(event['group'], -1)
+        
+        return True
+    
+    def apply_event(self, event):
+        """تطبيق تعديل واحد (من هذه العملية أو من عملية أخرى) على الجداول في الذاكرة"""
+        op = event['op']
+        if op == 'reload':
+            # catch_up يعيد قراءة المخزن كاملاً عند هذا التعديل، ولا شيء يطبق على الجداول نفسها
+            return False
+        group_name = event['group']
+        if op in ('attend', 'unattend'):
+            return self.apply_attendance_event(event)
+        
+        if op == 'add_group':
+            if group_name in self.groups_df:
+                return False
+            self.groups_df[group_name] = empty_group_frame()
+            return True
+        
+        df = self.groups_df.get(group_name)
+        if df is None:
+            return False
+        
+        if op == 'delete_group':
+            del self.groups_df[group_name]
+            self.unindex_group(group_name)
+            self.calendar.drop_group(group_name)
+            return True
+        
+        if op == 'sessions':
+            if event['held']:
+                self.calendar.add(group_name, event['dates'])
+            else:
+                self.calendar.remove(group_name, event['dates'])
+            self.aggregates.touch(group_name)
+            return True
+        
+        if op == 'add_students':
+            self.append_students(group_name, event['rows'])
+            return True
+        
+        location = self.code_index.get(event['code'])
+        if location is None or location[0] != group_name:
+            return False
+        student_index = location[1]
+        
+        if op == 'payments':
+            # تحديث ملخص المجموعة بالأشهر التي تغيرت فقط
+            mask = int(df.at[student_index, PAYMENTS_COLUMN])
+            for month, paid in event['values'].items():
+                if month not in self.months:
+                    continue
+                bit = 1 << self.months.index(month)
+                if bool(mask & bit) != bool(paid):
+                    self.aggregates.add_payment(group_name, month, 1 if paid else -1)
+                    mask ^= bit
+            df.at[student_index, PAYMENTS_COLUMN] = mask
+        
+        elif op == 'test':
+            self.tests.add_entry(group_name, event['code'], event['entry'])
+            self.aggregates.touch(group_name)
+        
+        elif op == 'delete_student':
+            row = df.loc[student_index]
+            self.groups_df[group_name] = df.drop(student_index).reset_index(drop=True)
+            self.unindex_student(group_name, event['code'], row)
+        
+        else:
+            return False
+        return True
+    
+    def full_frame(self, group_name, positions=None):
+        """صفوف مجموعة بأعمدة الملف الكاملة (أعمدة الأشهر والملاحظات والحضور والاختبارات)
+
+        تبنى للصفوف المطلوبة فقط عند الحفظ أو التصدير أو العرض، والجدول في الذاكرة يبقى مضغوطاً
+        """
+        df = self.groups_df[group_name]
+        if positions is not None:
+            df = df.iloc[positions]
+        codes = df['الكود'].to_numpy(dtype=object)
+        tests = self.tests.text_by_student(group_name)
+        flags = month_flags(df[PAYMENTS_COLUMN].to_numpy(), len(self.months))
+        
+        columns = {column: df[column] for column in ('الكود', 'الاسم', 'رقم_الهاتف', 'ولي_الامر', 'الحصص_الحاضرة')}
+        columns.update({month: flags[:, position] for position, month in enumerate(self.months)})
+        columns['تواريخ_الحضور'] = [self.attendance.legacy_string(student_id) for student_id in codes]
+        columns['تاريخ_التسجيل'] = df['تاريخ_التسجيل'].astype(object)
+        columns['ملاحظات'] = [self.notes.get(student_id, '') for student_id in codes]
+        columns['الاختبارات'] = [tests.get(student_id, '') for student_id in codes]
+        return pd.DataFrame(columns, index=df.index)
+    
+    def memory_report(self):
+        """استهلاك الذاكرة لكل مجموعة بالبايت: الجدول المضغوط، وتواريخ الحضور، والملاحظات، والاختبارات"""
+        history_bytes = defaultdict(int)
+        notes_bytes = defaultdict(int)
+        for student_id, days in self.attendance.dates.items():
+            group_name = self.attendance.groups.get(student_id)
+            history_bytes[group_name] += len(days) * days.itemsize
+            if student_id in self.notes:
+                notes_bytes[group_name] += len(self.notes[student_id].encode('utf-8'))
+        
+        tests = self.tests.get_frame()
+        tests_bytes = {
+            group_name: int(frame.memory_usage(deep=True).sum())
+            for group_name, frame in tests.groupby('group', sort=False)
+        }
+        
+        rows = []
+        for group_name, df in self.groups_df.items():
+            row = {
+                'المجموعة': group_name,
+                'عدد_الطلاب': len(df),
+                'الجدول': int(df.memory_usage(deep=True).sum()),
+                'تواريخ_الحضور': history_bytes[group_name],
+                'الملاحظات': notes_bytes[group_name],
+                'الاختبارات': tests_bytes.get(group_name, 0)
+            }
+            row['الإجمالي'] = row['الجدول'] + row['تواريخ_الحضور'] + row['الملاحظات'] + row['الاختبارات']
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def check_new_codes(self, changes):
+        """رفض إضافة طلاب بأكواد موجودة في أي مجموعة أو مكررة في نفس التعديلات
+
+        تستدعى تحت قفل الكتابة بعد اللحاق بتعديلات العمليات الأخرى، لأن فحص الواجهة قبل الإضافة لا يمنع
+        جلستين أو عمليتين من إضافة نفس الكود في نفس الوقت
+        """
+        added = {}
+        duplicates = {}
+        for change in changes:
+            if change['op'] != 'add_students':
+                continue
+            for row in change['rows']:
+                student_id = str(row.get('الكود', ''))
+                location = self.code_index.get(student_id)
+                first_group = location[0] if location is not None else added.get(student_id)
+                if first_group is not None:
+                    duplicates[student_id] = [first_group, change['group']]
+                added[student_id] = change['group']
+        if duplicates:
+            raise DuplicateStudentCodesError(duplicates)
+    
+    def commit(self, changes):
+        """تسجيل تعديلات (قواميس بها op و group) في المخزن الدائم ثم تطبيقها على الجداول في الذاكرة
+
+        كل طريقة تخزين تأخذ قفل الكتابة المشترك بين العمليات وتلحق بتعديلات العمليات الأخرى أولاً
+        حتى لا يكتب تعديل فوق آخر، وترجع التعديلات بأرقامها التسلسلية (رقم إصدار البيانات)
+        """
+        raise NotImplementedError
+    
+    def catch_up(self):
+        """تطبيق التعديلات التي سجلتها عمليات أخرى منذ آخر قراءة وإرجاع الجداول في الذاكرة"""
+        raise NotImplementedError
+    
+    def record_attendance(self, group_name, student_id, op, day):
+        """تسجيل حضور أو خصم حصة وتطبيقه على الجداول في الذاكرة"""
+        return self.commit([{'op': op, 'group': group_name, 'code': str(student_id), 'date': day}])[0]
+    
+    def record_attendance_batch(self, marks):
+        """تسجيل حضور عدة طلاب (المجموعة، الكود، اليوم) كمعاملة واحدة"""
+        return self.commit([
+            {'op': 'attend', 'group': group_name, 'code': str(student_id), 'date': day}
+            for group_name, student_id, day in marks
+        ])
+    
+    def update_payments(self, group_name, student_id, statuses):
+        """تعديل حالة دفع طالب (الشهر -> مدفوع أم لا)"""
+        values = {month: bool(paid) for month, paid in statuses.items()}
+        return self.commit([{'op': 'payments', 'group': group_name, 'code': str(student_id), 'values': values}])[0]
+    
+    def add_test_result(self, group_name, student_id, test_name, score, max_score=None, test_date=None):
+        """إضافة نتيجة اختبار لطالب بنفس صيغة عمود الاختبارات"""
+        entry = TestResults.format_entry(test_name, score, max_score, test_date)
+        return self.commit([{'op': 'test', 'group': group_name, 'code': str(student_id), 'entry': entry}])[0]
+    
+    def set_sessions(self, group_name, days, held=True):
+        """إضافة أيام حصص للمجموعة، أو حذفها إذا كان held خطأ"""
+        dates = sorted({day if isinstance(day, str) else day.isoformat() for day in days})
+        return self.commit([{'op': 'sessions', 'group': group_name, 'dates': dates, 'held': bool(held)}])[0]
+    
+    def add_student(self, group_name, row):
+        """إضافة طالب جديد في آخر جدول المجموعة (row: اسم عمود الملف -> القيمة)"""
+        return self.add_students(group_name, [row])
+    
+    def add_students(self, group_name, rows):
+        """إضافة عدة طلاب معاً في آخر جدول المجموعة كتعديل واحد"""
+        return self.commit([{'op': 'add_students', 'group': group_name, 'rows': list(rows)}])[0]
+    
+    def delete_student(self, group_name, student_id):
+        """حذف طالب من مجموعته"""
+        return self.commit([{'op': 'delete_student', 'group': group_name, 'code': str(student_id)}])[0]
+    
+    def add_group(self, group_name):
+        """إنشاء مجموعة جديدة فارغة"""
+        return self.commit([{'op': 'add_group', 'group': group_name}])[0]
+    
+    def delete_group(self, group_name):
+        """حذف مجموعة بكل طلابها"""
+        return self.commit([{'op': 'delete_group', 'group': group_name}])[0]
+    
+    def export_excel(self):
+        """تصدير البيانات الحالية كملف إكسل"""
+        return export_groups_to_excel({group_name: self.full_frame(group_name) for group_name in self.groups_df})
+    
+    def export_chunks(self, group_names, dataset='students', columns=None, date_from=None, date_to=None, chunk_rows=EXPORT_CHUNK_ROWS):
+        """دفعات (المجموعة، جدول) للتصدير بدون نسخ المجموعات كاملة
+
+        dataset='students' يصدر صفوف الطلاب مع فلتر تاريخ التسجيل،
+        و'attendance' يصدر صفاً لكل يوم حضور مع فلتر تاريخ الحضور
+        """
+        start = pd.Timestamp(date_from) if date_from else None
+        end = pd.Timestamp(date_to) if date_to else None
+        
+        def in_range(days):
+            mask = np.ones(len(days), dtype=bool)
+            if start is not None:
+                mask &= (days >= start).to_numpy()
+            if end is not None:
+                mask &= (days <= end).to_numpy()
+            return mask
+        
+        for group_name in group_names:
+            df = self.groups_df[group_name]
+            
+            if dataset == 'attendance':
+                names = dict(zip(df['الكود'].values, df['الاسم'].values))
+                for frame in self.attendance.iter_frames(group_name, chunk_rows):
+                    frame = frame[in_range(frame['date'])]
+                    chunk = pd.DataFrame({
+                        'الكود': frame['student_id'].values,
+                        'الاسم': frame['student_id'].map(names).values,
+                        'المجموعة': group_name,
+                        'التاريخ': frame['date'].dt.date.values
+                    })
+                    if not chunk.empty:
+                        yield group_name, chunk[columns or ATTENDANCE_EXPORT_COLUMNS]
+                continue
+            
+            positions = np.arange(len(df))
+            if start is not None or end is not None:
+                positions = np.flatnonzero(in_range(pd.to_datetime(df['تاريخ_التسجيل'].astype(object), errors='coerce')))
+            
+            for offset in range(0, len(positions), chunk_rows):
+                chunk = self.full_frame(group_name, positions[offset:offset + chunk_rows])
+                if columns:
+                    chunk = chunk[columns]
+                # عمود المجموعة مطلوب فقط عند تصدير أكثر من مجموعة في ملف واحد
+                if len(group_names) > 1 and 'المجموعة' not in chunk.columns:
+                    chunk = chunk.assign(**{'المجموعة': group_name})
+                yield group_name, chunk
+
+
+class ExcelStorage(StudentStorage):
+    """تخزين البيانات في ملف إكسل (ورقة لكل مجموعة) مع سجل تعديلات إلحاقي
+
+    تُكتب أوراق المجموعات المعدلة فقط، ويتم استبدال الملف دفعة واحدة عن طريق ملف مؤقت.
+    أكثر من عملية يمكنها استخدام نفس الملف: كل تعديل يكتب في السجل والقفل على الملف مأخوذ،
+    وكل عملية تلحق بتعديلات الأخرى من السجل بدلاً من إعادة قراءة ملف الإكسل كاملاً
+    """
+    
+    def __init__(self, excel_path, months):
+        super().__init__(excel_path, months)
+        self.journal = ChangeJournal(
+            os.path.join(os.path.dirname(os.path.abspath(excel_path)), "students_attendance_journal.jsonl")
+        )
+        # قفل مشترك بين كل العمليات والجلسات التي تستخدم نفس الملف
+        self.lock = InterProcessLock(f"{os.path.abspath(excel_path)}.lock")
+        # بصمة الملف التي تطابق الجداول الموجودة في الذاكرة
+        self.signature = None
+        # كائن openpyxl المطابق للملف لإعادة كتابة الأوراق المعدلة فقط
+        self.workbook = None
+        # المجموعات التي تغيرت منذ آخر حفظ بدون تسجيلها في السجل
+        self.dirty_groups = set()
+        # أعمدة دفع السنوات السابقة لكل مجموعة كما قرئت من الملف، وتكتب معها في كل حفظ حتى تؤرشف
+        self.past_payments = {}
+    
+    @property
+    def pending_count(self):
+        return self.journal.pending_count
+    
+    def load(self):
+        with self.lock:
+            if not os.path.exists(self.path):
+                print("ملف البيانات غير موجود، سيتم إنشاء ملف جديد")
+                self.journal.reset(0)
+                return None
+            
+            # الجداول في الذاكرة تكفي مع تطبيق التعديلات الجديدة من السجل
+            if self.groups_df is not None:
+                return self.catch_up()
+            return self.reload()
+    
+    def reload(self):
+        """قراءة ملف الإكسل كاملاً ثم تطبيق تعديلات السجل التي لم تدمج فيه"""
+        with self.lock:
+            past_payments = {}
+            session_rows = []
+            groups_df, compacted_seq = read_excel_groups(self.path, self.months, past_payments, session_rows)
+            
+            # إذا كان الملف فارغاً أو به مشاكل
+            if not groups_df:
+                return None
+            
+            self.groups_df = groups_df
+            self.past_payments = past_payments
+            self.signature = _file_signature(self.path)
+            self.workbook = None
+            self.dirty_groups = set()
+            self.build_indexes(session_rows)
+            
+            # إعادة تطبيق التعديلات التي لم تدمج في الملف قبل آخر إغلاق أو كتبتها عمليات أخرى
+            self.journal.reset(compacted_seq)
+            self.apply_journal(self.journal.read_new_events())
+            
+            print(f"تم تحميل البيانات بنجاح. عدد المجموعات: {len(self.groups_df)}")
+            return self.groups_df
+    
+    def initialize(self, groups_df):
+        with self.lock:
+            self.groups_df = groups_df
+            self.past_payments = {}
+            self.build_indexes()
+            self.save(full=True)
+            return self.groups_df
+    
+    def apply_journal(self, events):
+        """تطبيق تعديلات مقروءة من السجل على البيانات في الذاكرة"""
+        for event in events:
+            self.apply_event(event)
+            self.journal.mark_applied(event)
+        
+        if events:
+            print(f"تم تطبيق {len(events)} تعديل من السجل")
+    
+    def catch_up(self):
+        """اللحاق بتعديلات العمليات الأخرى من السجل، وإعادة قراءة الملف فقط إذا حذفت منه تعديلات لم تطبق بعد"""
+        with self.lock:
+            signature = _file_signature(self.path)
+            file_changed = signature is not None and signature != self.signature
+            compacted_seq = read_journal_seq(self.path) if file_changed else self.journal.compacted_seq
+            if compacted_seq < self.journal.compacted_seq:
+                # الملف أقدم من آخر نسخة مطبقة (مثل استعادة نسخة احتياطية)
+                return self.reload()
+            
+            events = self.journal.read_new_events()
+            first_seq = events[0]['seq'] if events else max(compacted_seq, self.journal.applied_seq) + 1
+            if first_seq > self.journal.applied_seq + 1 or any(event['op'] == 'reload' for event in events):
+                # تعديلات دمجتها عملية أخرى في الملف وحذفتها من السجل قبل أن تطبق هنا، أو أرشفة أعادت كتابته
+                return self.reload()
+            
+            self.apply_journal(events)
+            
+            if file_changed:
+                # عملية أخرى حفظت الملف: الجداول في الذاكرة تطابقه الآن، وأوراقه تقرأ من جديد عند الحفظ القادم
+                self.signature = signature
+                self.workbook = None
+                self.journal.mark_compacted(compacted_seq)
+            return self.groups_df
+    
+    def commit(self, changes):
+        if not changes:
+            return []
+        with self.lock:
+            # تطبيق تعديلات العمليات الأخرى أولاً حتى يأخذ التعديل الجديد الرقم التالي لآخر إصدار
+            self.catch_up()
+            self.check_new_codes(changes)
+            events = self.journal.extend(changes)
+            for event in events:
+                self.apply_event(event)
+                self.journal.mark_applied(event)
+        return events
+    
+    def write_backup(self, backup_path):
+        shutil.copy2(self.path, backup_path)
+    
+    def archive_years(self):
+        with self.lock:
+            self.catch_up()
+            changed_groups = self.archive_past_years(self.past_payments)
+            if not changed_groups:
+                return changed_groups
+            
+            self.past_payments = {}
+            # يدمج في الملف مع الحفظ الكامل، والعمليات الأخرى تقرؤه من السجل فتعيد قراءة الملف
+            for event in self.journal.extend([{'op': 'reload'}]):
+                self.journal.mark_applied(event)
+            if not self.save(full=True):
+                raise OSError(self.save_error)
+            return changed_groups
+    
+    def sheet_frame(self, group_name):
+        """صفوف ورقة المجموعة في الملف: أعمدة المجموعة الكاملة وأعمدة دفع السنوات السابقة التي لم تؤرشف"""
+        df = self.full_frame(group_name)
+        payments = self.past_payments.get(group_name)
+        if payments is None or len(payments.columns) <= 1:
+            return df
+        past = payments.drop_duplicates('الكود').set_index('الكود')
+        # الطلاب المضافون بعد القراءة ليس لهم دفع في السنوات السابقة
+        return df.join(past, on='الكود').fillna({column: False for column in past.columns})
+    
+    def get_workbook(self):
+        """إرجاع كائن openpyxl المطابق للملف الحالي إن وجد، وإلا قراءته من الملف"""
+        if self.workbook is not None and self.signature == _file_signature(self.path):
+            return self.workbook
+        
+        if os.path.exists(self.path):
+            return load_workbook(self.path)
+        return None
+    
+    def save(self, full=False):
+        """حفظ المجموعات المعدلة فقط في ملف الإكسل بشكل ذري مع معالجة محسنة للأخطاء"""
+        self.lock.acquire()
+        self.save_error = None
+        try:
+            # لا يكتب الحفظ فوق تعديلات عمليات أخرى لم تطبق بعد
+            self.catch_up()
+            workbook = None if full else self.get_workbook()
+            
+            # المجموعات المعدلة بالإضافة للمجموعات التي بها أحداث حضور لم تدمج بعد
+            changed_groups = self.dirty_groups | self.journal.pending_groups
+            journal_seq = self.journal.applied_seq
+            
+            if workbook is None:
+                # كتابة كاملة لجميع المجموعات
+                workbook = Workbook()
+                workbook.remove(workbook.active)
+                groups_to_write = list(self.groups_df.keys())
+            else:
+                groups_to_write = [group for group in changed_groups if group in self.groups_df]
+                
+                # حذف أوراق المجموعات المحذوفة
+                for sheet_name in list(workbook.sheetnames):
+                    if sheet_name not in self.groups_df and sheet_name not in (META_SHEET_NAME, SESSIONS_SHEET_NAME):
+                        workbook.remove(workbook[sheet_name])
+                
+                if not changed_groups and journal_seq == self.journal.compacted_seq:
+                    print("لا توجد تغييرات تحتاج إلى حفظ")
+                    return True
+            
+            for group_name in groups_to_write:
+                write_group_sheet(workbook, group_name, self.sheet_frame(group_name))
+            write_sessions_sheet(workbook, self.calendar.rows())
+            write_meta_sheet(workbook, journal_seq)
+            
+            # الكتابة في ملف مؤقت في نفس المجلد ثم استبدال الملف الأصلي دفعة واحدة
+            target_dir = os.path.dirname(os.path.abspath(self.path))
+            fd, temp_path = tempfile.mkstemp(suffix='.xlsx', dir=target_dir)
+            os.close(fd)
+            try:
+                workbook.save(temp_path)
+                
+                # الاحتفاظ بالنسخة السابقة كنسخة احتياطية عن طريق رابط بدلاً من نسخ الملف
+                if os.path.exists(self.path):
+                    backup_path = f"{self.path}.backup"
+                    try:
+                        if os.path.exists(backup_path):
+                            os.remove(backup_path)
+                        os.link(self.path, backup_path)
+                    except OSError:
+                        pass
+                
+                os.replace(temp_path, self.path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            
+            self.dirty_groups.clear()
+            
+            # الأحداث أصبحت جزءاً من ملف الإكسل ويمكن حذفها من السجل
+            self.journal.discard_through(journal_seq)
+            
+            # الملف تغير، لذلك نربط الجداول في الذاكرة بالبصمة الجديدة بدلاً من إعادة القراءة
+            self.signature = _file_signature(self.path)
+            self.workbook = workbook
+            
+            print(f"تم حفظ البيانات بنجاح في {self.path} (المجموعات المكتوبة: {len(groups_to_write)})")
+            print(f"حجم الملف المحفوظ: {os.path.getsize(self.path)} بايت")
+            return True
+            
+        except Exception as e:
+            # الحفظ يعمل غالباً في خيط الحفظ بالخلفية، والواجهة تعرض الخطأ من عامل الحفظ وليس من هنا
+            print(f"خطأ في حفظ البيانات: {str(e)}")
+            self.save_error = str(e)
+            
+            # إلغاء النسخة المحفوظة من الملف حتى تتم إعادة قراءته في المرة القادمة
+            # الملف الأصلي لا يتغير إلا عند نجاح الكتابة، لذلك لا حاجة لاستعادة النسخة الاحتياطية
+            self.workbook = None
+            return False
+        finally:
+            self.lock.release()
+
+
+class SQLiteStorage(StudentStorage):
+    """تخزين البيانات في قاعدة SQLite بجداول منفصلة للطلاب والحضور والدفع والاختبارات
+
+    كل تعديل يُكتب كتحديث نقطي مفهرس بكود الطالب، وملف الإكسل يبقى للاستيراد والتصدير فقط
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS groups (
+            name TEXT PRIMARY KEY,
+            position INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL UNIQUE,
+            group_name TEXT NOT NULL REFERENCES groups(name) ON DELETE CASCADE,
+            name TEXT NOT NULL DEFAULT '',
+            phone TEXT NOT NULL DEFAULT '',
+            parent_phone TEXT NOT NULL DEFAULT '',
+            attended_sessions INTEGER NOT NULL DEFAULT 0,
+            registration_date TEXT,
+            notes TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS idx_students_group ON students(group_name, id);
+        CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL REFERENCES students(code) ON DELETE CASCADE ON UPDATE CASCADE,
+            day TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_attendance_code ON attendance(code, id);
+        CREATE INDEX IF NOT EXISTS idx_attendance_day ON attendance(day);
+        CREATE TABLE IF NOT EXISTS payments (
+            code TEXT NOT NULL REFERENCES students(code) ON DELETE CASCADE ON UPDATE CASCADE,
+            month TEXT NOT NULL,
+            PRIMARY KEY (code, month)
+        );
+        CREATE TABLE IF NOT EXISTS tests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL REFERENCES students(code) ON DELETE CASCADE ON UPDATE CASCADE,
+            entry TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tests_code ON tests(code, id);
+        CREATE TABLE IF NOT EXISTS sessions (
+            group_name TEXT NOT NULL REFERENCES groups(name) ON DELETE CASCADE,
+            day TEXT NOT NULL,
+            PRIMARY KEY (group_name, day)
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event TEXT NOT NULL
+        );
+    """
+    
+    # أعمدة جدول الطلاب المقابلة لأعمدة جدول المجموعة
+    STUDENT_COLUMNS = {
+        'الكود': 'code',
+        'الاسم': 'name',
+        'رقم_الهاتف': 'phone',
+        'ولي_الامر': 'parent_phone',
+        'الحصص_الحاضرة': 'attended_sessions',
+        'تاريخ_التسجيل': 'registration_date',
+        'ملاحظات': 'notes'
+    }
+    
+    def __init__(self, db_path, months, import_path=None):
+        super().__init__(db_path, months)
+        self.import_path = import_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(self.SCHEMA)
+        # رقم إصدار قاعدة البيانات الذي يطابق الجداول الموجودة في الذاكرة
+        self.data_version = None
+        # آخر رقم في جدول التعديلات تم تطبيقه على الجداول في الذاكرة
+        self.applied_seq = 0
+    
+    def get_data_version(self):
+        """يتغير هذا الرقم فقط عندما تكتب عملية أخرى في قاعدة البيانات"""
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+    
+    def begin_write(self):
+        """أخذ قفل الكتابة في قاعدة البيانات قبل اللحاق بتعديلات العمليات الأخرى (إن لم تكن هناك معاملة مفتوحة)"""
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN IMMEDIATE")
+    
+    def load(self):
+        with self.lock:
+            # الجداول في الذاكرة تكفي مع تطبيق التعديلات الجديدة من جدول التعديلات
+            if self.groups_df is not None:
+                return self.catch_up()
+            return self.reload()
+    
+    def reload(self):
+        """قراءة كل المجموعات من قاعدة البيانات من جديد"""
+        with self.lock:
+            # استيراد ملف الإكسل القديم عند أول تشغيل بقاعدة بيانات فارغة
+            has_groups = self.connection.execute("SELECT 1 FROM groups LIMIT 1").fetchone() is not None
+            if not has_groups and self.import_path and os.path.exists(self.import_path):
+                past_payments = {}
+                session_rows = []
+                groups_df, _ = read_excel_groups(self.import_path, self.months, past_payments, session_rows)
+                if groups_df:
+                    # الكود فريد في قاعدة البيانات، والصف المكرر كان سيُستبعد بملاحظاته وحضوره بدون أي رسالة
+                    duplicates = duplicate_codes(groups_df)
+                    if duplicates:
+                        raise DuplicateStudentCodesError(duplicates)
+                    self.write_all(groups_df, past_payments, session_rows)
+                    print(f"تم استيراد {len(groups_df)} مجموعة من {self.import_path}")
+            
+            # المجموعات ورقم آخر تعديل يقرآن من نفس اللقطة حتى لا يضيع تعديل أو يطبق مرتين
+            started = not self.connection.in_transaction
+            if started:
+                self.connection.execute("BEGIN")
+            try:
+                data_version = self.get_data_version()
+                applied_seq = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+                group_names = [row[0] for row in self.connection.execute(
+                    "SELECT name FROM groups ORDER BY position, rowid"
+                )]
+                groups_df = self.read_groups(group_names) if group_names else None
+                session_rows = self.connection.execute("SELECT group_name, day FROM sessions").fetchall()
+            finally:
+                if started:
+                    self.connection.commit()
+            
+            if not group_names:
+                return None
+            
+            self.groups_df = groups_df
+            self.data_version = data_version
+            self.applied_seq = applied_seq
+            self.build_indexes(session_rows)
+            
+            print(f"تم تحميل البيانات بنجاح. عدد المجموعات: {len(self.groups_df)}")
+            return self.groups_df
+    
+    def read_groups(self, group_names):
+        """بناء جداول المجموعات من الجداول المنفصلة في قاعدة البيانات"""
+        columns = ', '.join(f"{sql_name} AS '{name}'" for name, sql_name in self.STUDENT_COLUMNS.items())
+        students = pd.read_sql_query(
+            f"SELECT group_name, {columns} FROM students ORDER BY id", self.connection
+        )
+        
+        attendance = dict(self.connection.execute(
+            "SELECT code, group_concat(day, '; ') FROM (SELECT code, day FROM attendance ORDER BY id) GROUP BY code"
+        ).fetchall())
+        tests = dict(self.connection.execute(
+            "SELECT code, group_concat(entry, '; ') FROM (SELECT code, entry FROM tests ORDER BY id) GROUP BY code"
+        ).fetchall())
+        payments = pd.read_sql_query("SELECT code, month FROM payments", self.connection)
+        
+        students['تواريخ_الحضور'] = students['الكود'].map(attendance).fillna('')
+        students['الاختبارات'] = students['الكود'].map(tests).fillna('')
+        for month in self.months:
+            paid_codes = payments.loc[payments['month'] == month, 'code']
+            students[month] = students['الكود'].isin(paid_codes)
+        
+        groups_df = {}
+        for group_name in group_names:
+            df = students[students['group_name'] == group_name].drop(columns='group_name')
+            groups_df[group_name] = normalize_group_frame(df.reset_index(drop=True), self.months)
+        return groups_df
+    
+    def write_backup(self, backup_path):
+        # اتصال قراءة منفصل، لأن النسخ من اتصال بداخله معاملة كتابة مفتوحة (مثل الأرشفة) لا يكتمل أبداً
+        source = sqlite3.connect(self.path)
+        backup = sqlite3.connect(backup_path)
+        try:
+            source.backup(backup)
+        finally:
+            backup.close()
+            source.close()
+    
+    def archive_years(self):
+        with self.lock:
+            self.begin_write()
+            try:
+                self.catch_up()
+                past_payments = self.read_past_payments()
+                changed_groups = self.archive_past_years(past_payments)
+                if not changed_groups:
+                    self.connection.commit()
+                    return changed_groups
+                
+                past_columns = sorted({column for payments in past_payments.values() for column in payments.columns.drop('الكود')})
+                self.connection.executemany("DELETE FROM payments WHERE month = ?", [(month,) for month in past_columns])
+                self.connection.execute("DELETE FROM sessions WHERE day < ?", (self.year_start.isoformat(),))
+                # أيام الحضور الباقية في الذاكرة تحل محل كل أيام الطالب في قاعدة البيانات
+                for group_name in changed_groups:
+                    for student_id in self.groups_df[group_name]['الكود'].values:
+                        self.connection.execute("DELETE FROM attendance WHERE code = ?", (student_id,))
+                        self.write_text_entries('attendance', 'day', student_id, self.attendance.legacy_string(student_id))
+                self.applied_seq = self.connection.execute(
+                    "INSERT INTO changes (event) VALUES (?)",
+                    (json.dumps({'op': 'reload', 'ts': datetime.now().isoformat(timespec='seconds')}),)
+                ).lastrowid
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+            self.data_version = self.get_data_version()
+            return changed_groups
+    
+    def read_past_payments(self):
+        """أعمدة دفع السنوات الدراسية السابقة لكل مجموعة من جدول الدفع"""
+        payments = pd.read_sql_query("SELECT code, month FROM payments", self.connection)
+        past_columns = past_month_columns(payments['month'].unique(), self.months)
+        past_payments = {}
+        if not past_columns:
+            return past_payments
+        for group_name, df in self.groups_df.items():
+            frame = pd.DataFrame({'الكود': df['الكود'].values})
+            for month in past_columns:
+                frame[month] = frame['الكود'].isin(payments.loc[payments['month'] == month, 'code'])
+            past_payments[group_name] = frame
+        return past_payments
+    
+    def initialize(self, groups_df):
+        with self.lock:
+            self.write_all(groups_df)
+            self.groups_df = groups_df
+            self.data_version = self.get_data_version()
+            self.build_indexes()
+            return self.groups_df
+    
+    def insert_students(self, group_name, rows):
+        """إدخال صفوف طلاب مع حضورهم ودفعهم واختباراتهم (داخل معاملة مفتوحة)"""
+        for row in rows:
+            # الخلية الفارغة في الإكسل تقرأ كقيمة مفقودة وكانت ستحفظ كالنص 'nan'
+            values = [text_cell(row.get(name)) if name != 'الحصص_الحاضرة' else int(row.get(name, 0) or 0)
+                      for name in self.STUDENT_COLUMNS]
+            code = str(row.get('الكود', ''))
+            inserted = self.connection.execute(
+                f"INSERT OR IGNORE INTO students (group_name, {', '.join(self.STUDENT_COLUMNS.values())}) "
+                f"VALUES (?, {', '.join('?' for _ in self.STUDENT_COLUMNS)})",
+                [group_name] + values
+            ).rowcount
+            # الكود موجود بالفعل: حضور ودفع واختبارات الصف الجديد كانت ستضاف للطالب الموجود
+            if not inserted:
+                existing = self.connection.execute("SELECT group_name FROM students WHERE code = ?", (code,)).fetchone()
+                raise DuplicateStudentCodesError({code: [existing[0] if existing else group_name, group_name]})
+            self.write_text_entries('attendance', 'day', code, row.get('تواريخ_الحضور', ''))
+            self.write_text_entries('tests', 'entry', code, row.get('الاختبارات', ''))
+            self.connection.executemany(
+                "INSERT INTO payments (code, month) VALUES (?, ?)",
+                [(code, month) for month in self.months if bool(row.get(month, False))]
+            )
+    
+    def write_text_entries(self, table, column, code, text):
+        """تحويل النص القديم المفصول بـ ; إلى صفوف منفصلة"""
+        if pd.isna(text) or str(text) in ('', 'nan'):
+            return
+        entries = [entry.strip() for entry in str(text).split(';')]
+        self.connection.executemany(
+            f"INSERT INTO {table} (code, {column}) VALUES (?, ?)",
+            [(code, entry) for entry in entries if entry and entry != 'nan']
+        )
+    
+    def write_all(self, groups_df, past_payments=None, session_rows=()):
+        """استبدال كل محتوى قاعدة البيانات بالمجموعات المعطاة في معاملة واحدة
+
+        إذا لم تكن المجموعات هي الجداول في الذاكرة (استيراد أو بدء جديد) يسجل تعديل 'reload'
+        حتى تعيد العمليات الأخرى قراءة قاعدة البيانات كاملة. دفع السنوات السابقة ليس في الجداول في
+        الذاكرة، لذلك يبقى كما هو عند حفظ الجداول في الذاكرة، ويؤخذ من past_payments عند الاستيراد،
+        وكذلك أيام الحصص تؤخذ من session_rows عند الاستيراد
+        """
+        with self.connection:
+            kept_payments = []
+            if groups_df is self.groups_df:
+                kept_payments = self.connection.execute(
+                    f"SELECT code, month FROM payments WHERE month NOT IN ({', '.join('?' for _ in self.months)})",
+                    self.months
+                ).fetchall()
+            for payments in (past_payments or {}).values():
+                for month in payments.columns.drop('الكود'):
+                    kept_payments += [(code, month) for code in payments.loc[payments[month].astype(bool), 'الكود']]
+            
+            self.connection.execute("DELETE FROM groups")
+            for position, (group_name, df) in enumerate(groups_df.items()):
+                self.connection.execute("INSERT INTO groups (name, position) VALUES (?, ?)", (group_name, position))
+                # الجداول المضغوطة في الذاكرة تحول لأعمدة الملف الكاملة مجموعة بمجموعة
+                if groups_df is self.groups_df:
+                    df = self.full_frame(group_name)
+                self.insert_students(group_name, df.to_dict('records'))
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO payments (code, month) SELECT ?, ? WHERE EXISTS (SELECT 1 FROM students WHERE code = ?)",
+                [(code, month, code) for code, month in kept_payments]
+            )
+            # أيام الحضور حصص عقدتها المجموعة (مثل عند الاستيراد)، وباقي الحصص من الذاكرة عند حفظ الجداول فيها
+            self.connection.execute(
+                "INSERT OR IGNORE INTO sessions (group_name, day) "
+                "SELECT DISTINCT students.group_name, attendance.day FROM attendance JOIN students USING (code)"
+            )
+            if groups_df is self.groups_df:
+                session_rows = self.calendar.rows()
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO sessions (group_name, day) SELECT name, ? FROM groups WHERE name = ?",
+                [(day, group_name) for group_name, day in session_rows]
+            )
+            if groups_df is not self.groups_df:
+                self.applied_seq = self.connection.execute(
+                    "INSERT INTO changes (event) VALUES (?)",
+                    (json.dumps({'op': 'reload', 'ts': datetime.now().isoformat(timespec='seconds')}),)
+                ).lastrowid
+    
+    def save(self, full=False):
+        """كل التعديلات تكتب فوراً، والحفظ الكامل يعيد مزامنة قاعدة البيانات مع الجداول في الذاكرة"""
+        if not full:
+            return True
+        self.save_error = None
+        try:
+            with self.lock:
+                # اللحاق بتعديلات العمليات الأخرى قبل استبدال كل البيانات حتى لا يضيع أي منها
+                self.begin_write()
+                self.catch_up()
+                self.write_all(self.groups_df)
+                self.data_version = self.get_data_version()
+            print(f"تم حفظ البيانات بنجاح في {self.path}")
+            return True
+        except Exception as e:
+            if self.connection.in_transaction:
+                self.connection.rollback()
+            # الحفظ يعمل غالباً في خيط الحفظ بالخلفية، والواجهة تعرض الخطأ من عامل الحفظ وليس من هنا
+            print(f"خطأ في حفظ البيانات: {str(e)}")
+            self.save_error = str(e)
+            return False
+    
+    def catch_up(self):
+        """تطبيق التعديلات التي كتبتها عمليات أخرى في جدول التعديلات بدلاً من إعادة قراءة قاعدة البيانات
+
+        تعاد القراءة كاملة فقط إذا حذفت تعديلات لم تطبق بعد أو أعيدت كتابة كل البيانات
+        """
+        with self.lock:
+            # رقم الإصدار يقرأ قبل التعديلات، فأي تعديل يكتب بعدها يغيره ويقرأ في المرة القادمة
+            data_version = self.get_data_version()
+            if data_version == self.data_version:
+                return self.groups_df
+            
+            events = []
+            for seq, text in self.connection.execute(
+                "SELECT seq, event FROM changes WHERE seq > ? ORDER BY seq", (self.applied_seq,)
+            ).fetchall():
+                event = json.loads(text)
+                event['seq'] = seq
+                events.append(event)
+            
+            if (events and events[0]['seq'] != self.applied_seq + 1) or any(event['op'] == 'reload' for event in events):
+                return self.reload()
+            
+            for event in events:
+                self.apply_event(event)
+            if events:
+                self.applied_seq = events[-1]['seq']
+                print(f"تم تطبيق {len(events)} تعديل من عمليات أخرى")
+            self.data_version = data_version
+            return self.groups_df
+    
+    def commit(self, changes):
+        if not changes:
+            return []
+        with self.lock:
+            self.begin_write()
+            try:
+                self.catch_up()
+                self.check_new_codes(changes)
+                timestamp = datetime.now().isoformat(timespec='seconds')
+                events = []
+                for change in changes:
+                    event = dict(change, ts=timestamp)
+                    self.write_event(event)
+                    event['seq'] = self.connection.execute(
+                        "INSERT INTO changes (event) VALUES (?)",
+                        (json.dumps(event, ensure_ascii=False, default=_json_default),)
+                    ).lastrowid
+                    events.append(event)
+                # جدول التعديلات يحتفظ بآخرها فقط لتلحق بها العمليات الأخرى
+                self.connection.execute(
+                    "DELETE FROM changes WHERE seq <= ?", (events[-1]['seq'] - JOURNAL_RETAIN_EVENTS,)
+                )
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+            
+            for event in events:
+                self.apply_event(event)
+            self.applied_seq = events[-1]['seq']
+            self.data_version = self.get_data_version()
+        return events
+    
+    def write_event(self, event):
+        """كتابة تعديل واحد في جداول قاعدة البيانات كتحديث نقطي (داخل معاملة مفتوحة)"""
+        op = event['op']
+        code = event.get('code')
+        # الإضافات تتجاهل طالباً حذفته جلسة أخرى قبل وصول التعديل كما في الجداول في الذاكرة
+        student_exists = "WHERE EXISTS (SELECT 1 FROM students WHERE code = ?)"
+        if op == 'attend':
+            self.connection.execute(
+                f"INSERT INTO attendance (code, day) SELECT ?, ? {student_exists}", (code, event['date'], code)
+            )
+            self.connection.execute(
+                "UPDATE students SET attended_sessions = attended_sessions + 1 WHERE code = ?", (code,)
+            )
+            self.connection.execute(
+                "INSERT OR IGNORE INTO sessions (group_name, day) "
+                "SELECT group_name, ? FROM students WHERE code = ? AND group_name = ?", (event['date'], code, event['group'])
+            )
+        
+        elif op == 'unattend':
+            decremented = self.connection.execute(
+                "UPDATE students SET attended_sessions = attended_sessions - 1 "
+                "WHERE code = ? AND attended_sessions > 0", (code,)
+            ).rowcount
+            # مثل الجداول في الذاكرة: لا يحذف يوم حضور إذا كان العداد صفراً (خصم مكرر من جلستين)
+            if decremented == 1:
+                self.connection.execute(
+                    "DELETE FROM attendance WHERE id = (SELECT MAX(id) FROM attendance WHERE code = ?)", (code,)
+                )
+        
+        elif op == 'payments':
+            for month, paid in event['values'].items():
+                if paid:
+                    self.connection.execute(
+                        f"INSERT OR IGNORE INTO payments (code, month) SELECT ?, ? {student_exists}", (code, month, code)
+                    )
+                else:
+                    self.connection.execute(
+                        "DELETE FROM payments WHERE code = ? AND month = ?", (code, month)
+                    )
+        
+        elif op == 'test':
+            self.connection.execute(
+                f"INSERT INTO tests (code, entry) SELECT ?, ? {student_exists}", (code, event['entry'], code)
+            )
+        
+        elif op == 'sessions':
+            if event['held']:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO sessions (group_name, day) SELECT name, ? FROM groups WHERE name = ?",
+                    [(day, event['group']) for day in event['dates']]
+                )
+            else:
+                self.connection.executemany(
+                    "DELETE FROM sessions WHERE group_name = ? AND day = ?", [(event['group'], day) for day in event['dates']]
+                )
+        
+        elif op == 'add_students':
+            self.insert_students(event['group'], event['rows'])
+        
+        elif op == 'delete_student':
+            self.connection.execute("DELETE FROM students WHERE code = ?", (code,))
+        
+        elif op == 'add_group':
+            self.connection.execute(
+                "INSERT OR IGNORE INTO groups (name, position) "
+                "VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM groups))",
+                (event['group'],)
+            )
+        
+        elif op == 'delete_group':
+            self.connection.execute("DELETE FROM groups WHERE name = ?", (event['group'],))
+
+
+@st.cache_resource
+def _shared_storage(backend, path, months):
+    """طريقة تخزين واحدة مشتركة على مستوى العملية بين إعادات تشغيل Streamlit والجلسات"""
+    if backend == "sqlite":
+        return SQLiteStorage(path, months, import_path="students_data.xlsx")
+    return ExcelStorage(path, months)
+
+
+# عدد آخر القياسات المحفوظة لكل مرحلة لحساب النسب المئوية المتحركة
+METRICS_WINDOW = 500
+# النسب المئوية المعروضة والمصدرة لزمن كل مرحلة
+METRICS_QUANTILES = [0.5, 0.95, 0.99]
+# ملف نص Prometheus (لقارئ ملفات node_exporter) تكتب فيه المقاييس، والتصدير معطل إذا كان فارغاً
+METRICS_PROMETHEUS_PATH = os.environ.get("STUDENTS_METRICS_PROMETHEUS", "")
+# ملف سجل يضاف إليه سطر JSON بمراحل كل إعادة تشغيل، والتسجيل معطل إذا كان فارغاً
+METRICS_LOG_PATH = os.environ.get("STUDENTS_METRICS_LOG", "")
+# أقل فترة (بالثواني) بين كل كتابة لملف Prometheus
+METRICS_EXPORT_INTERVAL = float(os.environ.get("STUDENTS_METRICS_EXPORT_INTERVAL", 15))
+
+
+class HotPathMetrics:
+    """أزمنة وعدادات المسارات الساخنة: التحميل والحفظ ومسح QR وعرض الإحصائيات
+
+    زمن كل مرحلة يضاف لنافذة متحركة من آخر القياسات تحسب منها النسب المئوية، ولقائمة مراحل إعادة
+    التشغيل الحالية في خيط الواجهة فقط، لذلك قياسات الخيوط الخلفية تدخل في النسب ولا تختلط بمراحل
+    جلسة أخرى
+    """
+    
+    def __init__(self, window=METRICS_WINDOW, prometheus_path=METRICS_PROMETHEUS_PATH, log_path=METRICS_LOG_PATH,
+                 export_interval=METRICS_EXPORT_INTERVAL):
+        self.prometheus_path = prometheus_path
+        self.log_path = log_path
+        self.export_interval = export_interval
+        self.lock = threading.Lock()
+        # المرحلة -> آخر الأزمنة بالمللي ثانية
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        # المرحلة -> عدد المرات ومجموع الأزمنة وعدد الأخطاء منذ بدء البرنامج
+        self.calls = defaultdict(int)
+        self.totals_ms = defaultdict(float)
+        self.errors = defaultdict(int)
+        self.counters = defaultdict(int)
+        # مراحل إعادة التشغيل الحالية لكل خيط
+        self.local = threading.local()
+        self.last_export = 0.0
+        self.export_error = None
+    
+    def begin_run(self):
+        """بداية إعادة تشغيل جديدة للواجهة في الخيط الحالي"""
+        self.local.started = time.perf_counter()
+        self.local.spans = []
+        self.local.depth = 0
+        self.count('reruns')
+    
+    @property
+    def run_spans(self):
+        """مراحل إعادة التشغيل الحالية: (المرحلة، بدايتها من أول التشغيل، زمنها، مستوى التداخل) بالمللي ثانية"""
+        return getattr(self.local, 'spans', [])
+    
+    @contextmanager
+    def span(self, name):
+        """قياس زمن ما بداخله كمرحلة باسم name، والاستثناء يحسب خطأ ثم يكمل طريقه"""
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.local.depth = depth
+            duration_ms = (time.perf_counter() - started) * 1000
+            self.record(name, duration_ms, failed)
+            spans = getattr(self.local, 'spans', None)
+            if spans is not None:
+                spans.append((name, (started - self.local.started) * 1000, duration_ms, depth))
+    
+    def record(self, name, duration_ms, failed=False):
+        with self.lock:
+            self.samples[name].append(duration_ms)
+            self.calls[name] += 1
+            self.totals_ms[name] += duration_ms
+            if failed:
+                self.errors[name] += 1
+    
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+    
+    def end_run(self):
+        """إنهاء إعادة التشغيل الحالية: تسجيل زمنها الكلي وتصدير المقاييس إذا كان مفعلاً"""
+        started = getattr(self.local, 'started', None)
+        if started is None:
+            return
+        self.record('rerun', (time.perf_counter() - started) * 1000)
+        try:
+            if self.log_path:
+                self.append_log()
+            if self.prometheus_path and time.monotonic() - self.last_export >= self.export_interval:
+                self.export_prometheus()
+            self.export_error = None
+        except OSError as e:
+            self.export_error = str(e)
+            print(f"خطأ في تصدير مقاييس الأداء: {self.export_error}")
+    
+    def summary(self):
+        """لكل مرحلة: عدد المرات والأخطاء والمتوسط والنسب المئوية والأعلى لآخر القياسات بالمللي ثانية"""
+        with self.lock:
+            windows = {name: np.fromiter(samples, dtype=float) for name, samples in self.samples.items()}
+            calls = dict(self.calls)
+            errors = dict(self.errors)
+        if not windows:
+            return pd.DataFrame()
+        
+        rows = []
+        for name, values in sorted(windows.items()):
+            quantiles = np.quantile(values, METRICS_QUANTILES)
+            row = {'المرحلة': name, 'المرات': calls[name], 'الأخطاء': errors.get(name, 0), 'المتوسط': values.mean()}
+            row.update({f"p{int(q * 100)}": value for q, value in zip(METRICS_QUANTILES, quantiles)})
+            row['الأعلى'] = values.max()
+            rows.append(row)
+        return pd.DataFrame(rows).set_index('المرحلة').round(1)
+    
+    def append_log(self):
+        record = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'spans': [
+                {'name': name, 'start_ms': round(start_ms, 2), 'duration_ms': round(duration_ms, 2), 'depth': depth}
+                for name, start_ms, duration_ms, depth in self.run_spans
+            ]
+        }
+        with self.lock, open(self.log_path, 'a', encoding='utf-8') as log_file:
+            log_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+    
+    def prometheus_text(self):
+        """المقاييس بصيغة نص Prometheus: ملخص زمن لكل مرحلة بالثواني وعدادات الأخطاء والأحداث"""
+        with self.lock:
+            windows = {name: sorted(samples) for name, samples in self.samples.items()}
+            calls = dict(self.calls)
+            totals_ms = dict(self.totals_ms)
+            errors = dict(self.errors)
+            counters = dict(self.counters)
+        
+        lines = [
+            "# HELP students_span_seconds Duration of instrumented hot-path spans over the recent window.",
+            "# TYPE students_span_seconds summary"
+        ]
+        for name, values in sorted(windows.items()):
+            for q, value in zip(METRICS_QUANTILES, np.quantile(values, METRICS_QUANTILES)):
+                lines.append(f'students_span_seconds{{span="{name}",quantile="{q:g}"}} {value / 1000:.6f}')
+            lines.append(f'students_span_seconds_sum{{span="{name}"}} {totals_ms[name] / 1000:.6f}')
+            lines.append(f'students_span_seconds_count{{span="{name}"}} {calls[name]}')
+        lines += [
+            "# HELP students_span_errors_total Spans that ended with an exception.",
+            "# TYPE students_span_errors_total counter"
+        ]
+        lines += [f'students_span_errors_total{{span="{name}"}} {errors.get(name, 0)}' for name in sorted(windows)]
+        lines += [
+            "# HELP students_events_total Counted application events.",
+            "# TYPE students_events_total counter"
+        ]
+        lines += [f'students_events_total{{event="{name}"}} {value}' for name, value in sorted(counters.items())]
+        return '\n'.join(lines) + '\n'
+    
+    def export_prometheus(self):
+        # الكتابة في ملف مؤقت ثم استبداله حتى لا يقرأ المجمع ملفاً نصف مكتوب
+        temp_path = f"{self.prometheus_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(self.prometheus_text())
+        os.replace(temp_path, self.prometheus_path)
+        self.last_export = time.monotonic()
+    
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.calls.clear()
+            self.totals_ms.clear()
+            self.errors.clear()
+            self.counters.clear()
+
+
+@st.cache_resource
+def _shared_metrics():
+    """مقاييس أداء واحدة مشتركة بين إعادات التشغيل والجلسات والخيوط الخلفية"""
+    return HotPathMetrics()
+
+
+def timed(name):
+    """قياس زمن دالة من دوال الواجهة كمرحلة في self.metrics"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.span(name):
+                return function(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# الفترة (بالثواني) التي تجمع خلالها طلبات الحفظ المتتالية في حفظ واحد بالخلفية
+SAVE_FLUSH_INTERVAL = float(os.environ.get("STUDENTS_SAVE_FLUSH_INTERVAL", 5))
+
+
+class SaveWorker:
+    """حفظ بالخلفية: الواجهة تطلب الحفظ وترجع فوراً، وخيط خلفي يجمع الطلبات المتتالية في حفظ واحد
+
+    كل تعديل مسجل بالفعل في السجل أو قاعدة البيانات عند حدوثه، لذلك تأخير الحفظ لا يضيع أي تعديل،
+    والحفظ يتم فوراً عند زر الحفظ اليدوي وعند إغلاق البرنامج
+    """
+    
+    def __init__(self, storage, interval=SAVE_FLUSH_INTERVAL, metrics=None):
+        self.storage = storage
+        self.interval = interval
+        self.metrics = metrics
+        # كل طلب حفظ هو قيمة full الخاصة به
+        self.requests = queue.Queue()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        # حفظ واحد فقط في نفس الوقت سواء من الخيط الخلفي أو من الحفظ الفوري
+        self.save_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.last_save = None
+        self.last_duration = 0.0
+        # عدد الطلبات التي جمعها آخر حفظ
+        self.last_coalesced = 0
+        self.error = None
+        atexit.register(self.shutdown)
+    
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    @property
+    def pending(self):
+        """عدد طلبات الحفظ التي لم تنفذ بعد"""
+        return self.requests.qsize()
+    
+    def request(self, full=False):
+        """طلب حفظ بالخلفية بدون انتظار"""
+        self.requests.put(full)
+        with self.start_lock:
+            if not self.is_running and not self.stop_event.is_set():
+                self.thread = threading.Thread(target=self.run, name="save-worker", daemon=True)
+                self.thread.start()
+    
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                full = self.requests.get(timeout=1)
+            except queue.Empty:
+                continue
+            
+            # انتظار باقي طلبات الفترة لدمجها في نفس الحفظ، والإيقاف يقطع الانتظار
+            self.stop_event.wait(self.interval)
+            count, pending_full = self.drain()
+            self.save(full or pending_full, count + 1)
+    
+    def drain(self):
+        """سحب كل الطلبات المنتظرة وإرجاع (عددها، هل أحدها حفظ كامل)"""
+        count = 0
+        full = False
+        while True:
+            try:
+                full = self.requests.get_nowait() or full
+            except queue.Empty:
+                return count, full
+            count += 1
+    
+    def save(self, full, count):
+        with self.save_lock:
+            if self.storage.groups_df is None:
+                return True
+            
+            started = time.perf_counter()
+            try:
+                saved = self.storage.save(full=full)
+                error = None if saved else (self.storage.save_error or "تعذر الحفظ، راجع سجل البرنامج")
+            except Exception as e:
+                saved, error = False, str(e)
+                print(f"خطأ في الحفظ بالخلفية: {error}")
+            
+            self.last_save = datetime.now()
+            self.last_duration = time.perf_counter() - started
+            self.last_coalesced = count
+            self.error = error
+            if self.metrics is not None:
+                self.metrics.record('storage_save', self.last_duration * 1000, not saved)
+                self.metrics.count('save_requests', count)
+            return saved
+    
+    def flush(self, full=False):
+        """تنفيذ كل طلبات الحفظ المنتظرة فوراً وانتظار انتهائها"""
+        count, pending_full = self.drain()
+        return self.save(full or pending_full, count)
+    
+    def shutdown(self):
+        """إيقاف الخيط الخلفي مع حفظ أخير مضمون عند إغلاق البرنامج"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=60)
+        self.flush()
+
+
+@st.cache_resource
+def _shared_save_worker(backend, path, months):
+    """عامل حفظ بالخلفية واحد لكل طريقة تخزين مشتركة"""
+    return SaveWorker(_shared_storage(backend, path, months), metrics=_shared_metrics())
+
+
+# مفتاح جدول Google Sheets الذي تنسخ إليه المجموعات، والمزامنة معطلة إذا كان فارغاً
+SHEETS_SPREADSHEET_KEY = os.environ.get("STUDENTS_SHEETS_KEY", "")
+# ملف بيانات حساب الخدمة المستخدم في الاتصال بـ Google Sheets
+SHEETS_CREDENTIALS_PATH = os.environ.get("STUDENTS_SHEETS_CREDENTIALS", "service_account.json")
+# الفترة (بالثواني) بين كل فحص للتعديلات التي لم ترسل بعد إلى Google Sheets
+SHEETS_SYNC_INTERVAL = float(os.environ.get("STUDENTS_SHEETS_SYNC_INTERVAL", 30))
+# أول وأقصى انتظار (بالثواني) قبل إعادة المحاولة بعد فشل الاتصال، ويتضاعف مع كل فشل متتالٍ
+SHEETS_BACKOFF_BASE = 2
+SHEETS_BACKOFF_MAX = 300
+# صفوف فارغة إضافية عند إنشاء أو تكبير ورقة حتى لا يحتاج كل طالب جديد طلب تكبير منفصل
+SHEETS_ROW_HEADROOM = 200
+
+
+def sheet_column_letter(number):
+    """اسم العمود في Google Sheets من رقمه (1 -> A، 27 -> AA)"""
+    letters = ''
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def sheet_cell(value):
+    """قيمة خلية بنوع يقبله JSON، والقيم الفارغة نص فارغ"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or value is pd.NA or value is pd.NaT or value != value:
+        return ''
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def sheet_row_ranges(positions):
+    """تقسيم أرقام صفوف مرتبة إلى نطاقات متصلة (أول صف، آخر صف)"""
+    ranges = []
+    for position in positions:
+        if ranges and ranges[-1][1] == position - 1:
+            ranges[-1][1] = position
+        else:
+            ranges.append([position, position])
+    return ranges
+
+
+class SheetsMirror:
+    """نسخة من المجموعات في Google Sheets (ورقة لكل مجموعة) تُحدّث بالفرق فقط من خيط خلفي
+
+    صندوق الصادر ملف محلي بجانب البيانات يحفظ بصمة كل صف كما وصل للجدول آخر مرة، وعند كل مزامنة
+    تُرسل الصفوف التي تغيرت بصمتها فقط بطلب batch_update واحد لكل مجموعة. لذلك التسجيل والمسح
+    لا ينتظران الشبكة أبداً، وما لم يصل بسبب انقطاع الاتصال يُرسل بعد عودته أو بعد إعادة التشغيل
+    """
+    
+    def __init__(self, storage, spreadsheet_key, client_factory, interval=SHEETS_SYNC_INTERVAL):
+        self.storage = storage
+        self.spreadsheet_key = spreadsheet_key
+        # دالة ترجع عميل gspread (أو أي كائن بنفس الواجهة) وتستدعى عند أول اتصال فقط
+        self.client_factory = client_factory
+        self.interval = interval
+        self.outbox_path = f"{os.path.abspath(storage.path)}.sheets.json"
+        # قفل بين العمليات حتى لا ترسل عمليتان نفس الفرق
+        self.lock = InterProcessLock(f"{self.outbox_path}.lock")
+        self.spreadsheet = None
+        # عنوان الورقة -> كائن الورقة في الجدول
+        self.worksheets = {}
+        # رقم إصدار كل مجموعة في الملخصات عند آخر مزامنة، حتى لا تحسب بصمات مجموعة لم تتغير
+        self.synced_aggregates = None
+        self.synced_versions = {}
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        # عدد مرات الفشل المتتالية وموعد المحاولة التالية بعدها
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_sync = None
+        self.last_duration = 0.0
+        self.last_rows = 0
+        self.last_calls = 0
+        self.error = None
+        atexit.register(self.shutdown)
+    
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    @property
+    def pending_groups(self):
+        """المجموعات التي تغيرت منذ آخر مزامنة ناجحة"""
+        if self.storage.groups_df is None:
+            return []
+        if self.storage.aggregates is not self.synced_aggregates:
+            return list(self.storage.groups_df)
+        versions = self.storage.aggregates.versions
+        return [
+            group_name for group_name in self.storage.groups_df
+            if self.synced_versions.get(group_name) != versions.get(group_name, 0)
+        ]
+    
+    def request(self):
+        """طلب مزامنة قريبة بدون انتظار، وتشغيل الخيط الخلفي إذا لم يكن يعمل"""
+        with self.start_lock:
+            if not self.is_running and not self.stop_event.is_set():
+                self.thread = threading.Thread(target=self.run, name="sheets-sync", daemon=True)
+                self.thread.start()
+        self.wake_event.set()
+    
+    def run(self):
+        while not self.stop_event.is_set():
+            # بعد الفشل لا تعاد المحاولة قبل موعدها حتى لو طُلبت مزامنة
+            delay = self.retry_at - time.monotonic()
+            if delay > 0:
+                self.stop_event.wait(delay)
+                continue
+            
+            self.wake_event.clear()
+            self.attempt()
+            self.wake_event.wait(self.interval)
+    
+    def attempt(self):
+        """مزامنة واحدة مع تسجيل نتيجتها وتحديد موعد إعادة المحاولة عند الفشل"""
+        started = time.perf_counter()
+        try:
+            rows, calls = self.sync()
+        except Exception as e:
+            self.failures += 1
+            delay = min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** (self.failures - 1))
+            # تأخير عشوائي بسيط حتى لا تعيد كل العمليات المحاولة في نفس اللحظة
+            self.retry_at = time.monotonic() + delay * np.random.uniform(0.5, 1.0)
+            self.error = str(e)
+            # قد يكون الاتصال انقطع، لذلك يعاد فتح الجدول وقراءة أوراقه في المحاولة التالية
+            self.spreadsheet = None
+            print(f"خطأ في مزامنة Google Sheets، إعادة المحاولة خلال {delay} ثانية: {self.error}")
+            return False
+        
+        self.failures = 0
+        self.retry_at = 0.0
+        self.error = None
+        # الحالة تعرض آخر مزامنة أرسلت شيئاً فعلاً وليس آخر فحص بدون تغييرات
+        if calls:
+            self.last_sync = datetime.now()
+            self.last_duration = time.perf_counter() - started
+            self.last_rows = rows
+            self.last_calls = calls
+        return True
+    
+    def read_outbox(self):
+        """حالة الأوراق كما وصلت للجدول: المجموعة -> {header, rows (بصمات الصفوف), grid_rows, grid_cols}"""
+        try:
+            with open(self.outbox_path, encoding='utf-8') as outbox_file:
+                return json.load(outbox_file)
+        except (OSError, ValueError):
+            return {}
+    
+    def write_outbox(self, sheets):
+        temp_path = f"{self.outbox_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as outbox_file:
+            json.dump(sheets, outbox_file, ensure_ascii=False)
+            outbox_file.flush()
+            os.fsync(outbox_file.fileno())
+        os.replace(temp_path, self.outbox_path)
+    
+    def snapshot(self, sheets):
+        """صفوف وبصمات المجموعات التي تغيرت منذ آخر مزامنة: المجموعة -> (الأعمدة، الصفوف، البصمات، الإصدار)"""
+        storage = self.storage
+        with storage.lock:
+            storage.catch_up()
+            if storage.groups_df is None:
+                return None, {}
+            
+            aggregates = storage.aggregates
+            snapshots = {}
+            for group_name in storage.groups_df:
+                version = aggregates.versions[group_name]
+                if (aggregates is self.synced_aggregates and group_name in sheets
+                        and self.synced_versions.get(group_name) == version):
+                    continue
+                
+                df = storage.full_frame(group_name)
+                rows = [[sheet_cell(value) for value in row] for row in df.astype(object).values.tolist()]
+                hashes = [
+                    hashlib.blake2b(json.dumps(row, ensure_ascii=False).encode('utf-8'), digest_size=8).hexdigest()
+                    for row in rows
+                ]
+                snapshots[group_name] = ([str(column) for column in df.columns], rows, hashes, version)
+            return aggregates, snapshots
+    
+    def open_spreadsheet(self):
+        if self.spreadsheet is None:
+            spreadsheet = self.client_factory().open_by_key(self.spreadsheet_key)
+            self.worksheets = {worksheet.title: worksheet for worksheet in spreadsheet.worksheets()}
+            self.spreadsheet = spreadsheet
+        return self.spreadsheet
+    
+    def sync(self):
+        """إرسال الفرق بين المجموعات الحالية وما وصل للجدول، وإرجاع (عدد الصفوف المرسلة، عدد طلبات الشبكة)"""
+        with self.lock:
+            sheets = self.read_outbox()
+            aggregates, snapshots = self.snapshot(sheets)
+            if aggregates is None:
+                return 0, 0
+            
+            rows_sent = 0
+            calls = 0
+            
+            for group_name in [group_name for group_name in sheets if group_name not in self.storage.groups_df]:
+                spreadsheet = self.open_spreadsheet()
+                worksheet = self.worksheets.pop(group_name, None)
+                if worksheet is not None:
+                    spreadsheet.del_worksheet(worksheet)
+                    calls += 1
+                del sheets[group_name]
+                self.write_outbox(sheets)
+            
+            if aggregates is not self.synced_aggregates:
+                self.synced_aggregates = aggregates
+                self.synced_versions = {}
+            
+            for group_name, (header, rows, hashes, version) in snapshots.items():
+                sheet = sheets.get(group_name)
+                if sheet is not None and sheet['header'] == header and sheet['rows'] == hashes:
+                    # المجموعة لم تتغير عن آخر ما وصل للجدول (مثل بعد إعادة التشغيل)، فلا حاجة للاتصال
+                    self.synced_versions[group_name] = version
+                    continue
+                
+                sent, group_calls = self.push_group(self.open_spreadsheet(), group_name, header, rows, hashes, sheets)
+                rows_sent += sent
+                calls += group_calls
+                # حفظ التقدم بعد كل مجموعة حتى لا تعاد المجموعات التي وصلت إذا فشلت التالية
+                if group_calls:
+                    self.write_outbox(sheets)
+                self.synced_versions[group_name] = version
+            
+            if calls:
+                print(f"تمت مزامنة Google Sheets: {rows_sent} صف في {calls} طلب")
+            return rows_sent, calls
+    
+    def push_group(self, spreadsheet, group_name, header, rows, hashes, sheets):
+        """إرسال صفوف مجموعة واحدة التي تغيرت بطلب batch_update واحد وإرجاع (عدد الصفوف، عدد الطلبات)"""
+        calls = 0
+        sheet = sheets.get(group_name)
+        worksheet = self.worksheets.get(group_name)
+        
+        if worksheet is None:
+            worksheet = spreadsheet.add_worksheet(title=group_name, rows=len(rows) + 1 + SHEETS_ROW_HEADROOM, cols=len(header))
+            self.worksheets[group_name] = worksheet
+            sheet = None
+            calls += 1
+        elif sheet is None:
+            # ورقة موجودة بدون حالة محلية (مثل حذف صندوق الصادر)، لذلك تمسح وتكتب من جديد
+            worksheet.clear()
+            calls += 1
+        
+        if sheet is None:
+            sheet = {'header': [], 'rows': [], 'grid_rows': worksheet.row_count, 'grid_cols': worksheet.col_count}
+        
+        # تكبير الورقة فقط عندما لا تكفي الصفوف الإضافية
+        if len(rows) + 1 > sheet['grid_rows'] or len(header) > sheet['grid_cols']:
+            sheet['grid_rows'] = max(sheet['grid_rows'], len(rows) + 1 + SHEETS_ROW_HEADROOM)
+            sheet['grid_cols'] = max(sheet['grid_cols'], len(header))
+            worksheet.resize(rows=sheet['grid_rows'], cols=sheet['grid_cols'])
+            calls += 1
+        
+        width = max(len(header), len(sheet['header']))
+        last_column = sheet_column_letter(width)
+        old_hashes = sheet['rows'] if sheet['header'] == header else []
+        data = []
+        if sheet['header'] != header:
+            data.append({'range': f"A1:{last_column}1", 'values': [header + [''] * (width - len(header))]})
+        
+        changed = [
+            position for position, row_hash in enumerate(hashes)
+            if position >= len(old_hashes) or old_hashes[position] != row_hash
+        ]
+        # الصفوف الزائدة عن المجموعة الحالية (طلاب محذوفون) تمسح بقيم فارغة في نفس الطلب
+        removed = list(range(len(rows), len(sheet['rows'])))
+        blank = [''] * width
+        for first, last in sheet_row_ranges(changed + removed):
+            values = [
+                rows[position] + [''] * (width - len(rows[position])) if position < len(rows) else blank
+                for position in range(first, last + 1)
+            ]
+            data.append({'range': f"A{first + 2}:{last_column}{last + 2}", 'values': values})
+        
+        if data:
+            worksheet.batch_update(data, value_input_option='RAW')
+            calls += 1
+        
+        sheet.update(header=header, rows=hashes)
+        sheets[group_name] = sheet
+        return len(changed) + len(removed), calls
+    
+    def shutdown(self):
+        """إيقاف الخيط الخلفي، وما لم يرسل يبقى في صندوق الصادر للتشغيل القادم"""
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+
+def sheets_client():
+    """عميل gspread بحساب الخدمة المضبوط في STUDENTS_SHEETS_CREDENTIALS"""
+    return gspread.service_account(filename=SHEETS_CREDENTIALS_PATH)
+
+
+@st.cache_resource
+def _shared_sheets_mirror(backend, path, months):
+    """نسخة Google Sheets واحدة لكل طريقة تخزين مشتركة، أو None إذا لم تضبط المزامنة"""
+    if not SHEETS_SPREADSHEET_KEY:
+        return None
+    if gspread is None:
+        print("مزامنة Google Sheets تحتاج تثبيت مكتبة gspread")
+        return None
+    return SheetsMirror(_shared_storage(backend, path, months), SHEETS_SPREADSHEET_KEY, sheets_client)
+
+
+# أقصى طول لضلع الصورة في المرور السريع لقراءة QR
+QR_FAST_MAX_SIDE = 640
+
+
+class QRScanner:
+    """محرك قراءة QR بكاشف واحد مشترك ومرورين: صورة رمادية مصغرة أولاً ثم الدقة الكاملة
+
+    يقرأ عدة أكواد من نفس الصورة، ويحتفظ بأزمنة كل مرحلة لآخر عمليات المسح
+    """
+    
+    def __init__(self, fast_max_side=QR_FAST_MAX_SIDE):
+        self.detector = cv2.QRCodeDetector()
+        # الكاشف غير آمن للاستخدام من أكثر من خيط في نفس الوقت
+        self.lock = threading.Lock()
+        self.fast_max_side = fast_max_side
+        self.recent_scans = deque(maxlen=100)
+    
+    @staticmethod
+    def to_gray(image, bgr=False):
+        """تحويل صورة PIL أو مصفوفة (RGB أو BGR من الكاميرا) إلى صورة رمادية"""
+        if isinstance(image, Image.Image):
+            return np.asarray(image.convert('L'))
+        if image.ndim == 2:
+            return image
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if bgr else cv2.COLOR_RGBA2GRAY)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY)
+    
+    def detect_codes(self, gray, allow_single=False):
+        """قراءة كل الأكواد في الصورة، مع محاولة القراءة الفردية كاحتياط"""
+        with self.lock:
+            found, decoded, _, _ = self.detector.detectAndDecodeMulti(gray)
+            codes = [code.strip() for code in decoded if code and code.strip()] if found else []
+            if not codes and allow_single:
+                data, _, _ = self.detector.detectAndDecode(gray)
+                if data and data.strip():
+                    codes = [data.strip()]
+        return codes
+    
+    def decode(self, image, bgr=False):
+        """قراءة الأكواد من صورة وإرجاع الأكواد والمرحلة التي نجحت وأزمنة كل مرحلة بالمللي ثانية"""
+        timings = {}
+        started = time.perf_counter()
+        
+        gray = self.to_gray(image, bgr)
+        timings['convert_ms'] = (time.perf_counter() - started) * 1000
+        
+        codes = []
+        stage = None
+        height, width = gray.shape[:2]
+        scale = self.fast_max_side / max(height, width)
+        
+        # المرور السريع على صورة مصغرة
+        if scale < 1:
+            step = time.perf_counter()
+            small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            timings['downscale_ms'] = (time.perf_counter() - step) * 1000
+            
+            step = time.perf_counter()
+            codes = self.detect_codes(small)
+            timings['fast_pass_ms'] = (time.perf_counter() - step) * 1000
+            if codes:
+                stage = 'fast'
+        
+        # الرجوع للدقة الكاملة إذا فشل المرور السريع
+        if not codes:
+            step = time.perf_counter()
+            codes = self.detect_codes(gray, allow_single=True)
+            timings['full_pass_ms'] = (time.perf_counter() - step) * 1000
+            if codes:
+                stage = 'full'
+        
+        timings['total_ms'] = (time.perf_counter() - started) * 1000
+        
+        result = {
+            'codes': list(dict.fromkeys(codes)),
+            'stage': stage,
+            'size': (width, height),
+            'timings': timings
+        }
+        self.recent_scans.append(result)
+        return result
+    
+    def timing_summary(self):
+        """متوسط وأعلى 95% لزمن كل مرحلة في آخر عمليات المسح"""
+        if not self.recent_scans:
+            return pd.DataFrame()
+        timings = pd.DataFrame([scan['timings'] for scan in self.recent_scans])
+        return timings.agg(['mean', lambda column: column.quantile(0.95), 'max']).set_axis(
+            ['المتوسط', 'p95', 'الأعلى']
+        ).round(1)
+
+
+@st.cache_resource
+def _shared_qr_scanner():
+    """محرك قراءة QR واحد مشترك بدلاً من إنشاء كاشف جديد لكل صورة"""
+    return QRScanner()
+
+
+# المدة (بالثواني) التي يتم فيها تجاهل تكرار نفس الكود في المسح المستمر
+LIVE_SCAN_DEBOUNCE_SECONDS = 30
+# الفترة (بالثواني) بين كل دفعة تسجيل للأكواد المنتظرة أثناء المسح المستمر
+LIVE_SCAN_COMMIT_INTERVAL = 2
+
+
+class LiveScanWorker:
+    """مسح مستمر في خيط خلفي من كاميرا أو ملف فيديو بدون الحاجة للضغط على زر لكل طالب
+
+    الأكواد المقروءة تدخل طابوراً بعد تجاهل التكرار خلال فترة محددة،
+    ثم تسجلها الواجهة على دفعات بنفس منطق تسجيل الحضور
+    """
+    
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.codes = queue.Queue()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.source = None
+        self.debounce_seconds = LIVE_SCAN_DEBOUNCE_SECONDS
+        # كود الطالب -> آخر وقت تمت قراءته فيه، للطلاب الذين قرئوا خلال فترة تجاهل التكرار فقط
+        self.last_seen = {}
+        self.pruned_at = float('-inf')
+        self.frames_read = 0
+        self.error = None
+        # آخر الطلاب الذين تم تسجيلهم لعرضهم في الواجهة
+        self.recent = deque(maxlen=20)
+    
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def start(self, source, debounce_seconds=LIVE_SCAN_DEBOUNCE_SECONDS):
+        """بدء المسح من رقم كاميرا (مثل "0") أو مسار ملف فيديو أو رابط بث"""
+        if self.is_running:
+            return
+        self.source = int(source) if str(source).isdigit() else source
+        self.debounce_seconds = debounce_seconds
+        self.frames_read = 0
+        self.error = None
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="live-qr-scanner", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+    
+    def run(self):
+        capture = cv2.VideoCapture(self.source)
+        try:
+            if not capture.isOpened():
+                self.error = f"تعذر فتح مصدر الفيديو: {self.source}"
+                return
+            
+            while not self.stop_event.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    # انتهى ملف الفيديو أو انقطعت الكاميرا
+                    break
+                self.frames_read += 1
+                
+                now = time.monotonic()
+                self.forget_expired(now)
+                for student_code in self.scanner.decode(frame, bgr=True)['codes']:
+                    if now - self.last_seen.get(student_code, float('-inf')) >= self.debounce_seconds:
+                        self.codes.put((student_code, datetime.now()))
+                    self.last_seen[student_code] = now
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            capture.release()
+    
+    def forget_expired(self, now):
+        """حذف الأكواد التي انتهت فترة تجاهل تكرارها، مرة واحدة كل فترة حتى لا يمر على القاموس مع كل إطار
+
+        بدون ذلك يبقى كل طالب مر أمام الكاميرا في القاموس طوال تشغيل المسح
+        """
+        if now - self.pruned_at < self.debounce_seconds:
+            return
+        self.pruned_at = now
+        self.last_seen = {
+            student_code: seen for student_code, seen in self.last_seen.items() if now - seen < self.debounce_seconds
+        }
+    
+    def drain(self):
+        """سحب كل الأكواد المنتظرة دفعة واحدة"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.codes.get_nowait())
+            except queue.Empty:
+                return batch
+
+
+@st.cache_resource
+def _shared_live_scanner():
+    """عامل مسح مستمر واحد لكل عملية (محطة المسح على الباب)"""
+    return LiveScanWorker(_shared_qr_scanner())
+
+
+# امتدادات الملفات المدعومة في الاستيراد الجماعي للحضور
+BULK_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+BULK_VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+# قراءة إطار واحد من كل عدد من الإطارات عند استيراد فيديو مسجل
+BULK_VIDEO_FRAME_STEP = 5
+
+# محرك القراءة الخاص بكل عملية في مجمع العمليات (الكاشف لا يمكن نقله بين العمليات)
+_process_scanner = None
+
+
+def _process_qr_scanner():
+    global _process_scanner
+    if _process_scanner is None:
+        _process_scanner = QRScanner()
+    return _process_scanner
+
+
+def capture_day(path):
+    """يوم التقاط الصورة من بيانات EXIF، أو يوم آخر تعديل للملف إذا لم تتوفر"""
+    try:
+        with Image.open(path) as image:
+            exif = image.getexif()
+            taken = exif.get_ifd(0x8769).get(36867) or exif.get(306)
+        if taken:
+            return datetime.strptime(str(taken).strip()[:19], "%Y:%m:%d %H:%M:%S").date().isoformat()
+    except Exception:
+        pass
+    return date.fromtimestamp(os.path.getmtime(path)).isoformat()
+
+
+def decode_image_file(path):
+    """قراءة أكواد QR من ملف صورة واحد"""
+    with Image.open(path) as image:
+        codes = _process_qr_scanner().decode(image)['codes']
+    return {'source': path, 'day': capture_day(path), 'codes': codes}
+
+
+def decode_video_segment(path, start_frame, stop_frame, frame_step=BULK_VIDEO_FRAME_STEP):
+    """قراءة أكواد QR من جزء من ملف فيديو بقراءة إطار واحد من كل frame_step إطار"""
+    scanner = _process_qr_scanner()
+    capture = cv2.VideoCapture(path)
+    codes = []
+    try:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        for frame_number in range(start_frame, stop_frame):
+            # تخطي الإطارات التي لن تتم قراءتها بدون تحويلها لصور
+            if (frame_number - start_frame) % frame_step:
+                if not capture.grab():
+                    break
+                continue
+            ok, frame = capture.read()
+            if not ok:
+                break
+            codes.extend(scanner.decode(frame, bgr=True)['codes'])
+    finally:
+        capture.release()
+    
+    return {
+        'source': f"{path} [{start_frame}-{stop_frame}]",
+        'day': capture_day(path),
+        'codes': list(dict.fromkeys(codes))
+    }
+
+
+def run_bulk_task(function, args):
+    """تشغيل مهمة قراءة واحدة وإرجاع الخطأ كنتيجة بدلاً من إيقاف باقي المهام"""
+    try:
+        return function(*args)
+    except Exception as e:
+        return {'source': args[0], 'day': None, 'codes': [], 'error': str(e)}
+
+
+def bulk_media_tasks(path, workers, frame_step=BULK_VIDEO_FRAME_STEP):
+    """تقسيم مجلد صور أو ملف فيديو إلى مهام قراءة مستقلة: مهمة لكل صورة أو لكل جزء من الفيديو"""
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(BULK_IMAGE_EXTENSIONS)
+        )
+        return [(decode_image_file, (file_path,)) for file_path in files]
+    
+    if path.lower().endswith(BULK_IMAGE_EXTENSIONS):
+        return [(decode_image_file, (path,))]
+    
+    if path.lower().endswith(BULK_VIDEO_EXTENSIONS):
+        capture = cv2.VideoCapture(path)
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        if frame_count <= 0:
+            raise ValueError(f"تعذر قراءة ملف الفيديو: {path}")
+        
+        # أجزاء متساوية بعدد العمليات، وكل جزء يبدأ بإطار تتم قراءته
+        segment = -(-frame_count // workers)
+        segment = -(-segment // frame_step) * frame_step
+        return [
+            (decode_video_segment, (path, start, min(start + segment, frame_count), frame_step))
+            for start in range(0, frame_count, segment)
+        ]
+    
+    raise ValueError(f"المسار ليس مجلد صور أو ملف فيديو مدعوم: {path}")
+
+
+def make_process_pool(workers):
+    """مجمع عمليات بطريقة spawn: نسخ عملية بها خيوط (الحفظ والمزامنة والمسح المستمر) بطريقة fork قد يوقف
+    العمليات الجديدة على قفل كان مأخوذاً لحظة النسخ. العملية الجديدة تشغل هذا الملف من جديد بدون الواجهة
+    فتجد دوال المسح والرسم بأسمائها حتى عند تشغيله من Streamlit
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def scan_media_bulk(path, max_workers=None, frame_step=BULK_VIDEO_FRAME_STEP):
+    """قراءة كل أكواد QR في مجلد صور أو ملف فيديو بالتوازي على مجمع عمليات
+
+    ترجع نتيجة لكل ملف أو جزء فيديو بنفس ترتيب الملفات: المصدر واليوم والأكواد (أو الخطأ)
+    """
+    workers = max_workers or os.cpu_count() or 1
+    tasks = bulk_media_tasks(path, workers, frame_step)
+    if not tasks:
+        return []
+    
+    try:
+        with make_process_pool(min(workers, len(tasks))) as executor:
+            futures = [executor.submit(run_bulk_task, function, args) for function, args in tasks]
+            return [future.result() for future in futures]
+    except Exception as e:
+        print(f"تعذر تشغيل مجمع العمليات، سيتم المسح في العملية الحالية: {str(e)}")
+        return [run_bulk_task(function, args) for function, args in tasks]
+
+
+# إعدادات رسم صور QR للطلاب
+QR_BOX_SIZE = 10
+QR_BORDER = 4
+# أقصى عدد صور QR في الذاكرة المؤقتة
+QR_CACHE_MAX_ITEMS = 5000
+# أقل عدد صور جديدة يستحق تشغيل مجمع عمليات لرسمها
+QR_PARALLEL_MIN_ITEMS = 32
+# صفحة A4 بدقة 150 نقطة لكل بوصة وعدد البطاقات في كل صفحة
+QR_SHEET_PAGE_SIZE = (1240, 1754)
+QR_SHEET_COLUMNS = 4
+QR_SHEET_ROWS = 5
+
+
+def render_qr_png(student_id, box_size=QR_BOX_SIZE, border=QR_BORDER):
+    """رسم QR لكود طالب وإرجاعه كبايتات PNG"""
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=border)
+    qr.add_data(student_id)
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white")
+    
+    img_bytes = BytesIO()
+    qr_img.save(img_bytes, format="PNG")
+    return img_bytes.getvalue()
+
+
+class QRImageCache:
+    """ذاكرة مؤقتة لصور QR مفتاحها بصمة المحتوى: الكود وإعدادات الرسم
+
+    نفس الكود بنفس الإعدادات يعطي نفس الصورة دائماً، لذلك لا تحتاج الذاكرة لإبطال عند تعديل البيانات
+    """
+    
+    def __init__(self, max_items=QR_CACHE_MAX_ITEMS):
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(student_id, box_size=QR_BOX_SIZE, border=QR_BORDER):
+        return hashlib.sha256(f"{student_id}|{box_size}|{border}".encode('utf-8')).hexdigest()
+    
+    def lookup(self, key):
+        with self.lock:
+            png = self.images.get(key)
+            if png is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.images.move_to_end(key)
+            return png
+    
+    def store(self, key, png):
+        with self.lock:
+            self.images[key] = png
+            self.images.move_to_end(key)
+            # حذف الأقدم استخداماً عند تجاوز الحد
+            while len(self.images) > self.max_items:
+                self.images.popitem(last=False)
+    
+    def get(self, student_id, box_size=QR_BOX_SIZE, border=QR_BORDER):
+        """صورة PNG لكود طالب من الذاكرة المؤقتة، أو برسمها مرة واحدة"""
+        key = self.key(student_id, box_size, border)
+        png = self.lookup(key)
+        if png is None:
+            png = render_qr_png(str(student_id), box_size, border)
+            self.store(key, png)
+        return png
+    
+    def get_many(self, student_ids, box_size=QR_BOX_SIZE, border=QR_BORDER, max_workers=None):
+        """صور عدة طلاب بنفس الترتيب، مع رسم الصور غير الموجودة بالتوازي على مجمع عمليات"""
+        student_ids = [str(student_id) for student_id in student_ids]
+        keys = [self.key(student_id, box_size, border) for student_id in student_ids]
+        images = {key: self.lookup(key) for key in keys}
+        missing = list({key: student_id for student_id, key in zip(student_ids, keys) if images[key] is None}.items())
+        
+        if missing:
+            missing_ids = [student_id for _, student_id in missing]
+            workers = min(max_workers or os.cpu_count() or 1, len(missing))
+            rendered = None
+            if workers > 1 and len(missing) >= QR_PARALLEL_MIN_ITEMS:
+                try:
+                    with make_process_pool(workers) as executor:
+                        rendered = list(executor.map(
+                            render_qr_png, missing_ids, repeat(box_size), repeat(border),
+                            chunksize=-(-len(missing) // workers)
+                        ))
+                except Exception as e:
+                    print(f"تعذر تشغيل مجمع العمليات، سيتم الرسم في العملية الحالية: {str(e)}")
+            if rendered is None:
+                rendered = [render_qr_png(student_id, box_size, border) for student_id in missing_ids]
+            
+            for (key, _), png in zip(missing, rendered):
+                self.store(key, png)
+                images[key] = png
+        
+        return [images[key] for key in keys]
+
+
+@st.cache_resource
+def _shared_qr_cache():
+    """ذاكرة صور QR واحدة مشتركة بين الجلسات"""
+    return QRImageCache()
+
+
+def _sheet_font(size=28):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # إصدارات Pillow القديمة لا تدعم تحديد حجم الخط الافتراضي
+        return ImageFont.load_default()
+
+
+def qr_sheet_pages(student_ids, images, columns=QR_SHEET_COLUMNS, rows=QR_SHEET_ROWS):
+    """ترتيب صور QR في صفحات A4 مع كتابة الكود تحت كل صورة"""
+    page_width, page_height = QR_SHEET_PAGE_SIZE
+    cell_width = page_width // columns
+    cell_height = page_height // rows
+    qr_side = min(cell_width, cell_height - 50) - 20
+    per_page = columns * rows
+    font = _sheet_font()
+    
+    pages = []
+    for start in range(0, len(student_ids), per_page):
+        page = Image.new('RGB', QR_SHEET_PAGE_SIZE, 'white')
+        draw = ImageDraw.Draw(page)
+        for position, (student_id, png) in enumerate(zip(student_ids[start:start + per_page], images[start:start + per_page])):
+            row, column = divmod(position, columns)
+            left = column * cell_width
+            top = row * cell_height
+            
+            with Image.open(BytesIO(png)) as qr_img:
+                page.paste(qr_img.convert('RGB').resize((qr_side, qr_side), Image.NEAREST), (left + (cell_width - qr_side) // 2, top + 10))
+            text_width = draw.textlength(student_id, font=font)
+            draw.text((left + (cell_width - text_width) / 2, top + qr_side + 15), student_id, fill='black', font=font)
+        pages.append(page)
+    return pages
+
+
+def export_qr_sheet(student_ids, images, file_format='pdf'):
+    """تجميع صور QR في ملف واحد للطباعة: PDF متعدد الصفحات، أو صورة PNG واحدة، أو ZIP بصورة لكل طالب"""
+    output = BytesIO()
+    if file_format == 'zip':
+        # صور PNG مضغوطة بالفعل، لذلك تخزن في الملف بدون ضغط إضافي
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+            for student_id, png in zip(student_ids, images):
+                archive.writestr(f"qr_code_{student_id}.png", png)
+        return output.getvalue()
+    
+    pages = qr_sheet_pages(student_ids, images)
+    if file_format == 'pdf':
+        pages[0].save(output, format='PDF', save_all=True, append_images=pages[1:], resolution=150)
+    else:
+        # كل الصفحات تحت بعضها في صورة واحدة
+        page_width, page_height = QR_SHEET_PAGE_SIZE
+        sheet = Image.new('RGB', (page_width, page_height * len(pages)), 'white')
+        for number, page in enumerate(pages):
+            sheet.paste(page, (0, number * page_height))
+        sheet.save(output, format='PNG')
+    return output.getvalue()
+
+
+# أحجام صفحات جدول الطلاب في الإحصائيات
+ANALYTICS_PAGE_SIZES = [25, 50, 100, 200]
+# عدد آخر الحصص المعروضة في خريطة الحضور
+HEATMAP_SESSION_COUNTS = [10, 20, 50]
+# أقصى عدد طلاب في خريطة الحضور، والطلاب الأقل حضوراً يعرضون أولاً
+HEATMAP_MAX_STUDENTS = 60
+# أيام الأسبوع بترتيب date.weekday() لجدول حصص المجموعة
+WEEKDAY_NAMES = ['الاثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة', 'السبت', 'الأحد']
+
 
 class StudentAttendanceSystem:
     def __init__(self):
         st.set_page_config(page_title="نظام حضور الطلاب", layout="wide", page_icon="🎓")
+        # أزمنة المراحل لإعادة التشغيل هذه وللنسب المتحركة المشتركة
+        self.metrics = _shared_metrics()
+        self.metrics.begin_run()
         self.excel_path = "students_data.xlsx"
         self.current_group = None
-        # تعريف أسماء الأشهر الجديدة
-        self.months = [
-            'يوليو_2025', 'أغسطس_2025', 'سبتمبر_2025', 'أكتوبر_2025', 
-            'نوفمبر_2025', 'ديسمبر_2025', 'يناير_2026', 'فبراير_2026', 
-            'مارس_2026', 'أبريل_2026', 'مايو_2026', 'يونيو_2026'
-        ]
+        # أعمدة الدفع لأشهر السنة الدراسية النشطة حسب التقويم المضبوط
+        self.months = academic_months()
+        
+        # طريقة التخزين: ملف إكسل (الافتراضي) أو قاعدة SQLite
+        if STORAGE_BACKEND == "sqlite":
+            storage_key = ("sqlite", os.path.abspath("students_data.db"), tuple(self.months))
+        else:
+            storage_key = ("excel", os.path.abspath(self.excel_path), tuple(self.months))
+        self.storage = _shared_storage(*storage_key)
+        # الحفظ بالخلفية حتى لا تنتظر الواجهة كتابة الملف بعد كل تعديل
+        self.saver = _shared_save_worker(*storage_key)
+        # نسخة Google Sheets الاختيارية تُحدّث بالفرق من خيط خلفي
+        self.sheets = _shared_sheets_mirror(*storage_key)
         
         # تحميل البيانات أولاً قبل إعداد الواجهة
         self.load_data()
+        if self.sheets is not None:
+            self.sheets.request()
         self.setup_ui()
     
+    @property
+    def groups_df(self):
+        """جداول المجموعات الحالية من طريقة التخزين، لأن reload وcatch_up يستبدلان القاموس وجداوله"""
+        return self.storage.groups_df
+    
+    @timed('load_data')
     def load_data(self):
-        """تحميل البيانات من ملف الإكسل مع معالجة الأخطاء المحسنة"""
+        """تحميل البيانات من طريقة التخزين الحالية مع معالجة الأخطاء المحسنة"""
         try:
-            if os.path.exists(self.excel_path):
-                # قراءة جميع الأوراق من ملف الإكسل
-                self.groups_df = pd.read_excel(self.excel_path, sheet_name=None)
-                
-                # إذا كان الملف فارغاً أو به مشاكل
-                if not self.groups_df:
-                    self.initialize_default_group()
-                    return
-                
-                # معالجة وتصحيح البيانات لكل مجموعة
-                for group_name in list(self.groups_df.keys()):
-                    df = self.groups_df[group_name]
-                    
-                    # تصحيح الأعمدة إذا كان هناك خطأ إملائي
-                    if 'رقم_الهاتf' in df.columns and 'رقم_الهاتف' not in df.columns:
-                        df.rename(columns={'رقم_الهاتf': 'رقم_الهاتف'}, inplace=True)
-                    
-                    # إنشاء الأعمدة الأساسية المطلوبة
-                    required_columns = [
-                        'الكود', 'الاسم', 'رقم_الهاتف', 'ولي_الامر', 'الحصص_الحاضرة'
-                    ] + self.months + [
-                        'تواريخ_الحضور', 'تاريخ_التسجيل', 'ملاحظات', 'الاختبارات'
-                    ]
-                    
-                    # إضافة الأعمدة المفقودة
-                    for col in required_columns:
-                        if col not in df.columns:
-                            if col in self.months:
-                                df[col] = False
-                            elif col == 'الحصص_الحاضرة':
-                                df[col] = 0
-                            else:
-                                df[col] = ''
-                    
-                    # ترتيب الأعمدة بالترتيب الصحيح
-                    df = df[required_columns]
-                    
-                    # تحويل أنواع البيانات
-                    df['الكود'] = df['الكود'].astype(str)
-                    df['الاسم'] = df['الاسم'].astype(str)
-                    df['رقم_الهاتف'] = df['رقم_الهاتف'].astype(str)
-                    df['ولي_الامر'] = df['ولي_الامر'].astype(str)
-                    df['الحصص_الحاضرة'] = pd.to_numeric(df['الحصص_الحاضرة'], errors='coerce').fillna(0).astype(int)
-                    df['تواريخ_الحضور'] = df['تواريخ_الحضور'].astype(str).fillna('')
-                    df['ملاحظات'] = df['ملاحظات'].astype(str).fillna('')
-                    df['الاختبارات'] = df['الاختبارات'].astype(str).fillna('')
-                    
-                    # معالجة تاريخ التسجيل
-                    try:
-                        df['تاريخ_التسجيل'] = pd.to_datetime(df['تاريخ_التسجيل'], errors='coerce').dt.date
-                        df['تاريخ_التسجيل'] = df['تاريخ_التسجيل'].fillna(date.today())
-                    except:
-                        df['تاريخ_التسجيل'] = date.today()
-                    
-                    # التأكد من أن أعمدة الأشهر من النوع المنطقي
-                    for month in self.months:
-                        df[month] = df[month].astype(bool)
-                    
-                    # تحديث البيانات في المجموعة
-                    self.groups_df[group_name] = df
-                
-                # تحديد المجموعة الحالية
-                if self.current_group is None or self.current_group not in self.groups_df:
-                    self.current_group = list(self.groups_df.keys())[0]
-                
-                print(f"تم تحميل البيانات بنجاح. عدد المجموعات: {len(self.groups_df)}")
-                
-            else:
-                print("ملف البيانات غير موجود، سيتم إنشاء ملف جديد")
+            groups_df = self.storage.load()
+            
+            # إذا لم تكن هناك بيانات بعد أو كان الملف فارغاً
+            if not groups_df:
                 self.initialize_default_group()
+                return
+            
+            # تحديد المجموعة الحالية
+            if self.current_group is None or self.current_group not in self.groups_df:
+                self.current_group = list(self.groups_df.keys())[0]
                 
+        except DuplicateStudentCodesError as e:
+            # لا تنشأ مجموعة افتراضية هنا لأنها تكتب فوق ملف البيانات الموجود
+            print(f"حدث خطأ في تحميل البيانات: {str(e)}")
+            st.error(f"حدث خطأ في تحميل البيانات: {str(e)}، صححها في ملف البيانات ثم أعد التشغيل")
+            st.stop()
         except Exception as e:
             print(f"حدث خطأ في تحميل البيانات: {str(e)}")
             st.error(f"حدث خطأ في تحميل البيانات: {str(e)}")
@@ -107,69 +3992,68 @@ class StudentAttendanceSystem:
 
     def initialize_default_group(self):
         """إنشاء مجموعة افتراضية جديدة"""
-        required_columns = [
-            'الكود', 'الاسم', 'رقم_الهاتف', 'ولي_الامر', 'الحصص_الحاضرة'
-        ] + self.months + [
-            'تواريخ_الحضور', 'تاريخ_التسجيل', 'ملاحظات', 'الاختبارات'
-        ]
+        required_columns = build_required_columns(self.months)
         
-        self.groups_df = {
+        # حفظ الملف فوراً
+        self.storage.initialize({
             "المجموعة_الافتراضية": pd.DataFrame(columns=required_columns)
-        }
+        })
         self.current_group = "المجموعة_الافتراضية"
-        
-        # حفظ الملف فوراً
-        self.save_data()
         print("تم إنشاء مجموعة افتراضية جديدة")
     
-    def save_data(self):
-        """حفظ البيانات في ملف الإكسل مع معالجة محسنة للأخطاء"""
-        try:
-            # إنشاء نسخة احتياطية من الملف الحالي إذا كان موجود
-            if os.path.exists(self.excel_path):
-                backup_path = f"{self.excel_path}.backup"
-                try:
-                    import shutil
-                    shutil.copy2(self.excel_path, backup_path)
-                except:
-                    pass
-            
-            # حفظ البيانات
-            with pd.ExcelWriter(self.excel_path, engine='openpyxl') as writer:
-                for group_name, df in self.groups_df.items():
-                    # إنشاء نسخة للحفظ
-                    df_to_save = df.copy()
-                    
-                    # تحويل التواريخ لنص للحفظ
-                    if 'تاريخ_التسجيل' in df_to_save.columns:
-                        df_to_save['تاريخ_التسجيل'] = df_to_save['تاريخ_التسجيل'].astype(str)
-                    
-                    # استبدال القيم الفارغة بنصوص فارغة
-                    df_to_save = df_to_save.fillna('')
-                    
-                    # حفظ البيانات في الورقة المناسبة
-                    df_to_save.to_excel(writer, sheet_name=group_name, index=False)
-            
-            print(f"تم حفظ البيانات بنجاح في {self.excel_path}")
-            
-            # التحقق من الحفظ
-            if os.path.exists(self.excel_path):
-                file_size = os.path.getsize(self.excel_path)
-                print(f"حجم الملف المحفوظ: {file_size} بايت")
-            
-        except Exception as e:
-            print(f"خطأ في حفظ البيانات: {str(e)}")
-            st.error(f"خطأ في حفظ البيانات: {str(e)}")
-            
-            # محاولة استعادة النسخة الاحتياطية
-            backup_path = f"{self.excel_path}.backup"
-            if os.path.exists(backup_path):
-                try:
-                    import shutil
-                    shutil.copy2(backup_path, self.excel_path)
-                    print("تم استعادة النسخة الاحتياطية")
-                except:
-                    pass
+    def log_attendance(self, group_name, student_index, op='attend'):
+        """تسجيل حضور أو خصم حصة كتعديل نقطي بدلاً من إعادة حفظ كل البيانات"""
+        student_id = self.groups_df[group_name].loc[student_index, 'الكود']
+        current_date = date.today().strftime("%Y-%m-%d")
+        event = self.storage.record_attendance(group_name, student_id, op, current_date)
+        self.metrics.count(f'attendance_{op}')
+        
+        # دمج السجل في ملف البيانات بالخلفية عند تراكم عدد كافٍ من الأحداث
+        if self.storage.pending_count >= JOURNAL_COMPACT_EVERY:
+            self.save_data()
+        return event
+    
+    @timed('save_data')
+    def save_data(self, full=False, wait=False):
+        """طلب حفظ التعديلات المعلقة بالخلفية، أو الحفظ فوراً وانتظار انتهائه إذا كان wait صحيحاً"""
+        if self.sheets is not None:
+            self.sheets.request()
+        if wait:
+            return self.saver.flush(full=full)
+        self.saver.request(full=full)
+        return True
+    
+    def save_status(self):
+        """حالة الحفظ بالخلفية في الشريط الجانبي"""
+        saver = self.saver
+        if saver.last_save is None:
+            st.caption(f"💾 الحفظ بالخلفية كل {saver.interval:g} ثانية، ولم يتم أي حفظ بعد")
+        else:
+            st.caption(
+                f"💾 آخر حفظ بالخلفية: {saver.last_save:%H:%M:%S} "
+                f"في {saver.last_duration:.1f} ثانية (طلبات مدمجة: {saver.last_coalesced})"
+            )
+        if saver.pending:
+            st.caption(f"⏳ طلبات حفظ منتظرة: {saver.pending}")
+        if saver.error:
+            st.error(f"خطأ في آخر حفظ بالخلفية: {saver.error}")
+    
+    def sheets_status(self):
+        """حالة مزامنة Google Sheets في الشريط الجانبي"""
+        sheets = self.sheets
+        if sheets.last_sync is not None:
+            st.caption(
+                f"☁️ آخر مزامنة مع Google Sheets: {sheets.last_sync:%H:%M:%S} "
+                f"({sheets.last_rows} صف في {sheets.last_calls} طلب، {sheets.last_duration:.1f} ثانية)"
+            )
+        pending_groups = sheets.pending_groups
+        if pending_groups:
+            st.caption(f"☁️ مجموعات بها تعديلات لم ترسل بعد: {len(pending_groups)}")
+        if sheets.error:
+            st.error(f"خطأ في مزامنة Google Sheets (محاولة رقم {sheets.failures}): {sheets.error}")
+        if st.button("☁️ مزامنة Google Sheets الآن"):
+            sheets.request()
+            st.success("تم طلب المزامنة، وستتم بالخلفية")
     
     def setup_ui(self):
         st.markdown("""
@@ -246,8 +4130,8 @@ class StudentAttendanceSystem:
         st.title("🎓 نظام حضور الطلاب")
         
         # عرض حالة آخر حفظ
-        if os.path.exists(self.excel_path):
-            last_modified = os.path.getmtime(self.excel_path)
+        if os.path.exists(self.storage.path):
+            last_modified = os.path.getmtime(self.storage.path)
             last_modified_date = date.fromtimestamp(last_modified)
             st.info(f"📁 آخر حفظ للبيانات: {last_modified_date}")
         
@@ -267,13 +4151,7 @@ class StudentAttendanceSystem:
             new_group_name = st.text_input("اسم المجموعة الجديدة")
             if st.button("➕ إضافة مجموعة") and new_group_name:
                 if new_group_name not in self.groups_df:
-                    required_columns = [
-                        'الكود', 'الاسم', 'رقم_الهاتف', 'ولي_الامر', 'الحصص_الحاضرة'
-                    ] + self.months + [
-                        'تواريخ_الحضور', 'تاريخ_التسجيل', 'ملاحظات', 'الاختبارات'
-                    ]
-                    
-                    self.groups_df[new_group_name] = pd.DataFrame(columns=required_columns)
+                    self.storage.add_group(new_group_name)
                     self.save_data()
                     st.success(f"تم إنشاء المجموعة '{new_group_name}' بنجاح!")
                     time.sleep(1)
@@ -285,17 +4163,44 @@ class StudentAttendanceSystem:
             if len(self.groups_df) > 1:
                 group_to_delete = st.selectbox("اختر مجموعة للحذف", current_groups)
                 if st.button("🗑️ حذف المجموعة") and group_to_delete:
-                    del self.groups_df[group_to_delete]
+                    self.storage.delete_group(group_to_delete)
                     self.current_group = list(self.groups_df.keys())[0]
                     self.save_data()
                     st.success(f"تم حذف المجموعة '{group_to_delete}' بنجاح!")
                     time.sleep(1)
                     st.rerun()
             
-            # زر حفظ يدوي
+            # زر حفظ يدوي ينفذ كل طلبات الحفظ المنتظرة فوراً
             if st.button("💾 حفظ البيانات يدوياً"):
-                self.save_data()
-                st.success("تم حفظ البيانات!")
+                if self.save_data(full=True, wait=True):
+                    st.success("تم حفظ البيانات!")
+                else:
+                    st.error(f"خطأ في حفظ البيانات: {self.saver.error}")
+            
+            self.save_status()
+            if self.sheets is not None:
+                self.sheets_status()
+            
+            # حالة سجل التعديلات
+            if isinstance(self.storage, ExcelStorage):
+                st.caption(f"🧾 تعديلات لم تدمج في ملف الإكسل: {self.storage.pending_count}")
+                if self.storage.pending_count and st.button("🧾 دمج سجل التعديلات الآن"):
+                    if self.save_data(wait=True):
+                        st.success("تم دمج سجل التعديلات في ملف البيانات!")
+                    else:
+                        st.error(f"خطأ في حفظ البيانات: {self.saver.error}")
+            else:
+                # ملف الإكسل يبقى متاحاً كصيغة تصدير عند استخدام قاعدة البيانات
+                if st.button("📤 تجهيز نسخة Excel"):
+                    st.download_button(
+                        label="📥 تحميل ملف Excel",
+                        data=self.storage.export_excel(),
+                        file_name=f"students_data_{date.today()}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+            
+            # لوحة الأداء تملأ بعد عرض كل التبويبات حتى تشمل كل مراحل إعادة التشغيل هذه
+            metrics_container = st.container()
         
         # تبويبات الواجهة الرئيسية
         tabs = st.tabs(["📷 مسح حضور الطالب", "➕ تسجيل طالب جديد", "🔄 إدارة الطلاب", "📊 الإحصائيات"])
@@ -308,13 +4213,247 @@ class StudentAttendanceSystem:
             self.manage_students_tab()
         with tabs[3]:
             self.view_analytics_tab()
+        
+        self.metrics.end_run()
+        with metrics_container:
+            self.metrics_panel()
+        
+        # إعادة التشغيل بعد عرض كل التبويبات لتسجيل الدفعة التالية من المسح المستمر، فقط في جلسة المشغل
+        # التي تعرض المسح المستمر وفعلت التسجيل التلقائي، لأن عامل المسح مشترك بين كل الجلسات
+        live_mode = st.session_state.get('scan_mode') == "🎥 مسح مستمر"
+        if live_mode and _shared_live_scanner().is_running and st.session_state.get('live_auto_refresh', False):
+            time.sleep(LIVE_SCAN_COMMIT_INTERVAL)
+            st.rerun()
+            
+    def metrics_panel(self):
+        """لوحة اختيارية في الشريط الجانبي بمراحل إعادة التشغيل الحالية والنسب المئوية لآخر القياسات"""
+        if not st.checkbox("⏱️ عرض لوحة الأداء", key="metrics_show"):
+            return
+        
+        metrics = self.metrics
+        spans = metrics.run_spans
+        if spans:
+            st.caption("مراحل إعادة التشغيل الحالية بالمللي ثانية")
+            st.dataframe(
+                pd.DataFrame(
+                    [(' ' * 4 * depth + name, start_ms, duration_ms) for name, start_ms, duration_ms, depth in spans],
+                    columns=['المرحلة', 'البداية', 'الزمن']
+                ).round(1),
+                use_container_width=True, hide_index=True
+            )
+        
+        summary = metrics.summary()
+        if not summary.empty:
+            st.caption(f"آخر {METRICS_WINDOW} قياس لكل مرحلة بالمللي ثانية")
+            st.dataframe(summary, use_container_width=True)
+        counters = metrics.counters.copy()
+        if counters:
+            st.caption(' | '.join(f"{name}: {value}" for name, value in sorted(counters.items())))
+        
+        if metrics.prometheus_path:
+            st.caption(f"📈 ملف Prometheus: {metrics.prometheus_path}")
+        if metrics.log_path:
+            st.caption(f"🧾 سجل المراحل: {metrics.log_path}")
+        if metrics.export_error:
+            st.error(f"خطأ في تصدير مقاييس الأداء: {metrics.export_error}")
+        
+        st.download_button(
+            label="📥 تحميل المقاييس بصيغة Prometheus",
+            data=metrics.prometheus_text(),
+            file_name="students_metrics.prom",
+            mime="text/plain",
+            key="metrics_download"
+        )
+        if st.button("🔄 تصفير المقاييس", key="metrics_reset"):
+            metrics.reset()
+            st.success("تم تصفير المقاييس")
+    
+    def commit_live_scans(self):
+        """تسجيل حضور كل الأكواد المنتظرة من المسح المستمر كمعاملة واحدة (كتابة واحدة في السجل أو قاعدة البيانات)"""
+        worker = _shared_live_scanner()
+        scans = worker.drain()
+        marks = []
+        for student_code, seen_at in scans:
+            student_group, _ = self.storage.find_student(student_code)
+            if student_group is not None:
+                marks.append((student_group, str(student_code), seen_at.strftime("%Y-%m-%d")))
+        
+        if marks:
+            self.storage.record_attendance_batch(marks)
+            self.metrics.count('attendance_attend', len(marks))
+            if self.storage.pending_count >= JOURNAL_COMPACT_EVERY:
+                self.save_data()
+        
+        # عدد الحصص يقرأ بعد تسجيل الدفعة كلها
+        results = []
+        for student_code, seen_at in scans:
+            student_group, student_index = self.storage.find_student(student_code)
+            if student_group is None:
+                results.append({'الكود': student_code, 'الاسم': '❌ غير مسجل', 'المجموعة': '', 'الوقت': seen_at})
+                continue
+            
+            student_row = self.groups_df[student_group].loc[student_index]
+            results.append({
+                'الكود': student_code,
+                'الاسم': student_row['الاسم'],
+                'المجموعة': student_group,
+                'الحصص_الحاضرة': int(student_row['الحصص_الحاضرة']),
+                'الوقت': seen_at
+            })
+        
+        worker.recent.extendleft(results)
+        return results
+    
+    def live_scan_section(self):
+        """واجهة المسح المستمر من الكاميرا أو ملف فيديو"""
+        worker = _shared_live_scanner()
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            source = st.text_input("مصدر الفيديو (رقم الكاميرا أو مسار ملف)", value="0", key="live_source")
+        with col2:
+            debounce_seconds = st.number_input(
+                "تجاهل تكرار نفس الكود خلال (ثانية)", min_value=1, value=LIVE_SCAN_DEBOUNCE_SECONDS, key="live_debounce"
+            )
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button("▶️ بدء المسح المستمر", disabled=worker.is_running):
+                worker.start(source, debounce_seconds)
+                st.rerun()
+        with col2:
+            if st.button("⏹️ إيقاف المسح", disabled=not worker.is_running):
+                worker.stop()
+                self.commit_live_scans()
+                st.rerun()
+        with col3:
+            st.checkbox("تسجيل تلقائي كل ثانيتين", value=True, key="live_auto_refresh")
+        
+        new_results = self.commit_live_scans()
+        
+        status = "🟢 يعمل" if worker.is_running else "⚪ متوقف"
+        st.caption(f"{status} | الإطارات المقروءة: {worker.frames_read} | تم تسجيلهم الآن: {len(new_results)}")
+        if worker.error:
+            st.error(worker.error)
+        
+        if worker.recent:
+            st.markdown("### آخر الطلاب المسجلين")
+            st.dataframe(pd.DataFrame(list(worker.recent)), use_container_width=True)
+    
+    def import_bulk_attendance(self, media_path, day=None, max_workers=None, frame_step=BULK_VIDEO_FRAME_STEP):
+        """تسجيل حضور كل الأكواد في مجلد صور أو فيديو مسجل كمعاملة واحدة وإرجاع ملخص
+
+        day يحدد يوم الحضور لكل الملفات، وإلا يستخدم يوم التقاط كل ملف.
+        الطالب يسجل مرة واحدة فقط في اليوم مهما تكرر في الصور أو كان مسجلاً من قبل
+        """
+        started = time.perf_counter()
+        results = scan_media_bulk(media_path, max_workers, frame_step)
+        
+        summary = {'files': len(results), 'codes_read': 0, 'duplicates': 0, 'recorded': [], 'unknown': [], 'errors': []}
+        marks = []
+        seen = set()
+        for result in results:
+            if result.get('error'):
+                summary['errors'].append({'الملف': result['source'], 'الخطأ': result['error']})
+                continue
+            
+            attendance_day = day or result['day']
+            for student_code in result['codes']:
+                summary['codes_read'] += 1
+                student_group, student_index = self.storage.find_student(student_code)
+                if student_group is None:
+                    summary['unknown'].append({'الكود': student_code, 'الملف': result['source']})
+                    continue
+                
+                student_code = str(student_code)
+                if (student_code, attendance_day) in seen or self.storage.attendance.attended_on(student_code, attendance_day):
+                    summary['duplicates'] += 1
+                    continue
+                seen.add((student_code, attendance_day))
+                
+                marks.append((student_group, student_code, attendance_day))
+                summary['recorded'].append({
+                    'الكود': student_code,
+                    'الاسم': self.groups_df[student_group].loc[student_index, 'الاسم'],
+                    'المجموعة': student_group,
+                    'التاريخ': attendance_day
+                })
+        
+        if marks:
+            self.storage.record_attendance_batch(marks)
+            self.save_data()
+        
+        summary['elapsed'] = time.perf_counter() - started
+        print(f"استيراد جماعي: {len(marks)} حضور من {summary['files']} ملف في {summary['elapsed']:.1f} ثانية")
+        return summary
+    
+    def bulk_import_section(self):
+        """واجهة تسجيل الحضور من مجلد صور أو ملف فيديو تم تصويره مسبقاً"""
+        media_path = st.text_input("مسار مجلد الصور أو ملف الفيديو", key="bulk_media_path")
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            use_file_date = st.checkbox("استخدام تاريخ التقاط كل ملف", value=True, key="bulk_use_file_date")
+            attendance_day = None if use_file_date else st.date_input("تاريخ الحضور", value=date.today(), key="bulk_day")
+        with col2:
+            max_workers = st.number_input("عدد العمليات", min_value=1, value=os.cpu_count() or 1, key="bulk_workers")
+        with col3:
+            frame_step = st.number_input(
+                "قراءة إطار من كل (للفيديو)", min_value=1, value=BULK_VIDEO_FRAME_STEP, key="bulk_frame_step"
+            )
+        
+        if st.button("📂 بدء الاستيراد") and media_path:
+            if not os.path.exists(media_path):
+                st.error("المسار غير موجود!")
+                return
+            
+            try:
+                with st.spinner("جاري قراءة الأكواد..."):
+                    summary = self.import_bulk_attendance(
+                        media_path,
+                        day=attendance_day.isoformat() if attendance_day else None,
+                        max_workers=int(max_workers),
+                        frame_step=int(frame_step)
+                    )
+            except Exception as e:
+                print(f"خطأ في الاستيراد الجماعي: {str(e)}")
+                st.error(f"خطأ في الاستيراد الجماعي: {str(e)}")
+                return
+            
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("الملفات", summary['files'])
+            col2.metric("تم تسجيلهم", len(summary['recorded']))
+            col3.metric("مكرر في نفس اليوم", summary['duplicates'])
+            col4.metric("غير مسجلين", len(summary['unknown']))
+            st.caption(f"⏱️ {summary['elapsed']:.1f} ثانية | أكواد مقروءة: {summary['codes_read']}")
             
+            if summary['recorded']:
+                st.success(f"تم تسجيل حضور {len(summary['recorded'])} طالب!")
+                st.dataframe(pd.DataFrame(summary['recorded']), use_container_width=True)
+            if summary['unknown']:
+                st.markdown("### أكواد غير مسجلة في النظام")
+                st.dataframe(pd.DataFrame(summary['unknown']), use_container_width=True)
+            if summary['errors']:
+                st.markdown("### ملفات تعذرت قراءتها")
+                st.dataframe(pd.DataFrame(summary['errors']), use_container_width=True)
+
     def scan_qr_tab(self):
         if self.current_group not in self.groups_df:
             st.warning("الرجاء اختيار مجموعة صالحة")
             return
             
         st.header(f"📷 تسجيل حضور الطالب - مجموعة {self.current_group}")
+        
+        scan_mode = st.radio(
+            "طريقة المسح", ["📸 صورة لكل طالب", "🎥 مسح مستمر", "📂 استيراد صور أو فيديو"], horizontal=True, key="scan_mode"
+        )
+        if scan_mode == "🎥 مسح مستمر":
+            self.live_scan_section()
+            return
+        if scan_mode == "📂 استيراد صور أو فيديو":
+            self.bulk_import_section()
+            return
+        
         welcome_placeholder = st.empty()
         
         # استخدام session state لتجنب المعالجة المكررة للصورة
@@ -329,37 +4468,44 @@ class StudentAttendanceSystem:
             
             try:
                 img = Image.open(img_file)
-                frame = np.array(img)
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                detector = cv2.QRCodeDetector()
-                data, vertices, _ = detector.detectAndDecode(gray)
+                with self.metrics.span('qr_decode'):
+                    scan_result = _shared_qr_scanner().decode(img)
+                self.metrics.count('qr_scans' if scan_result['codes'] else 'qr_scans_unread')
                 
-                if data:
-                    self.process_student_attendance(data.strip(), welcome_placeholder)
+                if scan_result['codes']:
+                    # قد تحتوي الصورة على أكثر من كود طالب
+                    for i, student_code in enumerate(scan_result['codes']):
+                        placeholder = welcome_placeholder if i == 0 else st.empty()
+                        self.process_student_attendance(student_code, placeholder)
                 else:
                     st.warning("لم يتم التعرف على كود الطالب، حاول مرة أخرى")
+                
+                timings = ' | '.join(f"{name}: {value:.0f}ms" for name, value in scan_result['timings'].items())
+                st.caption(f"⏱️ {timings}")
             except Exception as e:
                 st.error(f"خطأ في المسح: {str(e)}")
         
+        # أزمنة مراحل المسح لضبط الأداء على الأجهزة الضعيفة
+        scanner = _shared_qr_scanner()
+        if scanner.recent_scans:
+            with st.expander("⏱️ أزمنة مراحل المسح"):
+                st.dataframe(scanner.timing_summary(), use_container_width=True)
+        
         # زر لمسح الصورة يدوياً إذا احتجنا
         if st.button("🗑️ مسح الصورة والبدء من جديد"):
             st.session_state.last_processed_image = None
             st.rerun()
     
+    @timed('process_attendance')
     def process_student_attendance(self, student_id, welcome_placeholder):
         # البحث عن الطالب في جميع المجموعات
         student_found = False
-        student_group = None
         student_row = None
-        student_index = None
         
-        for group_name, df in self.groups_df.items():
-            if student_id in df['الكود'].values:
-                student_found = True
-                student_group = group_name
-                student_index = df[df['الكود'] == student_id].index[0]
-                student_row = df.loc[student_index]
-                break
+        student_group, student_index = self.storage.find_student(student_id)
+        if student_group is not None:
+            student_found = True
+            student_row = self.groups_df[student_group].loc[student_index]
         
         if student_found:
             # التحقق من عدم تكرار تسجيل الحضور لنفس الصورة
@@ -367,22 +4513,8 @@ class StudentAttendanceSystem:
                 st.session_state[f'last_attendance_{student_id}'] = None
             
             if st.session_state[f'last_attendance_{student_id}'] != st.session_state.last_processed_image:
-                # تحديث عدد الحصص
-                self.groups_df[student_group].loc[student_index, 'الحصص_الحاضرة'] += 1
-                
-                # تسجيل تاريخ الحضور
-                current_date = date.today().strftime("%Y-%m-%d")
-                current_presence = student_row['تواريخ_الحضور']
-                
-                if pd.isna(current_presence) or current_presence == '' or current_presence == 'nan':
-                    new_presence = current_date
-                else:
-                    new_presence = f"{current_presence}; {current_date}"
-                    
-                self.groups_df[student_group].loc[student_index, 'تواريخ_الحضور'] = new_presence
-                
-                # حفظ البيانات فوراً
-                self.save_data()
+                # تسجيل الحضور في السجل (يتم دمجه في ملف الإكسل لاحقاً)
+                self.log_attendance(student_group, student_index)
                 
                 # تسجيل أن هذه الصورة تم معالجتها
                 st.session_state[f'last_attendance_{student_id}'] = st.session_state.last_processed_image
@@ -423,7 +4555,7 @@ class StudentAttendanceSystem:
                 
             with col2:
                 st.markdown("### الحضور والدفع")
-                months_paid = [month for month in self.months if updated_student_row[month]]
+                months_paid = paid_months(updated_student_row[PAYMENTS_COLUMN], self.months)
                 months_display = [month.replace('_', ' ') for month in months_paid]
                 
                 st.markdown(f"""
@@ -432,24 +4564,20 @@ class StudentAttendanceSystem:
                 """)
             
             # عرض تواريخ الحضور
-            if pd.notna(updated_student_row['تواريخ_الحضور']) and updated_student_row['تواريخ_الحضور'] != '' and updated_student_row['تواريخ_الحضور'] != 'nan':
+            dates = self.storage.attendance.history(updated_student_row['الكود'])
+            if dates:
                 st.markdown("### تواريخ الحضور")
-                dates = str(updated_student_row['تواريخ_الحضور']).split(';')
                 st.markdown('<div class="attendance-dates">', unsafe_allow_html=True)
-                for i, date_str in enumerate(dates, 1):
-                    date_str = date_str.strip()
-                    if date_str and date_str != 'nan':
-                        st.markdown(f"- الحصة {i}: {date_str}")
+                for i, attendance_date in enumerate(dates, 1):
+                    st.markdown(f"- الحصة {i}: {attendance_date}")
                 st.markdown('</div>', unsafe_allow_html=True)
             
             # عرض نتائج الاختبارات
-            if pd.notna(updated_student_row['الاختبارات']) and updated_student_row['الاختبارات'] != '' and updated_student_row['الاختبارات'] != 'nan':
+            tests = self.storage.tests.for_student(updated_student_row['الكود'])
+            if not tests.empty:
                 st.markdown("### نتائج الاختبارات")
-                tests = str(updated_student_row['الاختبارات']).split(';')
-                for test in tests:
-                    test = test.strip()
-                    if test and test != 'nan':
-                        st.markdown(f"- {test}")
+                for entry in tests['entry']:
+                    st.markdown(f"- {entry}")
             
             st.markdown('</div>', unsafe_allow_html=True)
         else:
@@ -477,17 +4605,7 @@ class StudentAttendanceSystem:
             # تحديد الشهر الحالي بناءً على تاريخ التسجيل
             current_month = None
             if registration_date:
-                month_num = registration_date.month
-                year = registration_date.year
-                
-                months_mapping = {
-                    7: 'يوليو_2025', 8: 'أغسطس_2025', 9: 'سبتمبر_2025', 
-                    10: 'أكتوبر_2025', 11: 'نوفمبر_2025', 12: 'ديسمبر_2025',
-                    1: 'يناير_2026', 2: 'فبراير_2026', 3: 'مارس_2026', 
-                    4: 'أبريل_2026', 5: 'مايو_2026', 6: 'يونيو_2026'
-                }
-                
-                current_month = months_mapping.get(month_num)
+                current_month = self.registration_months().get(registration_date.month)
             
             # إظهار حالة الدفع
             st.subheader("حالة الدفع للأشهر")
@@ -496,12 +4614,8 @@ class StudentAttendanceSystem:
             
             if st.form_submit_button("تسجيل الطالب"):
                 if student_name and student_id:
-                    # التحقق من عدم وجود الكود في أي مجموعة
-                    code_exists = False
-                    for group_name, df in self.groups_df.items():
-                        if student_id in df['الكود'].values:
-                            code_exists = True
-                            break
+                    # التحقق من عدم وجود الكود في أي مجموعة عن طريق فهرس الأكواد
+                    code_exists = self.storage.find_student(student_id)[0] is not None
                     
                     if code_exists:
                         st.error("هذا الكود مسجل بالفعل لطالب آخر في إحدى المجموعات")
@@ -522,39 +4636,90 @@ class StudentAttendanceSystem:
                             selected_group
                         )
                         
-                        st.success("تم تسجيل الطالب بنجاح! ✅")
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.image(qr_image, caption=f"كود الطالب {student_name}", width=300)
-                        
-                        with col2:
-                            months_paid = [m.replace('_', ' ') for m, paid in month_status.items() if paid]
-                            st.markdown(f"""
-                            ### بيانات الطالب المسجل:
-                            - **المجموعة**: {selected_group}
-                            - **الاسم**: {student_name}
-                            - **كود الطالب**: {student_id}
-                            - **رقم الهاتف**: {phone}
-                            - **ولي الأمر**: {parent_phone}
-                            - **تاريخ التسجيل**: {registration_date}
-                            - **الشهر المدفوع**: {', '.join(months_paid) if months_paid else 'لا يوجد'}
-                            """)
+                        # لا يعرض نجاح ولا QR إذا رُفض الطالب (مثل كود سجلته جلسة أخرى في نفس اللحظة)
+                        if qr_image is not None:
+                            st.success("تم تسجيل الطالب بنجاح! ✅")
+                            
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                st.image(qr_image, caption=f"كود الطالب {student_name}", width=300)
+                            
+                            with col2:
+                                months_paid = [m.replace('_', ' ') for m, paid in month_status.items() if paid]
+                                st.markdown(f"""
+                                ### بيانات الطالب المسجل:
+                                - **المجموعة**: {selected_group}
+                                - **الاسم**: {student_name}
+                                - **كود الطالب**: {student_id}
+                                - **رقم الهاتف**: {phone}
+                                - **ولي الأمر**: {parent_phone}
+                                - **تاريخ التسجيل**: {registration_date}
+                                - **الشهر المدفوع**: {', '.join(months_paid) if months_paid else 'لا يوجد'}
+                                """)
                 else:
                     st.error("الرجاء إدخال اسم الطالب وكود الطالب")
+        
+        # إضافة قائمة طلاب كاملة من ملف
+        self.bulk_students_section()
+    
+    def registration_months(self):
+        """رقم الشهر -> عمود الدفع الخاص به في السنة الدراسية النشطة"""
+        return {parse_month_column(month)[0]: month for month in self.months}
+    
+    def import_students(self, roster, group_name):
+        """إضافة كل الطلاب الصالحين في ملف الطلاب لمجموعة بإضافة واحدة وحفظ واحد
+
+        يرجع (الطلاب المضافين، أخطاء الصفوف المرفوضة)
+        """
+        students, errors = validate_roster(
+            roster, self.months, list(self.storage.code_index), self.registration_months()
+        )
+        
+        if not students.empty:
+            self.storage.add_students(group_name, students.to_dict('records'))
+            self.save_data()
+        
+        print(f"تم استيراد {len(students)} طالب في المجموعة {group_name} ورفض {len(errors)} صف")
+        return students, errors
     
+    def bulk_students_section(self):
+        """واجهة استيراد قائمة طلاب من ملف CSV أو Excel"""
+        with st.expander("📥 استيراد طلاب من ملف CSV أو Excel"):
+            st.caption("الأعمدة: الكود، الاسم، رقم_الهاتف، ولي_الامر، تاريخ_التسجيل، ملاحظات (الكود والاسم فقط مطلوبان)")
+            roster_file = st.file_uploader("ملف الطلاب", type=['csv', 'xlsx', 'xls'], key="roster_file")
+            group_options = list(self.groups_df.keys())
+            group_name = st.selectbox("المجموعة", group_options, key="roster_group")
+            generate_qr = st.checkbox("تجهيز أكواد QR للطلاب المضافين", value=True, key="roster_qr")
+            
+            if st.button("📥 استيراد الطلاب") and roster_file is not None:
+                try:
+                    started = time.perf_counter()
+                    students, errors = self.import_students(read_roster_file(roster_file), group_name)
+                except Exception as e:
+                    print(f"خطأ في استيراد الطلاب: {str(e)}")
+                    st.error(f"خطأ في استيراد الطلاب: {str(e)}")
+                    return
+                
+                if not students.empty:
+                    st.success(f"تم إضافة {len(students)} طالب للمجموعة '{group_name}' في {time.perf_counter() - started:.1f} ثانية ✅")
+                if not errors.empty:
+                    st.warning(f"تم رفض {len(errors)} صف")
+                    st.dataframe(errors, use_container_width=True)
+                
+                if generate_qr and not students.empty:
+                    student_ids = students['الكود'].tolist()
+                    st.download_button(
+                        label="📥 تحميل أكواد الطلاب المضافين (PDF)",
+                        data=export_qr_sheet(student_ids, _shared_qr_cache().get_many(student_ids), 'pdf'),
+                        file_name=f"qr_codes_{group_name}_{date.today()}.pdf",
+                        mime="application/pdf"
+                    )
+
     def create_student(self, student_id, student_name, phone, parent_phone, registration_date, notes, month_status, group_name):
-        """إنشاء طالب جديد مع حفظ فوري للبيانات"""
+        """إنشاء طالب جديد مع حفظ فوري للبيانات، ويرجع صورة QR أو None إذا لم يتم التسجيل"""
         try:
             # إنشاء QR Code
-            qr = qrcode.QRCode(version=1, box_size=10, border=4)
-            qr.add_data(student_id)
-            qr.make(fit=True)
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-            
-            img_bytes = BytesIO()
-            qr_img.save(img_bytes, format="PNG")
-            img_bytes.seek(0)
+            img_bytes = self.generate_qr_code(student_id)
             
             # إعداد بيانات الطالب الجديد
             new_row_data = {
@@ -573,69 +4738,74 @@ class StudentAttendanceSystem:
             for month in self.months:
                 new_row_data[month] = month_status.get(month, False)
             
-            # إضافة الطالب للمجموعة المحددة
-            new_row = pd.DataFrame([new_row_data])
-            
-            # التأكد من ترتيب الأعمدة
-            required_columns = [
-                'الكود', 'الاسم', 'رقم_الهاتف', 'ولي_الامر', 'الحصص_الحاضرة'
-            ] + self.months + [
-                'تواريخ_الحضور', 'تاريخ_التسجيل', 'ملاحظات', 'الاختبارات'
-            ]
-            
-            new_row = new_row[required_columns]
-            
-            self.groups_df[group_name] = pd.concat(
-                [self.groups_df[group_name], new_row], 
-                ignore_index=True
-            )
-            
-            # حفظ البيانات فوراً
+            # إضافة الطالب في آخر جدول المجموعة المحددة وحفظ البيانات فوراً
+            self.storage.add_student(group_name, new_row_data)
             self.save_data()
             
             print(f"تم إنشاء الطالب {student_name} بنجاح في المجموعة {group_name}")
             
             return img_bytes
             
+        except DuplicateStudentCodesError as e:
+            print(f"لم يتم تسجيل الطالب: {str(e)}")
+            st.error("هذا الكود مسجل بالفعل لطالب آخر في إحدى المجموعات")
+            return None
+        
         except Exception as e:
             print(f"خطأ في إنشاء الطالب: {str(e)}")
             st.error(f"خطأ في إنشاء الطالب: {str(e)}")
             return None
     
+    @timed('search_students')
     def search_students(self, query, search_by="name"):
-        """البحث عن الطلاب في المجموعة الحالية"""
-        df = self.groups_df[self.current_group]
-        
+        """البحث عن الطلاب في المجموعة الحالية باستخدام فهرس البحث المبني مسبقاً"""
         if search_by == "name":
             # البحث بأسماء الطلاب مع الاقتراحات
-            all_names = df['الاسم'].dropna().unique()
-            matches = [name for name in all_names if query.lower() in str(name).lower()]
-            return matches
+            return self.storage.search_index(self.current_group, 'الاسم').search(query)
         else:
             # البحث بأكواد الطلاب مع الاقتراحات
-            all_codes = df['الكود'].dropna().unique().astype(str)
-            matches = [code for code in all_codes if query.lower() in str(code).lower()]
-            return matches
+            return self.storage.search_index(self.current_group, 'الكود').search(query)
     
     def generate_qr_code(self, student_id):
-        """إنشاء QR Code لطالب معين"""
-        qr = qrcode.QRCode(version=1, box_size=10, border=4)
-        qr.add_data(student_id)
-        qr.make(fit=True)
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        
-        img_bytes = BytesIO()
-        qr_img.save(img_bytes, format="PNG")
-        img_bytes.seek(0)
-        
-        return img_bytes
+        """إنشاء QR Code لطالب معين من الذاكرة المؤقتة لصور QR"""
+        return BytesIO(_shared_qr_cache().get(student_id))
     
+    def qr_batch_section(self, df):
+        """تجهيز أكواد QR لكل طلاب المجموعة في ملف واحد للطباعة"""
+        file_formats = {
+            'pdf': ("📄 PDF للطباعة", "application/pdf"),
+            'png': ("🖼️ صورة PNG واحدة", "image/png"),
+            'zip': ("🗂️ ZIP بصورة لكل طالب", "application/zip")
+        }
+        
+        with st.expander("🖨️ طباعة أكواد QR للمجموعة"):
+            file_format = st.selectbox(
+                "صيغة الملف", list(file_formats), format_func=lambda name: file_formats[name][0], key="qr_sheet_format"
+            )
+            
+            if st.button("🎫 تجهيز أكواد المجموعة"):
+                started = time.perf_counter()
+                student_ids = [str(student_id) for student_id in df['الكود'].values]
+                images = _shared_qr_cache().get_many(student_ids)
+                sheet = export_qr_sheet(student_ids, images, file_format)
+                
+                st.caption(f"⏱️ تم تجهيز {len(student_ids)} كود في {time.perf_counter() - started:.1f} ثانية")
+                st.download_button(
+                    label="📥 تحميل أكواد المجموعة",
+                    data=sheet,
+                    file_name=f"qr_codes_{self.current_group}_{date.today()}.{file_format}",
+                    mime=file_formats[file_format][1]
+                )
+
     def manage_students_tab(self):
         st.header(f"🔄 إدارة الطلاب - مجموعة {self.current_group}")
         
         df = self.groups_df[self.current_group]
         
         if not df.empty:
+            # طباعة أكواد كل طلاب المجموعة
+            self.qr_batch_section(df)
+            
             # قسم البحث عن الطالب
             st.subheader("بحث عن الطالب")
             
@@ -694,22 +4864,8 @@ class StudentAttendanceSystem:
                     col1, col2 = st.columns(2)
                     with col1:
                         if st.button("➕ تسجيل حضور إضافي"):
-                            # تحديث عدد الحصص
-                            self.groups_df[self.current_group].loc[student_index, 'الحصص_الحاضرة'] += 1
-                            
-                            # تسجيل تاريخ الحضور
-                            current_date = date.today().strftime("%Y-%m-%d")
-                            current_presence = student_row['تواريخ_الحضور']
-                            
-                            if pd.isna(current_presence) or current_presence == '' or current_presence == 'nan':
-                                new_presence = current_date
-                            else:
-                                new_presence = f"{current_presence}; {current_date}"
-                                
-                            self.groups_df[self.current_group].loc[student_index, 'تواريخ_الحضور'] = new_presence
-                            
-                            # حفظ البيانات فوراً
-                            self.save_data()
+                            # تسجيل الحضور في السجل
+                            self.log_attendance(self.current_group, student_index)
                             st.success("تم تسجيل الحضور بنجاح!")
                             time.sleep(1)
                             st.rerun()
@@ -717,20 +4873,8 @@ class StudentAttendanceSystem:
                     with col2:
                         if st.button("➖ خصم حصة حضور"):
                             if student_row['الحصص_الحاضرة'] > 0:
-                                self.groups_df[self.current_group].loc[student_index, 'الحصص_الحاضرة'] -= 1
-                                
-                                # إزالة آخر تاريخ حضور
-                                current_presence = student_row['تواريخ_الحضور']
-                                if pd.notna(current_presence) and current_presence != '' and current_presence != 'nan':
-                                    dates = str(current_presence).split(';')
-                                    if len(dates) > 1:
-                                        new_dates = ';'.join(dates[:-1])
-                                    else:
-                                        new_dates = ''
-                                    self.groups_df[self.current_group].loc[student_index, 'تواريخ_الحضور'] = new_dates
-                                
-                                # حفظ البيانات فوراً
-                                self.save_data()
+                                # خصم الحصة وإزالة آخر تاريخ حضور عن طريق السجل
+                                self.log_attendance(self.current_group, student_index, op='unattend')
                                 st.success("تم خصم الحصة بنجاح!")
                                 time.sleep(1)
                                 st.rerun()
@@ -747,10 +4891,11 @@ class StudentAttendanceSystem:
                         # إنشاء شبكة من الخانات لجميع الأشهر
                         cols = st.columns(4)
                         updated_payment_status = {}
+                        current_paid = paid_months(student_row[PAYMENTS_COLUMN], self.months)
                         
                         for i, month in enumerate(self.months):
                             with cols[i % 4]:
-                                current_status = bool(student_row[month])
+                                current_status = month in current_paid
                                 updated_payment_status[month] = st.checkbox(
                                     month.replace('_', ' '), 
                                     value=current_status,
@@ -758,8 +4903,7 @@ class StudentAttendanceSystem:
                                 )
                         
                         if st.form_submit_button("حفظ حالة الدفع"):
-                            for month in self.months:
-                                self.groups_df[self.current_group].loc[student_index, month] = updated_payment_status[month]
+                            self.storage.update_payments(self.current_group, student_row['الكود'], updated_payment_status)
                             
                             # حفظ البيانات فوراً
                             self.save_data()
@@ -771,30 +4915,30 @@ class StudentAttendanceSystem:
                     st.subheader("إدارة الاختبارات")
                     
                     # عرض الاختبارات الحالية
-                    current_tests = student_row['الاختبارات']
-                    if pd.notna(current_tests) and current_tests != '' and current_tests != 'nan':
+                    current_tests = self.storage.tests.for_student(student_row['الكود'])
+                    if not current_tests.empty:
                         st.markdown("#### نتائج الاختبارات الحالية")
-                        tests = str(current_tests).split(';')
-                        for test in tests:
-                            test = test.strip()
-                            if test and test != 'nan':
-                                st.markdown(f"- {test}")
+                        for entry in current_tests['entry']:
+                            st.markdown(f"- {entry}")
                     
                     # إضافة اختبار جديد
                     st.markdown("#### إضافة اختبار جديد")
                     test_name = st.text_input("اسم الاختبار", key="test_name")
-                    test_score = st.text_input("الدرجة", key="test_score")
+                    test_col1, test_col2, test_col3 = st.columns(3)
+                    with test_col1:
+                        test_score = st.text_input("الدرجة", key="test_score")
+                    with test_col2:
+                        test_max_score = st.number_input("الدرجة النهائية (اختياري)", min_value=0.0, step=1.0, key="test_max_score")
+                    with test_col3:
+                        test_date = st.date_input("تاريخ الاختبار", value=date.today(), key="test_date")
                     
                     if st.button("إضافة نتيجة الاختبار"):
                         if test_name and test_score:
-                            new_test = f"{test_name}: {test_score}"
-                            
-                            if pd.isna(current_tests) or current_tests == '' or current_tests == 'nan':
-                                updated_tests = new_test
-                            else:
-                                updated_tests = f"{current_tests}; {new_test}"
-                            
-                            self.groups_df[self.current_group].loc[student_index, 'الاختبارات'] = updated_tests
+                            # حفظ النتيجة في جدول الاختبارات المنظم وفي عمود الاختبارات
+                            self.storage.add_test_result(
+                                self.current_group, student_row['الكود'], test_name, test_score,
+                                test_max_score or None, test_date
+                            )
                             # حفظ البيانات فوراً
                             self.save_data()
                             st.success("تم إضافة نتيجة الاختبار بنجاح!")
@@ -813,14 +4957,9 @@ class StudentAttendanceSystem:
                         with col1:
                             st.image(qr_img, caption=f"كود الطالب {student_row['الاسم']}", width=300)
                         with col2:
-                            # تحويل الصورة إلى bytes للتحميل
-                            img_bytes = BytesIO()
-                            Image.open(qr_img).save(img_bytes, format="PNG")
-                            img_bytes.seek(0)
-                            
                             st.download_button(
                                 label="📥 تحميل QR Code",
-                                data=img_bytes,
+                                data=qr_img.getvalue(),
                                 file_name=f"qr_code_{student_row['الكود']}.png",
                                 mime="image/png"
                             )
@@ -830,11 +4969,8 @@ class StudentAttendanceSystem:
                     st.warning("⚠️ تنبيه: هذه العملية لا يمكن التراجع عنها!")
                     
                     if st.button("🗑️ حذف الطالب", key="delete_student_btn", type="primary"):
-                        # حذف الطالب من المجموعة الحالية
-                        self.groups_df[self.current_group] = self.groups_df[self.current_group].drop(student_index)
-                        self.groups_df[self.current_group] = self.groups_df[self.current_group].reset_index(drop=True)
-                        
-                        # حفظ البيانات فوراً
+                        # حذف الطالب من المجموعة الحالية وحفظ البيانات فوراً
+                        self.storage.delete_student(self.current_group, student_row['الكود'])
                         self.save_data()
                         st.success("تم حذف الطالب بنجاح!")
                         time.sleep(2)
@@ -845,190 +4981,533 @@ class StudentAttendanceSystem:
         else:
             st.warning("لا يوجد طلاب مسجلين بعد")
     
+    def payments_figure(self, paid_counts):
+        """مخطط عدد الطلاب الذين دفعوا كل شهر"""
+        fig = px.bar(
+            x=[m.replace('_', ' ') for m in self.months],
+            y=paid_counts.values,
+            labels={'x': 'الشهر', 'y': 'عدد الطلاب الذين دفعوا'},
+            color=paid_counts.values,
+            color_continuous_scale='blues'
+        )
+        fig.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            font_color='white'
+        )
+        return fig
+    
+    def attendance_heatmap(self, group_name):
+        """خريطة حضور المجموعة (طالب × حصة) لآخر الحصص من مصفوفة تقويم الحصص"""
+        calendar = self.storage.calendar
+        sessions = calendar.sessions(group_name)
+        if not len(sessions):
+            return
+        
+        st.subheader("🗓️ خريطة الحضور")
+        session_count = st.selectbox("عدد آخر الحصص", HEATMAP_SESSION_COUNTS, key=f"heatmap_sessions_{group_name}")
+        fig = self.storage.aggregates.figure(
+            group_name, f"heatmap:{session_count}", lambda: self.heatmap_figure(group_name, session_count)
+        )
+        st.plotly_chart(fig, use_container_width=True, key=f"heatmap_{group_name}")
+        
+        rates = calendar.session_rates(group_name)
+        st.caption(
+            f"عدد الحصص المنعقدة: {len(sessions)}، متوسط نسبة الحضور في الحصة: {np.nanmean(rates.values):.1f}%، "
+            f"والخريطة تعرض أقل {HEATMAP_MAX_STUDENTS} طالب حضوراً"
+        )
+    
+    def sessions_section(self, group_name):
+        """إضافة حصص المجموعة يوماً بيوم أو من جدول أسبوعي، وحذف حصة لم يحضرها أحد
+
+        الحصة التي لم يحضرها أحد تحسب غياباً لكل الطلاب المسجلين قبلها في النسب والخريطة
+        """
+        with st.expander("📅 حصص المجموعة"):
+            col1, col2 = st.columns(2)
+            with col1:
+                session_day = st.date_input("يوم الحصة", value=date.today(), key=f"session_day_{group_name}")
+                if st.button("➕ إضافة الحصة", key=f"session_add_{group_name}"):
+                    self.storage.set_sessions(group_name, [session_day])
+                    self.save_data()
+                    st.success(f"تمت إضافة حصة {session_day} ✅")
+                    time.sleep(1)
+                    st.rerun()
+            
+            with col2:
+                weekdays = st.multiselect(
+                    "أيام الحصص في الأسبوع", range(len(WEEKDAY_NAMES)), format_func=WEEKDAY_NAMES.__getitem__,
+                    key=f"session_weekdays_{group_name}"
+                )
+                first_day = st.date_input("من", value=date.today(), key=f"session_from_{group_name}")
+                last_day = st.date_input("إلى", value=date.today() + timedelta(days=30), key=f"session_to_{group_name}")
+                if st.button("📆 إضافة الجدول", disabled=not weekdays, key=f"session_schedule_{group_name}"):
+                    days = [
+                        first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)
+                        if (first_day + timedelta(days=offset)).weekday() in weekdays
+                    ]
+                    if days:
+                        self.storage.set_sessions(group_name, days)
+                        self.save_data()
+                        st.success(f"تمت إضافة {len(days)} حصة ✅")
+                        time.sleep(1)
+                        st.rerun()
+                    else:
+                        st.error("لا توجد أيام من الجدول في هذه الفترة")
+            
+            # حصة حضرها طالب لا تحذف، لأن حضوره يسجل فيها
+            unattended = self.storage.calendar.unattended(group_name)
+            if unattended:
+                day = st.selectbox("حصة لم يحضرها أحد", unattended, key=f"session_remove_day_{group_name}")
+                if st.button("🗑️ حذف الحصة", key=f"session_remove_{group_name}"):
+                    self.storage.set_sessions(group_name, [day], held=False)
+                    self.save_data()
+                    st.success(f"تم حذف حصة {day} ✅")
+                    time.sleep(1)
+                    st.rerun()
+    
+    def heatmap_figure(self, group_name, session_count):
+        """خريطة الحضور: أخضر حضر، أحمر غاب، وفارغ قبل تسجيل الطالب"""
+        matrix = self.storage.calendar.matrix(group_name)
+        stats = self.storage.calendar.student_stats(group_name)
+        rows = np.argsort(stats['نسبة_الحضور'].fillna(100).to_numpy(), kind='stable')[:HEATMAP_MAX_STUDENTS]
+        columns = slice(-session_count, None)
+        
+        values = np.where(matrix['enrolled'][rows, columns], matrix['attended'][rows, columns].astype(float), np.nan)
+        names = self.groups_df[group_name]['الاسم'].astype(str).to_numpy(dtype=object)
+        fig = px.imshow(
+            values,
+            x=[str(day) for day in matrix['sessions'][columns]],
+            y=[f"{names[row]} ({matrix['codes'][row]})" for row in rows],
+            zmin=0, zmax=1,
+            color_continuous_scale=[[0, '#E74C3C'], [1, '#4CAF50']],
+            labels={'x': 'الحصة', 'y': 'الطالب', 'color': 'حضر'},
+            aspect='auto'
+        )
+        fig.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            font_color='white',
+            coloraxis_showscale=False,
+            height=max(300, 22 * len(rows))
+        )
+        return fig
+    
+    def tests_figure(self, ranked_tests):
+        """مخطط توزيع درجات اختبار واحد"""
+        fig = px.histogram(
+            ranked_tests, x='score', nbins=20,
+            labels={'score': 'الدرجة', 'count': 'عدد الطلاب'}
+        )
+        fig.update_layout(
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            font_color='white'
+        )
+        return fig
+    
+    def export_section(self, group_name):
+        """تصدير مجموعة أو كل المجموعات في ملف على دفعات بعد اختيار البيانات والأعمدة والفترة"""
+        datasets = {'students': "👥 بيانات الطلاب", 'attendance': "📅 سجل الحضور (صف لكل حصة)"}
+        
+        with st.expander("📤 تصدير البيانات"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                all_groups = st.radio("المجموعات", [f"{group_name} فقط", "كل المجموعات"], key="export_scope") == "كل المجموعات"
+            with col2:
+                dataset = st.radio("البيانات", list(datasets), format_func=datasets.get, key="export_dataset")
+            with col3:
+                file_format = st.selectbox("صيغة الملف", EXPORT_FORMATS, key="export_format")
+            
+            available_columns = build_required_columns(self.months) if dataset == 'students' else ATTENDANCE_EXPORT_COLUMNS
+            columns = st.multiselect("الأعمدة", available_columns, default=available_columns, key=f"export_columns_{dataset}")
+            
+            date_from = date_to = None
+            date_label = "تاريخ التسجيل" if dataset == 'students' else "تاريخ الحضور"
+            if st.checkbox(f"تحديد فترة حسب {date_label}", key="export_use_dates"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    date_from = st.date_input("من", value=date.today().replace(day=1), key="export_date_from")
+                with col2:
+                    date_to = st.date_input("إلى", value=date.today(), key="export_date_to")
+            
+            if st.button("📤 تجهيز ملف التصدير", key="export_prepare"):
+                if not columns:
+                    st.warning("الرجاء اختيار عمود واحد على الأقل")
+                    return
+                
+                group_names = list(self.groups_df.keys()) if all_groups else [group_name]
+                export_dir = os.path.join(os.path.dirname(os.path.abspath(self.storage.path)), EXPORT_DIR_NAME)
+                scope_name = "all_groups" if all_groups else group_name
+                export_path = os.path.join(export_dir, f"{dataset}_{scope_name}_{datetime.now():%Y%m%d_%H%M%S}.{file_format}")
+                
+                try:
+                    os.makedirs(export_dir, exist_ok=True)
+                    started = time.perf_counter()
+                    with st.spinner("جاري التصدير..."):
+                        rows = write_export(
+                            self.storage.export_chunks(group_names, dataset, columns, date_from, date_to),
+                            export_path,
+                            file_format
+                        )
+                except Exception as e:
+                    print(f"خطأ في التصدير: {str(e)}")
+                    st.error(f"خطأ في التصدير: {str(e)}")
+                    return
+                
+                st.caption(f"⏱️ تم تصدير {rows} صف في {time.perf_counter() - started:.1f} ثانية إلى {export_path}")
+                with open(export_path, 'rb') as export_file:
+                    st.download_button(
+                        label="📥 تحميل ملف التصدير",
+                        data=export_file,
+                        file_name=os.path.basename(export_path),
+                        mime=EXPORT_MIME_TYPES[file_format],
+                        key="export_download"
+                    )
+
+    @timed('analytics')
     def view_analytics_tab(self):
         st.header("📊 الإحصائيات")
         
-        # إنشاء تبويبات لكل مجموعة
-        group_tabs = st.tabs([f"{group_name}" for group_name in self.groups_df.keys()])
+        # عرض مجموعة واحدة فقط في كل مرة بدلاً من بناء محتوى كل المجموعات عند كل إعادة تشغيل
+        group_names = list(self.groups_df.keys())
+        group_name = st.selectbox(
+            "اختر المجموعة",
+            group_names,
+            index=group_names.index(self.current_group) if self.current_group in group_names else 0,
+            key="analytics_group"
+        )
+        self.group_analytics(group_name)
+        self.reports_section()
+        self.archive_section()
+        self.memory_section()
+    
+    def reports_section(self):
+        """قوائم المتابعة لكل المجموعات معاً (الغياب، عدم الدفع، نسبة الحضور) مع تصديرها"""
+        st.markdown("---")
+        with st.expander("📋 تقارير المتابعة لكل المجموعات"):
+            col1, col2, col3 = st.columns(3)
+            absent_sessions = unpaid_month = max_rate = None
+            with col1:
+                if st.checkbox("غائب عن آخر حصص متتالية", value=True, key="report_use_absent"):
+                    absent_sessions = int(st.number_input("عدد الحصص", min_value=1, value=2, key="report_absent_sessions"))
+            with col2:
+                if st.checkbox("لم يدفع شهراً", key="report_use_unpaid"):
+                    current_month = current_month_column(self.months)
+                    unpaid_month = st.selectbox(
+                        "الشهر", self.months,
+                        index=self.months.index(current_month) if current_month else 0,
+                        key="report_unpaid_month"
+                    )
+            with col3:
+                if st.checkbox("نسبة الحضور أقل من", key="report_use_rate"):
+                    max_rate = st.slider("النسبة %", 0, 100, 50, key="report_max_rate")
+            group_names = st.multiselect("المجموعات (كل المجموعات إذا تركت فارغة)", list(self.groups_df), key="report_groups")
+            
+            # النتيجة محفوظة لكل إصدار من البيانات، لذلك إعادة العرض بنفس الشروط لا تعيد الحساب
+            started = time.perf_counter()
+            report = self.storage.reports.query(absent_sessions, unpaid_month, max_rate, group_names or None)
+            st.caption(f"⏱️ {len(report)} طالب في {(time.perf_counter() - started) * 1000:.1f} مللي ثانية")
+            st.dataframe(report, use_container_width=True, hide_index=True)
+            
+            if report.empty:
+                return
+            
+            file_format = st.selectbox("صيغة الملف", EXPORT_FORMATS, key="report_format")
+            if st.button("📤 تصدير التقرير", key="report_export"):
+                export_dir = os.path.join(os.path.dirname(os.path.abspath(self.storage.path)), EXPORT_DIR_NAME)
+                export_path = os.path.join(export_dir, f"report_{datetime.now():%Y%m%d_%H%M%S}.{file_format}")
+                try:
+                    os.makedirs(export_dir, exist_ok=True)
+                    write_export([("التقرير", report)], export_path, file_format)
+                except Exception as e:
+                    print(f"خطأ في تصدير التقرير: {str(e)}")
+                    st.error(f"خطأ في تصدير التقرير: {str(e)}")
+                    return
+                
+                with open(export_path, 'rb') as export_file:
+                    st.download_button(
+                        label="📥 تحميل التقرير",
+                        data=export_file,
+                        file_name=os.path.basename(export_path),
+                        mime=EXPORT_MIME_TYPES[file_format],
+                        key="report_download"
+                    )
+    
+    def memory_section(self):
+        """استهلاك الذاكرة لكل مجموعة، ويحسب عند طلبه فقط"""
+        with st.expander("🧮 استهلاك الذاكرة"):
+            if not st.checkbox("حساب استهلاك الذاكرة لكل مجموعة", key="memory_show"):
+                return
+            
+            report = self.storage.memory_report()
+            size_columns = ['الجدول', 'تواريخ_الحضور', 'الملاحظات', 'الاختبارات', 'الإجمالي']
+            report[size_columns] = (report[size_columns] / 1024).round(1)
+            st.dataframe(report.set_index('المجموعة'), use_container_width=True)
+            st.caption(f"الأحجام بالكيلوبايت، والإجمالي لكل المجموعات {report['الإجمالي'].sum():.1f} KB")
+
+    def archive_section(self):
+        """أرشفة السنوات السابقة وتقارير السنوات المؤرشفة، وملف السنة لا يقرأ إلا عند طلب عرضها"""
+        archive = self.storage.archive
+        
+        st.markdown("---")
+        with st.expander("🗄️ السنوات الدراسية السابقة"):
+            self.archive_action()
+            years = archive.years()
+            if not years:
+                st.caption("لا توجد سنوات مؤرشفة بعد")
+                return
+            
+            year = st.selectbox("السنة الدراسية", years, format_func=lambda y: f"{y}/{y + 1}", key="archive_year")
+            if not st.checkbox("عرض بيانات السنة", key="archive_show"):
+                return
+            
+            try:
+                frame = archive.load(year)
+            except Exception as e:
+                print(f"خطأ في قراءة الأرشيف: {str(e)}")
+                st.error(f"خطأ في قراءة الأرشيف: {str(e)}")
+                return
+            
+            months = academic_months(year, archive.start_month)
+            summary = frame.groupby('المجموعة').agg(
+                عدد_الطلاب=('الكود', 'count'),
+                إجمالي_الحضور=('الحصص_الحاضرة', 'sum')
+            )
+            summary = summary.join(frame.groupby('المجموعة')[months].sum())
+            st.dataframe(summary, use_container_width=True)
+            
+            group_names = ["كل المجموعات"] + list(summary.index)
+            group_name = st.selectbox("المجموعة", group_names, key="archive_group")
+            students = frame if group_name == "كل المجموعات" else frame[frame['المجموعة'] == group_name]
+            st.dataframe(students, use_container_width=True, hide_index=True)
+    
+    def archive_action(self):
+        """زر نقل حضور ودفع ما قبل السنة الدراسية النشطة (STUDENTS_ACADEMIC_YEAR) للأرشيف
+
+        الأرشفة لا تحدث عند التحميل أبداً، لأنها تحذف البيانات من ملف البيانات ويجب أن يطلبها المدير
+        """
+        year_start = self.storage.year_start
+        st.caption(
+            f"السنة الدراسية النشطة تبدأ في {year_start}. الأرشفة تنقل الحضور قبل هذا التاريخ وأعمدة دفع "
+            f"السنوات السابقة لملفات الأرشيف بعد حفظ نسخة من ملف البيانات، وعدد الحصص الحاضرة لا يتغير"
+        )
+        confirm = st.checkbox(f"تأكيد أرشفة ما قبل {year_start}", key="archive_confirm")
+        if st.button("🗄️ أرشفة السنوات السابقة", disabled=not confirm, key="archive_run"):
+            try:
+                changed_groups = self.storage.archive_years()
+            except Exception as e:
+                print(f"خطأ في الأرشفة: {str(e)}")
+                st.error(f"خطأ في الأرشفة: {str(e)}")
+                return
+            
+            if changed_groups:
+                st.success(f"تم نقل بيانات السنوات السابقة لـ {len(changed_groups)} مجموعة للأرشيف ✅")
+            else:
+                st.info("لا توجد بيانات من سنوات سابقة لنقلها")
+
+    def group_analytics(self, group_name):
+        """إحصائيات وبيانات مجموعة واحدة"""
+        df = self.groups_df[group_name]
+        
+        st.subheader(f"إحصائيات مجموعة {group_name}")
         
-        for i, (group_name, df) in enumerate(self.groups_df.items()):
-            with group_tabs[i]:
-                st.subheader(f"إحصائيات مجموعة {group_name}")
+        if not df.empty:
+            # قسم منفصل للبحث عن طالب معين
+            st.markdown("---")
+            st.subheader("🔍 البحث عن طالب معين")
+            
+            # تحديد المجموعة الحالية مؤقتاً للبحث
+            temp_current_group = self.current_group
+            self.current_group = group_name
+            
+            # خيارات البحث
+            search_option = st.radio(f"ابحث باستخدام في {group_name}:", ["الكود", "الاسم"], horizontal=True, key=f"search_{group_name}")
+            
+            student_data = pd.DataFrame()
+            
+            if search_option == "الكود":
+                search_query = st.text_input("اكتب كود الطالب", key=f"code_search_{group_name}")
+                if search_query:
+                    suggestions = self.search_students(search_query, "code")
+                    if suggestions:
+                        selected_code = st.selectbox("الاقتراحات", suggestions, key=f"code_suggestions_{group_name}")
+                        student_data = df[df['الكود'] == selected_code] if selected_code else pd.DataFrame()
+            else:
+                search_query = st.text_input("اكتب اسم الطالب", key=f"name_search_{group_name}")
+                if search_query:
+                    suggestions = self.search_students(search_query, "name")
+                    if suggestions:
+                        selected_name = st.selectbox("الاقتراحات", suggestions, key=f"name_suggestions_{group_name}")
+                        student_data = df[df['الاسم'] == selected_name] if selected_name else pd.DataFrame()
+            
+            # استعادة المجموعة الحالية
+            self.current_group = temp_current_group
+            
+            if not student_data.empty:
+                student_row = student_data.iloc[0]
                 
-                if not df.empty:
-                    # قسم منفصل للبحث عن طالب معين
-                    st.markdown("---")
-                    st.subheader("🔍 البحث عن طالب معين")
-                    
-                    # تحديد المجموعة الحالية مؤقتاً للبحث
-                    temp_current_group = self.current_group
-                    self.current_group = group_name
-                    
-                    # خيارات البحث
-                    search_option = st.radio(f"ابحث باستخدام في {group_name}:", ["الكود", "الاسم"], horizontal=True, key=f"search_{group_name}")
-                    
-                    student_data = pd.DataFrame()
-                    
-                    if search_option == "الكود":
-                        search_query = st.text_input("اكتب كود الطالب", key=f"code_search_{group_name}")
-                        if search_query:
-                            suggestions = self.search_students(search_query, "code")
-                            if suggestions:
-                                selected_code = st.selectbox("الاقتراحات", suggestions, key=f"code_suggestions_{group_name}")
-                                student_data = df[df['الكود'] == selected_code] if selected_code else pd.DataFrame()
-                    else:
-                        search_query = st.text_input("اكتب اسم الطالب", key=f"name_search_{group_name}")
-                        if search_query:
-                            suggestions = self.search_students(search_query, "name")
-                            if suggestions:
-                                selected_name = st.selectbox("الاقتراحات", suggestions, key=f"name_suggestions_{group_name}")
-                                student_data = df[df['الاسم'] == selected_name] if selected_name else pd.DataFrame()
-                    
-                    # استعادة المجموعة الحالية
-                    self.current_group = temp_current_group
-                    
-                    if not student_data.empty:
-                        student_row = student_data.iloc[0]
-                        
-                        st.markdown("### بيانات الطالب المفصلة")
-                        st.markdown('<div class="student-info">', unsafe_allow_html=True)
-                        
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            st.markdown("#### المعلومات الشخصية")
-                            st.markdown(f"""
-                            - **الكود**: {student_row['الكود']}
-                            - **الاسم**: {student_row['الاسم']}
-                            - **رقم الهاتف**: {student_row['رقم_الهاتف']}
-                            - **ولي الأمر**: {student_row['ولي_الامر']}
-                            - **تاريخ التسجيل**: {student_row['تاريخ_التسجيل']}
-                            - **الحصص الحاضرة**: {student_row['الحصص_الحاضرة']}
-                            """)
-                        
-                        with col2:
-                            st.markdown("#### حالة الدفع للأشهر")
-                            months_paid = [month for month in self.months if student_row[month]]
-                            months_not_paid = [month for month in self.months if not student_row[month]]
-                            
-                            st.markdown("**الأشهر المدفوعة:**")
-                            for month in months_paid:
-                                st.markdown(f"- {month.replace('_', ' ')} ✅")
-                            
-                            if months_not_paid:
-                                st.markdown("**الأشهر غير المدفوعة:**")
-                                for month in months_not_paid:
-                                    st.markdown(f"- {month.replace('_', ' ')} ❌")
-                        
-                        # عرض تواريخ الحضور
-                        attendance_dates = student_row['تواريخ_الحضور']
-                        if pd.notna(attendance_dates) and attendance_dates != '' and attendance_dates != 'nan':
-                            st.markdown("#### تواريخ الحضور")
-                            dates = str(attendance_dates).split(';')
-                            st.markdown('<div class="attendance-dates">', unsafe_allow_html=True)
-                            for i, date_str in enumerate(dates, 1):
-                                date_str = date_str.strip()
-                                if date_str and date_str != 'nan':
-                                    st.markdown(f"- الحصة {i}: {date_str}")
-                            st.markdown('</div>', unsafe_allow_html=True)
-                        
-                        # عرض نتائج الاختبارات
-                        test_results = student_row['الاختبارات']
-                        if pd.notna(test_results) and test_results != '' and test_results != 'nan':
-                            st.markdown("#### نتائج الاختبارات")
-                            tests = str(test_results).split(';')
-                            for test in tests:
-                                test = test.strip()
-                                if test and test != 'nan':
-                                    st.markdown(f"- {test}")
-                        
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    # قسم منفصل لإحصائيات المجموعة ككل
-                    st.markdown("---")
-                    st.subheader("📈 إحصائيات المجموعة كاملة")
-                    
-                    total_students = len(df)
-                    total_attendance = df['الحصص_الحاضرة'].sum()
-                    avg_attendance = df['الحصص_الحاضرة'].mean() if total_students > 0 else 0
-                    total_paid_months = df[self.months].sum().sum()
-                    
-                    cols = st.columns(4)
-                    
-                    with cols[0]:
-                        st.markdown(f"""
-                        <div class='stats-card'>
-                            <div style='font-size: 24px;'>{total_students}</div>
-                            <div>عدد الطلاب</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with cols[1]:
-                        st.markdown(f"""
-                        <div class='stats-card'>
-                            <div style='font-size: 24px;'>{total_attendance}</div>
-                            <div>إجمالي الحصص الحاضرة</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with cols[2]:
-                        st.markdown(f"""
-                        <div class='stats-card'>
-                            <div style='font-size: 24px;'>{avg_attendance:.1f}</div>
-                            <div>متوسط الحضور لكل طالب</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with cols[3]:
-                        st.markdown(f"""
-                        <div class='stats-card'>
-                            <div style='font-size: 24px;'>{total_paid_months}</div>
-                            <div>إجمالي الأشهر المدفوعة</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    # مخطط حالات الدفع
-                    if total_students > 0:
-                        st.subheader("حالات الدفع للأشهر")
-                        paid_counts = df[self.months].sum()
-                        
-                        fig = px.bar(
-                            x=[m.replace('_', ' ') for m in self.months],
-                            y=paid_counts.values,
-                            labels={'x': 'الشهر', 'y': 'عدد الطلاب الذين دفعوا'},
-                            color=paid_counts.values,
-                            color_continuous_scale='blues'
-                        )
-                        fig.update_layout(
-                            plot_bgcolor='rgba(0,0,0,0)',
-                            paper_bgcolor='rgba(0,0,0,0)',
-                            font_color='white'
-                        )
-                        st.plotly_chart(fig, use_container_width=True, key=f"plotly_{group_name}_{i}")
-                    
-                    # عرض بيانات الطلاب
-                    st.subheader("بيانات جميع الطلاب")
-                    display_df = df.copy()
-                    display_df['الكود'] = display_df['الكود'].astype(str)
-                    
-                    # تحويل قيم الأشهر المنطقية إلى نص
-                    for month in self.months:
-                        display_df[month] = display_df[month].map({True: '✅ مدفوع', False: '❌ غير مدفوع'})
-                    
-                    st.dataframe(display_df, use_container_width=True)
+                st.markdown("### بيانات الطالب المفصلة")
+                st.markdown('<div class="student-info">', unsafe_allow_html=True)
+                
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.markdown("#### المعلومات الشخصية")
+                    st.markdown(f"""
+                    - **الكود**: {student_row['الكود']}
+                    - **الاسم**: {student_row['الاسم']}
+                    - **رقم الهاتف**: {student_row['رقم_الهاتف']}
+                    - **ولي الأمر**: {student_row['ولي_الامر']}
+                    - **تاريخ التسجيل**: {student_row['تاريخ_التسجيل']}
+                    - **الحصص الحاضرة**: {student_row['الحصص_الحاضرة']}
+                    """)
+                
+                with col2:
+                    st.markdown("#### حالة الدفع للأشهر")
+                    months_paid = paid_months(student_row[PAYMENTS_COLUMN], self.months)
+                    months_not_paid = [month for month in self.months if month not in months_paid]
                     
-                    # إنشاء ملف CSV للتصدير
-                    csv_data = df.to_csv(index=False, encoding='utf-8-sig')
+                    st.markdown("**الأشهر المدفوعة:**")
+                    for month in months_paid:
+                        st.markdown(f"- {month.replace('_', ' ')} ✅")
                     
-                    st.download_button(
-                        label=f"📥 تصدير بيانات {group_name} لملف CSV",
-                        data=csv_data,
-                        file_name=f"students_data_{group_name}_{date.today()}.csv",
-                        mime="text/csv",
-                        key=f"export_{group_name}"
-                    )
-                else:
-                    st.warning("لا توجد بيانات متاحة للعرض في هذه المجموعة")
+                    if months_not_paid:
+                        st.markdown("**الأشهر غير المدفوعة:**")
+                        for month in months_not_paid:
+                            st.markdown(f"- {month.replace('_', ' ')} ❌")
+                
+                # عرض تواريخ الحضور
+                dates = self.storage.attendance.history(student_row['الكود'])
+                if dates:
+                    st.markdown("#### تواريخ الحضور")
+                    st.markdown('<div class="attendance-dates">', unsafe_allow_html=True)
+                    for i, attendance_date in enumerate(dates, 1):
+                        st.markdown(f"- الحصة {i}: {attendance_date}")
+                    st.markdown('</div>', unsafe_allow_html=True)
+                
+                # عرض نتائج الاختبارات
+                test_results = self.storage.tests.for_student(student_row['الكود'])
+                if not test_results.empty:
+                    st.markdown("#### نتائج الاختبارات")
+                    for entry in test_results['entry']:
+                        st.markdown(f"- {entry}")
+                
+                st.markdown('</div>', unsafe_allow_html=True)
+            
+            # قسم منفصل لإحصائيات المجموعة ككل
+            st.markdown("---")
+            st.subheader("📈 إحصائيات المجموعة كاملة")
+            
+            # الملخص محسوب مسبقاً ويحدث مع كل تعديل على المجموعة
+            summary = self.storage.aggregates.summary(group_name, df)
+            total_students = summary['students']
+            total_attendance = summary['attendance']
+            avg_attendance = summary['average']
+            total_paid_months = summary['paid_total']
+            
+            cols = st.columns(4)
+            
+            with cols[0]:
+                st.markdown(f"""
+                <div class='stats-card'>
+                    <div style='font-size: 24px;'>{total_students}</div>
+                    <div>عدد الطلاب</div>
+                </div>
+                """, unsafe_allow_html=True)
+            
+            with cols[1]:
+                st.markdown(f"""
+                <div class='stats-card'>
+                    <div style='font-size: 24px;'>{total_attendance}</div>
+                    <div>إجمالي الحصص الحاضرة</div>
+                </div>
+                """, unsafe_allow_html=True)
+            
+            with cols[2]:
+                st.markdown(f"""
+                <div class='stats-card'>
+                    <div style='font-size: 24px;'>{avg_attendance:.1f}</div>
+                    <div>متوسط الحضور لكل طالب</div>
+                </div>
+                """, unsafe_allow_html=True)
+            
+            with cols[3]:
+                st.markdown(f"""
+                <div class='stats-card'>
+                    <div style='font-size: 24px;'>{total_paid_months}</div>
+                    <div>إجمالي الأشهر المدفوعة</div>
+                </div>
+                """, unsafe_allow_html=True)
+            
+            # مخطط حالات الدفع
+            if total_students > 0:
+                st.subheader("حالات الدفع للأشهر")
+                fig = self.storage.aggregates.figure(
+                    group_name, 'payments', lambda: self.payments_figure(summary['paid'])
+                )
+                st.plotly_chart(fig, use_container_width=True, key=f"plotly_{group_name}")
+                
+                self.attendance_heatmap(group_name)
+                self.sessions_section(group_name)
+            
+            # توزيع درجات الاختبارات
+            test_stats = self.storage.tests.group_stats(group_name)
+            if not test_stats.empty:
+                st.subheader("📝 نتائج الاختبارات")
+                st.dataframe(
+                    test_stats.rename(columns={
+                        'count': 'عدد الطلاب', 'mean': 'المتوسط', 'median': 'الوسيط',
+                        'min': 'أقل درجة', 'max': 'أعلى درجة'
+                    }).round(2),
+                    use_container_width=True
+                )
+                
+                selected_test = st.selectbox("اختر اختباراً لعرض توزيع الدرجات", list(test_stats.index), key=f"test_dist_{group_name}")
+                ranked_tests = self.storage.tests.ranked(group_name)
+                ranked_tests = ranked_tests[ranked_tests['test_name'] == selected_test]
+                
+                fig = self.storage.aggregates.figure(
+                    group_name, f"tests:{selected_test}", lambda: self.tests_figure(ranked_tests)
+                )
+                st.plotly_chart(fig, use_container_width=True, key=f"tests_{group_name}")
+                
+                names = df.set_index('الكود')['الاسم']
+                st.dataframe(
+                    ranked_tests.assign(name=ranked_tests['student_id'].map(names))
+                    .sort_values('rank')[['rank', 'name', 'student_id', 'score', 'max_score', 'percentile']]
+                    .rename(columns={
+                        'rank': 'الترتيب', 'name': 'الاسم', 'student_id': 'الكود',
+                        'score': 'الدرجة', 'max_score': 'الدرجة النهائية', 'percentile': 'المئين'
+                    }),
+                    use_container_width=True
+                )
+            
+            # عرض بيانات الطلاب صفحة بصفحة
+            st.subheader("بيانات جميع الطلاب")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                page_size = st.selectbox("عدد الطلاب في الصفحة", ANALYTICS_PAGE_SIZES, key=f"page_size_{group_name}")
+            page_count = max(1, -(-len(df) // page_size))
+            with col2:
+                page = st.number_input(
+                    f"الصفحة (من {page_count})", min_value=1, max_value=page_count, value=1, key=f"page_{group_name}"
+                )
+            
+            # بناء أعمدة الملف الكاملة لصفوف الصفحة المعروضة فقط
+            display_df = self.storage.full_frame(group_name, np.arange((page - 1) * page_size, min(page * page_size, len(df))))
+            display_df['الكود'] = display_df['الكود'].astype(str)
+            
+            # تحويل قيم الأشهر المنطقية إلى نص
+            for month in self.months:
+                display_df[month] = display_df[month].map({True: '✅ مدفوع', False: '❌ غير مدفوع'})
+            
+            st.dataframe(display_df, use_container_width=True)
+            
+            # تصدير المجموعة أو كل المجموعات عند طلبه فقط
+            self.export_section(group_name)
+        else:
+            st.warning("لا توجد بيانات متاحة للعرض في هذه المجموعة")
 
 if __name__ == "__main__":
     system = StudentAttendanceSystem()
@@ -0,0 +1,58 @@
+import os
+import sys
+from datetime import date
+
+import pandas as pd
+import pytest
+
+# main.py في جذر المستودع، والعمليات الجديدة في مجمع spawn ترث هذا المسار لتستورده
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+MONTHS = tuple(main.academic_months(2025))
+
+
+def student_rows(months, codes):
+    columns = main.build_required_columns(months)
+    rows = []
+    for number, code in enumerate(codes):
+        row = dict.fromkeys(columns, '')
+        row.update({month: False for month in months})
+        row.update({
+            'الكود': code, 'الاسم': f"طالب {number}", 'الحصص_الحاضرة': 0,
+            'تاريخ_التسجيل': date(2025, 9, 1 + number % 20)
+        })
+        rows.append(row)
+    return pd.DataFrame(rows, columns=columns)
+
+
+@pytest.fixture(params=['excel', 'sqlite'])
+def open_storage(request, tmp_path, monkeypatch):
+    """فتح نسخة من طريقة التخزين على نفس ملفات tmp_path (مثل عملية أو جلسة أخرى)"""
+    monkeypatch.chdir(tmp_path)
+    opened = []
+
+    def open_storage(backend=request.param):
+        if backend == 'sqlite':
+            storage = main.SQLiteStorage(str(tmp_path / "students_data.db"), MONTHS, import_path="students_data.xlsx")
+        else:
+            storage = main.ExcelStorage(str(tmp_path / "students_data.xlsx"), MONTHS)
+        opened.append(storage)
+        return storage
+
+    yield open_storage
+    for storage in opened:
+        if isinstance(storage, main.SQLiteStorage):
+            storage.connection.close()
+
+
+@pytest.fixture
+def storage(open_storage):
+    storage = open_storage()
+    storage.initialize({
+        'G1': student_rows(MONTHS, [f"A{number}" for number in range(30)]),
+        'G2': student_rows(MONTHS, [f"B{number}" for number in range(10)])
+    })
+    return storage
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+import main
+from conftest import MONTHS, student_rows
+
+
+LONG_NAMES = ["الصف الثالث الثانوي - مجموعة السبت أ", "الصف الثالث الثانوي - مجموعة السبت ب"]
+
+
+def export(storage, path, file_format, group_names, **options):
+    return main.write_export(storage.export_chunks(group_names, **options), str(path), file_format)
+
+
+def test_students_export_filters_by_registration_date(storage, tmp_path):
+    path = tmp_path / "students.csv"
+
+    # تاريخ تسجيل الطالب رقم n في البيانات هو يوم 1 + n % 20 سبتمبر
+    rows = export(storage, path, 'csv', ['G1', 'G2'], date_from='2025-09-05', date_to='2025-09-10', chunk_rows=4)
+
+    exported = pd.read_csv(path, encoding='utf-8-sig', dtype=str)
+    expected = [f"A{number}" for number in [*range(4, 10), *range(24, 30)]] + [f"B{number}" for number in range(4, 10)]
+    assert rows == len(expected)
+    assert exported['الكود'].tolist() == expected
+    assert set(exported['المجموعة']) == {'G1', 'G2'}
+
+
+def test_attendance_export_filters_by_attendance_date(storage, tmp_path):
+    storage.record_attendance_batch([
+        ('G1', 'A1', '2025-10-01'), ('G1', 'A1', '2025-10-08'), ('G1', 'A2', '2025-10-15'), ('G2', 'B1', '2025-10-08')
+    ])
+    path = tmp_path / "attendance.csv"
+
+    rows = export(storage, path, 'csv', ['G1'], dataset='attendance', date_from='2025-10-05')
+
+    exported = pd.read_csv(path, encoding='utf-8-sig', dtype=str)
+    assert rows == 2
+    assert exported[['الكود', 'التاريخ']].values.tolist() == [['A1', '2025-10-08'], ['A2', '2025-10-15']]
+
+
+def test_groups_with_the_same_first_31_letters_get_separate_sheets(storage, tmp_path):
+    for prefix, group_name in zip('XY', LONG_NAMES):
+        storage.add_group(group_name)
+        storage.add_students(group_name, student_rows(MONTHS, [f"{prefix}{number}" for number in range(3)]).to_dict('records'))
+    path = tmp_path / "groups.xlsx"
+
+    assert export(storage, path, 'xlsx', LONG_NAMES, chunk_rows=2) == 6
+
+    sheets = pd.read_excel(path, sheet_name=None, dtype=str)
+    assert [len(name) for name in sheets] == [31, 31]
+    assert [sheet['الكود'].tolist() for sheet in sheets.values()] == [['X0', 'X1', 'X2'], ['Y0', 'Y1', 'Y2']]
+
+
+@pytest.mark.parametrize('name, taken, expected', [
+    ("G1", [], "G1"),
+    ("a" * 40, ["a" * 31], "a" * 27 + " (2)"),
+    ("a" * 40, ["a" * 31, "A" * 27 + " (2)"], "a" * 27 + " (3)"),
+])
+def test_unique_sheet_name(name, taken, expected):
+    assert main.unique_sheet_name(name, taken) == expected
@@ -0,0 +1,26 @@
+import os
+from io import BytesIO
+
+from PIL import Image
+
+import main
+
+
+def test_pool_uses_spawn():
+    with main.make_process_pool(2) as executor:
+        assert executor._mp_context.get_start_method() == 'spawn'
+
+
+def test_bulk_scan_and_qr_render_run_under_spawn(tmp_path, capsys):
+    codes = [f"S{number:03d}" for number in range(main.QR_PARALLEL_MIN_ITEMS)]
+
+    # الرسم على مجمع العمليات (عدد الصور يكفي لتشغيله) ثم قراءة الصور على مجمع آخر
+    images = main.QRImageCache().get_many(codes, max_workers=2)
+    for code, png in zip(codes[:4], images):
+        Image.open(BytesIO(png)).convert('RGB').save(tmp_path / f"{code}.png")
+
+    results = main.scan_media_bulk(str(tmp_path), max_workers=2)
+
+    assert "تعذر تشغيل مجمع العمليات" not in capsys.readouterr().out
+    assert [result['codes'] for result in results] == [[code] for code in codes[:4]]
+    assert all(os.path.basename(result['source']).startswith(result['codes'][0]) for result in results)
@@ -0,0 +1,46 @@
+from datetime import date
+
+import main
+from conftest import MONTHS, student_rows
+
+
+def report_codes(result):
+    return set(result['الكود'])
+
+
+def test_reports_filter_absences_rates_and_unpaid_months(storage):
+    storage.set_sessions('G1', [date(2025, 10, 1), date(2025, 10, 8), date(2025, 10, 15)])
+    for day in ('2025-10-01', '2025-10-08', '2025-10-15'):
+        storage.record_attendance('G1', 'A0', 'attend', day)
+    storage.record_attendance('G1', 'A1', 'attend', '2025-10-01')
+    storage.update_payments('G1', 'A0', {MONTHS[2]: True})
+    late = student_rows(MONTHS, ['L1']).iloc[0].to_dict()
+    late['تاريخ_التسجيل'] = date(2025, 11, 2)
+    storage.add_student('G2', late)
+    reports = main.StudentReports(storage)
+
+    g1_codes = {f"A{number}" for number in range(30)}
+    assert report_codes(reports.query(absent_sessions=2, group_names=['G1'])) == g1_codes - {'A0'}
+    assert report_codes(reports.query(absent_sessions=3, group_names=['G1'])) == g1_codes - {'A0', 'A1'}
+    assert report_codes(reports.query(max_rate=50)) == g1_codes - {'A0'}
+
+    # الطالب المسجل بعد نهاية الشهر لا يطالب بدفعه
+    unpaid = reports.query(unpaid_month=MONTHS[2])
+    assert 'A0' not in report_codes(unpaid) and 'L1' not in report_codes(unpaid)
+    assert len(unpaid) == 39
+
+    row = reports.query(group_names=['G1']).set_index('الكود').loc['A1']
+    assert (row['آخر_حضور'], row['حصص_الغياب_المتتالية'], row['نسبة_الحضور']) == (date(2025, 10, 1), 2, 33.3)
+
+
+def test_reports_are_cached_until_the_data_changes(storage):
+    storage.set_sessions('G1', [date(2025, 10, 1), date(2025, 10, 8)])
+    reports = main.StudentReports(storage)
+
+    first = reports.query(absent_sessions=2)
+    assert reports.query(absent_sessions=2) is first
+    assert (reports.hits, reports.misses) == (1, 1)
+
+    storage.record_attendance('G1', 'A4', 'attend', '2025-10-08')
+    assert 'A4' not in report_codes(reports.query(absent_sessions=2))
+    assert reports.misses == 2
@@ -0,0 +1,42 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import main
+from conftest import MONTHS
+
+
+REGISTRATION_MONTHS = {main.parse_month_column(month)[0]: month for month in MONTHS}
+
+
+def test_validate_roster_cleans_valid_rows_and_reports_each_error():
+    roster = pd.DataFrame({
+        'كود الطالب': [' S1 ', 'S2', '', 'S 4', 'S1', 'A1', 'S7'],
+        'اسم الطالب': ['أحمد', 'منى', 'سعيد', 'ليلى', 'مكرر', 'موجود', ''],
+        'رقم الهاتف': ['٠١٠١٢٣٤٥٦٧٨', '010-1234-5678', '', '123', '', '', ''],
+        'تاريخ التسجيل': ['2025-10-03', '', '', '', 'غدا', '', ''],
+    })
+
+    students, errors = main.validate_roster(roster, MONTHS, ['A1'], REGISTRATION_MONTHS)
+
+    assert students.columns.tolist() == main.build_required_columns(MONTHS)
+    assert students['الكود'].tolist() == ['S1', 'S2']
+    assert students['رقم_الهاتف'].tolist() == ['01012345678', '01012345678']
+    # الشهر الموافق لتاريخ التسجيل مدفوع
+    assert students.loc[0, 'تاريخ_التسجيل'] == date(2025, 10, 3)
+    assert students.loc[0, MONTHS[3]] and not students.loc[0, MONTHS[2]]
+
+    reasons = dict(zip(errors['الصف'], errors['الخطأ']))
+    assert reasons == {
+        4: 'الكود فارغ',
+        5: 'الكود يحتوي على مسافات أو ;، رقم الهاتف غير صحيح',
+        6: 'تاريخ التسجيل غير صحيح، الكود مكرر في الملف',
+        7: 'الكود مسجل بالفعل',
+        8: 'الاسم فارغ',
+    }
+
+
+def test_validate_roster_requires_code_and_name_columns():
+    with pytest.raises(ValueError, match='الاسم'):
+        main.validate_roster(pd.DataFrame({'code': ['S1']}), MONTHS, [], REGISTRATION_MONTHS)
@@ -0,0 +1,40 @@
+import main
+
+
+def test_search_ignores_diacritics_and_letter_forms():
+    index = main.StudentSearchIndex(['أحمد علي', 'مُحَمَّد أحمد', 'فاطمة', 'سارة'])
+
+    assert index.search('احمد') == ['أحمد علي', 'مُحَمَّد أحمد']
+    assert index.search('فاطمه') == ['فاطمة']
+    assert index.search('ساره') == ['سارة']
+    assert index.search('ي') == ['أحمد علي']
+    assert index.search('خالد') == []
+    assert index.search('   ') == []
+
+
+def test_search_ranks_prefix_then_word_start_then_position():
+    index = main.StudentSearchIndex(['S120', 'S012', 'S12', 'X S12', 'XS12'])
+
+    assert index.search('s12') == ['S12', 'S120', 'X S12', 'XS12']
+    assert index.search('s12', limit=2) == ['S12', 'S120']
+
+
+def test_removing_one_of_two_equal_values_keeps_it_searchable():
+    index = main.StudentSearchIndex(['منى', 'منى', 'مها'])
+
+    index.remove('منى')
+    assert index.search('من') == ['منى']
+    index.remove('منى')
+    assert index.search('من') == []
+    assert index.search('م') == ['مها']
+
+
+def test_storage_search_index_follows_added_and_deleted_students(storage):
+    index = storage.search_index('G1', 'الكود')
+    assert index.search('A1', limit=3) == ['A1', 'A10', 'A11']
+
+    storage.add_student('G1', {'الكود': 'A1X', 'الاسم': 'جديد'})
+    storage.delete_student('G1', 'A10')
+
+    assert storage.search_index('G1', 'الكود').search('A1', limit=3) == ['A1', 'A11', 'A12']
+    assert 'A1X' in storage.search_index('G1', 'الكود').search('A1')
@@ -0,0 +1,187 @@
+import re
+
+import pytest
+
+import main
+
+
+class FakeWorksheet:
+    """ورقة في الذاكرة بنفس واجهة gspread، تسجل كل طلب في calls وترفض الكتابة خارج حجمها"""
+
+    def __init__(self, spreadsheet, title, rows, cols):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.cells = {}
+
+    def batch_update(self, data, value_input_option=None):
+        self.spreadsheet.calls.append(('batch_update', self.title, [item['range'] for item in data]))
+        if self.spreadsheet.fail:
+            raise ConnectionError("503 Service Unavailable")
+        for item in data:
+            first, last = map(int, re.match(r'A(\d+):[A-Z]+(\d+)$', item['range']).groups())
+            assert last <= self.row_count and len(item['values']) == last - first + 1
+            for offset, row in enumerate(item['values']):
+                assert len(row) <= self.col_count
+                self.cells[first + offset] = list(row)
+
+    def resize(self, rows=None, cols=None):
+        self.spreadsheet.calls.append(('resize', self.title))
+        self.row_count = rows or self.row_count
+        self.col_count = cols or self.col_count
+
+    def clear(self):
+        self.spreadsheet.calls.append(('clear', self.title))
+        self.cells = {}
+
+    def values(self):
+        """الصفوف غير الفارغة كما تظهر في الورقة"""
+        rows = [self.cells.get(number, []) for number in range(1, max(self.cells, default=0) + 1)]
+        return [row for row in rows if any(value != '' for value in row)]
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.calls = []
+        self.fail = False
+        self.sheets = [FakeWorksheet(self, 'Sheet1', 1000, 26)]
+
+    def worksheets(self):
+        return list(self.sheets)
+
+    def add_worksheet(self, title, rows, cols):
+        self.calls.append(('add_worksheet', title))
+        if self.fail:
+            raise ConnectionError("503 Service Unavailable")
+        worksheet = FakeWorksheet(self, title, rows, cols)
+        self.sheets.append(worksheet)
+        return worksheet
+
+    def del_worksheet(self, worksheet):
+        self.calls.append(('del_worksheet', worksheet.title))
+        self.sheets.remove(worksheet)
+
+    def worksheet(self, title):
+        return next(worksheet for worksheet in self.sheets if worksheet.title == title)
+
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+
+@pytest.fixture
+def spreadsheet():
+    return FakeSpreadsheet()
+
+
+@pytest.fixture
+def mirror(storage, spreadsheet):
+    mirror = main.SheetsMirror(storage, 'KEY', lambda: FakeClient(spreadsheet))
+    yield mirror
+    mirror.shutdown()
+
+
+def assert_mirrored(storage, spreadsheet):
+    for group_name in storage.groups_df:
+        df = storage.full_frame(group_name)
+        expected = [list(df.columns)] + [[main.sheet_cell(value) for value in row] for row in df.astype(object).values.tolist()]
+        assert spreadsheet.worksheet(group_name).values() == expected
+
+
+def batch_updates(spreadsheet):
+    return [call for call in spreadsheet.calls if call[0] == 'batch_update']
+
+
+def test_first_sync_writes_every_group(storage, spreadsheet, mirror):
+    rows, calls = mirror.sync()
+
+    assert rows == 40
+    assert [call[1] for call in batch_updates(spreadsheet)] == ['G1', 'G2']
+    assert_mirrored(storage, spreadsheet)
+
+
+def test_sync_sends_only_changed_rows_in_one_batch_per_group(storage, spreadsheet, mirror):
+    mirror.sync()
+    spreadsheet.calls.clear()
+
+    assert mirror.sync() == (0, 0)
+    assert spreadsheet.calls == []
+
+    # تغيير صفين متباعدين في G1 فقط: طلب واحد بنطاقين ولا شيء لـ G2
+    storage.record_attendance('G1', 'A3', 'attend', '2025-10-05')
+    storage.record_attendance('G1', 'A20', 'attend', '2025-10-05')
+    assert mirror.pending_groups == ['G1']
+
+    rows, calls = mirror.sync()
+
+    last_column = main.sheet_column_letter(len(storage.full_frame('G1').columns))
+    assert (rows, calls) == (2, 1)
+    assert spreadsheet.calls == [('batch_update', 'G1', [f"A5:{last_column}5", f"A22:{last_column}22"])]
+    assert mirror.pending_groups == []
+    assert_mirrored(storage, spreadsheet)
+
+
+def test_failed_flush_keeps_outbox_and_recovers(storage, spreadsheet, mirror):
+    mirror.sync()
+    outbox = mirror.read_outbox()
+    spreadsheet.calls.clear()
+
+    storage.record_attendance('G2', 'B4', 'attend', '2025-10-05')
+    spreadsheet.fail = True
+
+    assert not mirror.attempt()
+    assert not mirror.attempt()
+
+    # الصادر لا يتغير حتى يصل الفرق فعلاً، فيبقى ما لم يرسل معلقاً للمحاولة التالية
+    assert mirror.failures == 2
+    assert "503" in mirror.error
+    assert mirror.retry_at > 0
+    assert mirror.read_outbox() == outbox
+    assert mirror.pending_groups == ['G2']
+
+    spreadsheet.fail = False
+    spreadsheet.calls.clear()
+    assert mirror.attempt()
+
+    assert (mirror.failures, mirror.retry_at, mirror.error) == (0, 0.0, None)
+    assert (mirror.last_rows, mirror.last_calls) == (1, 1)
+    assert [call[1] for call in batch_updates(spreadsheet)] == ['G2']
+    assert mirror.pending_groups == []
+    assert_mirrored(storage, spreadsheet)
+
+
+def test_backoff_delay_doubles_up_to_the_limit(storage, spreadsheet, mirror, monkeypatch):
+    monkeypatch.setattr(main.np.random, 'uniform', lambda low, high: high)
+    spreadsheet.fail = True
+
+    delays = []
+    for _ in range(4):
+        before = main.time.monotonic()
+        mirror.attempt()
+        delays.append(round(mirror.retry_at - before))
+
+    base = main.SHEETS_BACKOFF_BASE
+    assert delays == [min(main.SHEETS_BACKOFF_MAX, base * 2 ** failure) for failure in range(4)]
+
+
+def test_restart_resumes_from_outbox(storage, spreadsheet, mirror):
+    mirror.sync()
+    storage.record_attendance('G1', 'A1', 'attend', '2025-10-05')
+    spreadsheet.fail = True
+    assert not mirror.attempt()
+    spreadsheet.fail = False
+    spreadsheet.calls.clear()
+
+    # نسخة جديدة (مثل بعد إعادة التشغيل) ترسل ما لم يصل فقط
+    restarted = main.SheetsMirror(storage, 'KEY', lambda: FakeClient(spreadsheet))
+    try:
+        assert restarted.sync() == (1, 1)
+    finally:
+        restarted.shutdown()
+    assert [call[1] for call in batch_updates(spreadsheet)] == ['G1']
+    assert_mirrored(storage, spreadsheet)
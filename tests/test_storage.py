@@ -0,0 +1,168 @@
+from datetime import date
+
+import pytest
+
+import main
+from conftest import MONTHS, student_rows
+
+
+def snapshot(storage):
+    """كل المجموعات بأعمدة الملف الكاملة كنصوص للمقارنة بين نسختين من التخزين
+
+    الخلية الفارغة تقرأ من الإكسل كقيمة مفقودة، لذلك تقارن كنص فارغ
+    """
+    return {
+        group_name: storage.full_frame(group_name).astype(object).fillna('').astype(str).to_dict('records')
+        for group_name in storage.groups_df
+    }
+
+
+def student(storage, student_id):
+    group_name, index = storage.find_student(student_id)
+    return storage.full_frame(group_name).loc[index]
+
+
+def reopen(open_storage):
+    storage = open_storage()
+    storage.load()
+    return storage
+
+
+def test_every_change_survives_reopening(storage, open_storage):
+    new_row = student_rows(MONTHS, ['N1']).iloc[0].to_dict()
+    storage.add_student('G2', new_row)
+    storage.record_attendance('G2', 'N1', 'attend', '2025-10-05')
+    storage.record_attendance('G2', 'N1', 'attend', '2025-10-12')
+    storage.update_payments('G2', 'N1', {MONTHS[1]: True})
+    storage.add_test_result('G2', 'N1', 'الوحدة الأولى', 18, 20, '2025-10-12')
+    storage.delete_student('G1', 'A5')
+    storage.add_group('G3')
+    storage.delete_group('G3')
+    storage.save()
+
+    row = student(storage, 'N1')
+    assert row['الحصص_الحاضرة'] == 2
+    assert main.AttendanceHistory.parse_legacy(row['تواريخ_الحضور']).tolist() == [
+        date(2025, 10, 5).toordinal(), date(2025, 10, 12).toordinal()
+    ]
+    assert row[MONTHS[1]] and not row[MONTHS[0]]
+    assert 'الوحدة الأولى' in row['الاختبارات']
+    assert storage.find_student('A5') == (None, None)
+    assert list(storage.groups_df) == ['G1', 'G2']
+
+    assert snapshot(reopen(open_storage)) == snapshot(storage)
+
+
+def test_unattend_removes_the_last_day_and_stops_at_zero(storage, open_storage):
+    storage.record_attendance('G1', 'A1', 'attend', '2025-10-05')
+    storage.record_attendance('G1', 'A1', 'attend', '2025-10-12')
+
+    storage.record_attendance('G1', 'A1', 'unattend', '2025-10-12')
+    row = student(storage, 'A1')
+    assert row['الحصص_الحاضرة'] == 1
+    assert main.AttendanceHistory.parse_legacy(row['تواريخ_الحضور']).tolist() == [date(2025, 10, 5).toordinal()]
+
+    # خصم حصة بعد الصفر لا يغير العداد ولا التواريخ، ولا يختلف بين الذاكرة والمخزن
+    storage.record_attendance('G1', 'A1', 'unattend', '2025-10-05')
+    storage.record_attendance('G1', 'A1', 'unattend', '2025-10-05')
+    row = student(storage, 'A1')
+    assert row['الحصص_الحاضرة'] == 0
+    assert row['تواريخ_الحضور'] == ''
+
+    storage.save()
+    assert snapshot(reopen(open_storage)) == snapshot(storage)
+
+
+def test_catch_up_applies_changes_from_another_instance(storage, open_storage):
+    other = reopen(open_storage)
+
+    storage.record_attendance_batch([('G1', 'A2', '2025-10-05'), ('G2', 'B3', '2025-10-05')])
+    storage.update_payments('G1', 'A2', {MONTHS[0]: True})
+    storage.add_students('G2', student_rows(MONTHS, ['N1', 'N2']).to_dict('records'))
+    storage.delete_student('G1', 'A7')
+    storage.add_group('G3')
+    storage.set_sessions('G3', [date(2025, 10, 6)])
+
+    other.catch_up()
+
+    assert snapshot(other) == snapshot(storage)
+    assert other.find_student('N2') == ('G2', 11)
+    assert other.calendar.rows() == storage.calendar.rows()
+
+    storage.delete_group('G3')
+    other.catch_up()
+    assert list(other.groups_df) == ['G1', 'G2']
+
+
+def test_adding_a_taken_code_fails_even_from_a_stale_instance(storage, open_storage):
+    other = reopen(open_storage)
+    storage.add_student('G1', student_rows(MONTHS, ['X1']).iloc[0].to_dict())
+
+    # النسخة الأخرى لم ترَ الطالب بعد، والفحص تحت قفل الكتابة بعد اللحاق يرفضه
+    with pytest.raises(main.DuplicateStudentCodesError) as error:
+        other.add_student('G2', student_rows(MONTHS, ['X1']).iloc[0].to_dict())
+    assert error.value.duplicates == {'X1': ['G1', 'G2']}
+
+    with pytest.raises(main.DuplicateStudentCodesError):
+        other.add_students('G2', student_rows(MONTHS, ['Y1', 'Y1']).to_dict('records'))
+
+    assert other.find_student('X1') == ('G1', 30)
+    assert other.find_student('Y1') == (None, None)
+    assert snapshot(reopen(open_storage)) == snapshot(other)
+
+
+def test_unattended_sessions_count_as_absences(storage, open_storage):
+    storage.record_attendance('G2', 'B1', 'attend', '2025-10-05')
+    storage.set_sessions('G2', [date(2025, 10, 7), date(2025, 10, 9)])
+    storage.delete_student('G2', 'B1')
+
+    # حذف الطالب الوحيد الذي حضر لا يحذف الحصة
+    matrix = storage.calendar.matrix('G2')
+    assert [str(day) for day in matrix['sessions']] == ['2025-10-05', '2025-10-07', '2025-10-09']
+    assert not matrix['attended'].any()
+    assert storage.calendar.student_stats('G2')['نسبة_الحضور'].eq(0).all()
+
+    storage.set_sessions('G2', ['2025-10-09'], held=False)
+    storage.save()
+    assert reopen(open_storage).calendar.rows() == [('G2', '2025-10-05'), ('G2', '2025-10-07')]
+
+
+@pytest.mark.parametrize('open_storage', ['excel'], indirect=True)
+def test_excel_journal_replays_until_compacted(storage, open_storage, tmp_path):
+    excel_path = str(tmp_path / "students_data.xlsx")
+    storage.record_attendance('G1', 'A1', 'attend', '2025-10-05')
+    storage.update_payments('G1', 'A1', {MONTHS[0]: True})
+
+    # بدون حفظ: الملف لم يتغير والنسخة الجديدة تعيد تطبيق السجل
+    assert main.read_journal_seq(excel_path) == 0
+    assert storage.pending_count == 2
+    assert snapshot(reopen(open_storage)) == snapshot(storage)
+
+    storage.save()
+    assert main.read_journal_seq(excel_path) == 2
+    assert storage.pending_count == 0
+
+    # بعد الدمج لا يطبق حدث مرتين على الملف
+    storage.record_attendance('G1', 'A1', 'attend', '2025-10-12')
+    reopened = reopen(open_storage)
+    assert reopened.journal.compacted_seq == 2
+    assert student(reopened, 'A1')['الحصص_الحاضرة'] == 2
+    assert snapshot(reopened) == snapshot(storage)
+
+
+@pytest.mark.parametrize('open_storage', ['excel'], indirect=True)
+def test_sqlite_imports_the_excel_file(storage, open_storage):
+    storage.record_attendance('G1', 'A1', 'attend', '2025-10-05')
+    storage.update_payments('G2', 'B2', {MONTHS[2]: True})
+    storage.add_test_result('G2', 'B2', 'مراجعة', 9, 10)
+    storage.set_sessions('G1', [date(2025, 10, 8)])
+    storage.save(full=True)
+
+    imported = reopen(lambda: open_storage('sqlite'))
+    assert snapshot(imported) == snapshot(storage)
+    assert imported.calendar.rows() == storage.calendar.rows()
+
+    # التعديلات بعد الاستيراد في قاعدة البيانات فقط، وتبقى بعد فتحها من جديد
+    imported.record_attendance('G1', 'A1', 'unattend', '2025-10-05')
+    assert snapshot(reopen(lambda: open_storage('sqlite'))) == snapshot(imported)
+    assert student(storage, 'A1')['الحصص_الحاضرة'] == 1